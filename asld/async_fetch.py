@@ -0,0 +1,449 @@
+"""
+Asynchronous fetcher
+
+An asyncio event loop keeps many requests in flight from a single process,
+  while a small process pool handles the CPU-bound parsing.
+"""
+import asyncio
+
+from time import time
+from queue import Queue, Empty
+from threading import Thread
+from functools import partial
+from concurrent.futures import ProcessPoolExecutor
+
+import asld.graph
+from asld.graph import ASLDGraph, STREAM_CHUNK
+from asld.graph import RDF_ACCEPT, RDF_STREAM_ACCEPT, RDF_STREAM_FORMATS
+from asld.graph import SPARQL_ACCEPT, SPARQL_STREAM_ACCEPT, SPARQL_STREAM_FORMAT
+from asld.utils import http_pool
+from asld.utils.async_http import AsyncHTTPPool
+from asld.utils.async_timeout_pool import AsyncTimeOutPool
+from asld.utils.host_scheduler import HostScheduler
+from asld.utils.document_cache import DocumentCache
+from asld.utils.color_print import Color
+
+
+class AsyncFetchPool:
+    """
+    Fetches IRIs keeping up to `inflight` requests on the wire.
+
+    Requests are (IRI, index, SPARQL query) tuples (as for ASLDGraph.pure_loadB),
+      and batches are (requests, batch format) pairs (as for ASLDGraph.pure_loadB_batch).
+    Answers are ASLDGraph.RequestAnswers.
+    Requests are dispatched by a HostScheduler (lower index first within a host).
+
+    When streaming, line based answers (N-Triples documents and TSV SPARQL
+      results) are parsed as they arrive and sent as partial answers.
+    """
+
+    def __init__(self, inflight=200, parsers=2, timeout=15, stream=False):
+        self.inflight = inflight
+        self.timeout = timeout
+        self.stream = stream
+
+        # Parsing processes are forked before the loop thread exists
+        self.parsers = None
+        if parsers > 0:
+            self.parsers = ProcessPoolExecutor(parsers, initializer=AsyncTimeOutPool.ignoreSIGINT)
+            self.parsers.submit(int).result()
+
+        self.loop = asyncio.new_event_loop()
+        self.http = AsyncHTTPPool(http_pool.POOL_SIZE, http_pool.HOST_POOL_SIZES)
+        self.scheduler = HostScheduler()
+        self._active = 0
+        self._wakeup = None
+        self._answers = Queue()  # Partial answers and finished fetches
+        self._thread = Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def __str__(self):
+        return "AsyncFetchPool<inflight: %d>" % self.inflight
+
+
+    def map(self, requests, batches=()):
+        """
+        Fetches lists of requests and batches, yielding answers as they complete
+        (streamed requests yield their partial answers first)
+        """
+        self.submit(requests, batches)
+
+        pending = len(requests) + sum(len(reqs) for (reqs, _) in batches)
+        while pending:
+            for reqAns in self.poll():
+                if not reqAns.partial:
+                    pending -= 1
+                yield reqAns
+
+    def submit(self, requests, batches=()):
+        """Starts fetching requests and batches, their answers are taken with poll"""
+        fetch = partial(self._fetch, emit=self._answers.put) if self.stream else self._fetch
+        for req in requests:
+            (iri, i, _) = req
+            f = self._submit(fetch, req, ASLDGraph.request_host(iri), i)
+            f.add_done_callback(partial(AsyncFetchPool._finished, self._answers.put, [req]))
+        for batch in batches:
+            (iri, i, _) = batch[0][0]
+            f = self._submit(self._fetch_batch, batch, ASLDGraph.request_host(iri), i)
+            f.add_done_callback(partial(AsyncFetchPool._finished, self._answers.put, batch[0]))
+
+    def poll(self, timeout=None):
+        """
+        Takes the answers available (partial ones included), waiting up to timeout
+          for the first one (or until it arrives, if None).
+        Failed fetches get empty answers.
+        """
+        answers = []
+        try:
+            item = self._answers.get(timeout is None  or  timeout > 0, timeout)
+            while True:
+                answers.extend(AsyncFetchPool._unwrap(item))
+                item = self._answers.get_nowait()
+        except Empty:
+            pass
+        return answers
+
+    @classmethod
+    def _finished(cls, put, reqs, f):
+        put((reqs, f))
+
+    @classmethod
+    def _unwrap(cls, item):
+        """Answers on a partial answer or a finished fetch"""
+        if isinstance(item, ASLDGraph.RequestAnswer):
+            return [item]
+
+        (reqs, f) = item
+        # pylint: disable=broad-except
+        try:
+            answer = f.result()
+            return answer if isinstance(answer, list) else [answer]
+        except Exception as e:
+            Color.RED.print("\nA fetch terminated on: (%s) %s" % (type(e), e))
+            return [ASLDGraph.RequestAnswer(b"", 0, iri, i, 0) for (iri, i, _) in reqs]
+
+    def close(self):
+        """Stops the loop and the parsing processes"""
+        self.loop.call_soon_threadsafe(self.http.close)
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+        self.loop.close()
+        if self.parsers is not None:
+            self.parsers.shutdown()
+
+
+    async def _parse(self, fun, *args):
+        """Runs a parsing function on the parsing processes"""
+        return await self.loop.run_in_executor(self.parsers, fun, *args)
+
+    def _submit(self, fetch, req, host, priority):
+        """Queues a fetch on the scheduler, returns a future for its answer"""
+        return asyncio.run_coroutine_threadsafe(self._schedule(fetch, req, host, priority),
+                                                self.loop)
+
+    async def _schedule(self, fetch, req, host, priority):
+        answer = self.loop.create_future()
+        self.scheduler.push(host, priority, (fetch, req, answer))
+        self._dispatch()
+        return await answer
+
+    def _dispatch(self):
+        """Starts as many scheduled requests as the limits allow"""
+        if self._wakeup is not None:
+            self._wakeup.cancel()
+            self._wakeup = None
+        while self._active < self.inflight:
+            nxt = self.scheduler.pop()
+            if nxt is None:
+                break
+            (host, (fetch, req, answer)) = nxt
+
+            self._active += 1
+            task = self.loop.create_task(fetch(req))
+            task.add_done_callback(partial(self._done, host, answer))
+
+        # Come back when a rate limited host gets a token
+        wait = self.scheduler.wait_time()
+        if wait is not None  and  self._active < self.inflight:
+            self._wakeup = self.loop.call_later(wait, self._dispatch)
+
+    def _done(self, host, answer, task):
+        self._active -= 1
+        self.scheduler.done(host)
+
+        if task.cancelled():
+            answer.cancel()
+        elif task.exception() is not None:
+            answer.set_exception(task.exception())
+        else:
+            answer.set_result(task.result())
+        self._dispatch()
+
+    async def _fetch(self, iri__i__qf, emit=None):
+        """
+        Async counterpart of ASLDGraph.pure_loadB
+        Partial answers are given to emit (if streaming)
+        """
+        (iri, i, queryString) = iri__i__qf
+
+        if ASLDGraph.replays():
+            reqAns = ASLDGraph.replay(iri__i__qf)
+            await asyncio.sleep(reqAns.reqTime)
+            return reqAns
+
+        _t0 = time()
+        # Streaming would hand out triples before the simulated delay
+        emitted = []  # Sizes of the chunks sent
+        if emit is not None  and  not ASLDGraph.simulates_delay(iri):
+            emit = partial(AsyncFetchPool._emit, emit, emitted, iri, i, _t0)
+        else:
+            emit = None
+
+        (data, size, cached) = await self._load_SPARQL(iri, queryString, emit)
+
+        # Get the document if SPARQL failed
+        if size == 0:
+            (data, size, cached) = await self._load_document(iri, emit)
+
+        # Simulate network delays
+        if not cached  and  ASLDGraph.simulates_delay(iri):
+            wait_time = ASLDGraph.delay_time(_t0)
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+
+        # Streamed answers were already sent by chunks, but are recorded whole
+        reqAns = ASLDGraph.RequestAnswer(b"" if emitted else data, size, iri, i,
+                                         time()-_t0, cached)
+        ASLDGraph.record(iri__i__qf, reqAns, data)
+        return reqAns
+
+    async def _fetch_batch(self, requests__bf):
+        """Async counterpart of ASLDGraph.pure_loadB_batch"""
+        (requests, batchFormat) = requests__bf
+
+        if ASLDGraph.replays():
+            # The batch takes as long as its slowest request
+            answers = [ASLDGraph.replay(r) for r in requests]
+            t = max(reqAns.reqTime for reqAns in answers)
+            await asyncio.sleep(t)
+            for reqAns in answers:
+                reqAns.reqTime = t
+            return answers
+
+        _t0 = time()
+        answers = await self._load_SPARQL_batch(requests, batchFormat)
+
+        loaded = []
+        delayed = False
+        for (iri, i, _) in requests:
+            (data, size, cached) = answers.get(str(iri), (b"", 0, False))
+
+            # Get the document if SPARQL failed
+            if size == 0:
+                (data, size, cached) = await self._load_document(iri)
+
+            delayed = delayed  or  (not cached  and  ASLDGraph.simulates_delay(iri))
+            loaded.append((data, size, iri, i, cached))
+
+        # Simulate a single network delay for the batch
+        if delayed:
+            wait_time = ASLDGraph.delay_time(_t0)
+            if wait_time > 0:
+                await asyncio.sleep(wait_time)
+
+        t = time()-_t0
+        answers = [ASLDGraph.RequestAnswer(data, size, iri, i, t, cached)
+                   for (data, size, iri, i, cached) in loaded]
+        for (req, reqAns) in zip(requests, answers):
+            ASLDGraph.record(req, reqAns)
+        return answers
+
+
+    @classmethod
+    def _emit(cls, emit, emitted, iri, i, _t0, data, size):
+        """Sends a chunk of a streamed request"""
+        # pylint: disable=too-many-arguments
+        emitted.append(size)
+        emit(ASLDGraph.RequestAnswer(data, size, iri, i, time()-_t0, partial=True))
+
+    async def _stream(self, res, emit, fun, *args, head=False):
+        """
+        Parses a line based body by chunks (of about STREAM_CHUNK bytes) as it arrives,
+          emitting the (packed graph, size) of each one.
+        Chunks are parsed with fun(lines, [header row,] *args).
+
+        Returns a (packed chunks, size, complete) triple (loaders join the chunks).
+        Bodies that break after a chunk was emitted are not complete.
+        """
+        # pylint: disable=too-many-arguments
+        chunks = []
+        size = 0
+        buf = bytearray()
+        body = res.chunks()
+        while True:
+            # pylint: disable=broad-except
+            try:
+                try:
+                    chunk = await asyncio.wait_for(body.__anext__(), self.timeout)
+                except StopAsyncIteration:
+                    chunk = None
+
+                if chunk is not None:
+                    buf += chunk
+                    if head:
+                        # Wait for the header row
+                        nl = buf.find(b"\n")
+                        if nl < 0:
+                            continue
+                        args = (bytes(buf[:nl]),) + args
+                        del buf[:nl+1]
+                        head = False
+                    if len(buf) < STREAM_CHUNK:
+                        continue
+                    cut = buf.rfind(b"\n") + 1
+                else:
+                    cut = 0 if head else len(buf)
+
+                if cut:
+                    lines = bytes(buf[:cut])
+                    del buf[:cut]
+                    (data, n) = await self._parse(fun, lines, *args)
+                    if n:
+                        emit(data, n)
+                        chunks.append(data)
+                        size += n
+
+                if chunk is None:
+                    return (chunks, size, True)
+
+            except Exception as e:
+                if not chunks:
+                    raise
+                res.close()
+                Color.RED.print("Streaming '%s' failed '%s'" % (res.url, e))
+                return (chunks, size, False)
+
+    async def _load_SPARQL(self, iri, queryString, emit=None):
+        endpoint = ASLDGraph.SPARQL_endpoint(iri)
+        if endpoint is None:
+            return (b"", 0, False)
+
+        key = DocumentCache.key(iri, queryString, endpoint)
+        (data, _) = ASLDGraph.cached_entry(key)
+        if data is not None:
+            return (data, ASLDGraph.packed_len(data), True)
+
+        accept = SPARQL_ACCEPT if emit is None else SPARQL_STREAM_ACCEPT
+        (method, url, headers, body) = ASLDGraph.SPARQL_request(endpoint, queryString, accept)
+        for _ in range(2):  # Try twice before failing
+            # pylint: disable=broad-except
+            try:
+                res = await asyncio.wait_for(self.http.open(method, url, headers, body),
+                                             self.timeout)
+
+                if res.status != 200:
+                    res.close()
+                    raise ConnectionError("HTTP %d" % res.status)
+
+                if emit is not None  and  res.content_type() == SPARQL_STREAM_FORMAT:
+                    (chunks, size, complete) = await self._stream(
+                        res, emit, ASLDGraph.pure_pack_SPARQL_tsv, endpoint, head=True)
+                    data = await self._parse(ASLDGraph.pure_join_packed, chunks)
+                    cache = data if complete else None
+                else:
+                    resBody = await asyncio.wait_for(res.read(), self.timeout)
+                    (data, size) = await self._parse(ASLDGraph.pure_pack_SPARQL, resBody)
+                    cache = data
+
+                if asld.graph.DOCUMENT_CACHE is not None  and  cache is not None:
+                    asld.graph.DOCUMENT_CACHE.put(key, cache, iri, endpoint)
+                return (data, size, False)
+
+            except Exception as e:
+                Color.RED.print("SPARQL Query failed '%s'" % e)
+
+        Color.YELLOW.print("The server's SPARQL endpoint (%s) is unavailable" % endpoint)
+        return (b"", 0, False)
+
+    async def _load_SPARQL_batch(self, requests, batchFormat):
+        endpoint = ASLDGraph.SPARQL_endpoint(requests[0][0])
+
+        answers = {}
+        missed = []
+        for (iri, _, queryString) in requests:
+            key = DocumentCache.key(iri, queryString, endpoint)
+            (data, _) = ASLDGraph.cached_entry(key)
+            if data is not None:
+                answers[str(iri)] = (data, ASLDGraph.packed_len(data), True)
+            else:
+                missed.append((iri, key))
+
+        if not missed:
+            return answers
+
+        iris = [iri for (iri, _) in missed]
+        queryString = ASLDGraph.SPARQL_batch_query(batchFormat, iris)
+        (method, url, headers, body) = ASLDGraph.SPARQL_request(endpoint, queryString)
+        for _ in range(2):  # Try twice before failing
+            # pylint: disable=broad-except
+            try:
+                res = await asyncio.wait_for(self.http.request(method, url, headers, body),
+                                             self.timeout)
+                if res.status != 200:
+                    raise ConnectionError("HTTP %d" % res.status)
+
+                packed = await self._parse(ASLDGraph.pure_pack_split_SPARQL, res.body, iris)
+                for (iri, key) in missed:
+                    (data, size) = packed[str(iri)]
+                    answers[str(iri)] = (data, size, False)
+                    if asld.graph.DOCUMENT_CACHE is not None:
+                        asld.graph.DOCUMENT_CACHE.put(key, data, iri, endpoint)
+                return answers
+
+            except Exception as e:
+                Color.RED.print("Batched SPARQL Query failed '%s'" % e)
+
+        Color.YELLOW.print("The server's SPARQL endpoint (%s) is unavailable" % endpoint)
+        return answers
+
+    async def _load_document(self, iri, emit=None):
+        key = DocumentCache.key(iri)
+        (data, entry) = ASLDGraph.cached_entry(key)
+        if data is not None:
+            return (data, ASLDGraph.packed_len(data), True)
+
+        accept = RDF_ACCEPT if emit is None else RDF_STREAM_ACCEPT
+        headers = ASLDGraph.revalidation_headers(entry, accept)
+        for _ in range(2):
+            # pylint: disable=broad-except
+            try:
+                res = await asyncio.wait_for(self.http.open("GET", iri, headers),
+                                             self.timeout)
+
+                if res.status == 304  and  entry is not None:
+                    await res.read()
+                    asld.graph.DOCUMENT_CACHE.touch(key)
+                    return (entry.data, ASLDGraph.packed_len(entry.data), True)
+                if res.status != 200:
+                    res.close()
+                    continue
+
+                if emit is not None  and  res.content_type() in RDF_STREAM_FORMATS:
+                    (chunks, size, complete) = await self._stream(
+                        res, emit, ASLDGraph.pure_pack_lines, res.url)
+                    data = await self._parse(ASLDGraph.pure_join_packed, chunks)
+                    cache = data if complete else None
+                else:
+                    body = await asyncio.wait_for(res.read(), self.timeout)
+                    (data, size) = await self._parse(ASLDGraph.pure_pack_document,
+                                                     body, res.content_type(), res.url)
+                    cache = data
+
+                if asld.graph.DOCUMENT_CACHE is not None  and  cache is not None:
+                    asld.graph.DOCUMENT_CACHE.put(key, cache, iri,
+                                                  etag=res.headers.get("etag"),
+                                                  modified=res.headers.get("last-modified"))
+                return (data, size, False)
+            except Exception:
+                pass
+        return (b"", 0, False)
@@ -1,17 +1,29 @@
 """
 Wrapper over `rdflib` Graph with support for SPARQL
 """
+import zlib
+
+from io import BytesIO
+from enum import Enum
+from hashlib import sha1
 from time import time, sleep
 from re import compile as regex_compile
-from json import load as json_load
+from json import load as json_load, loads as json_loads
 from bisect import bisect_right
 from random import randint
+from urllib.parse import urlencode, urlsplit
 
 from rdflib import Graph
-from rdflib.term import URIRef
-from SPARQLWrapper import SPARQLWrapper, JSON
+from rdflib.term import URIRef, Literal, BNode
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser, NTGraphSink
 
+from asld.query.state import State
+from asld.query.transition import Direction
 from asld.utils.color_print import Color
+from asld.utils.document_cache import DocumentCache
+from asld.utils.request_archive import RequestArchive, ArchiveMode, ReplayLatency
+from asld.utils.triple_store import TripleStore
+from asld.utils.http_pool import shared_pool
 
 
 # Known SPARQL endpoint that provide incomplete inverses (unnecessary if documents are complete).
@@ -46,6 +58,131 @@ else:
                                                                                DELAY_MAX))
 
 
+# Document dereferencing
+RDF_ACCEPT = ", ".join(["application/rdf+xml",
+                        "text/turtle;q=0.9",
+                        "application/n-triples;q=0.8",
+                        "text/n3;q=0.7",
+                        "application/ld+json;q=0.5"])
+RDF_FORMATS = {
+    "application/rdf+xml":   "xml",
+    "application/xml":       "xml",
+    "text/xml":              "xml",
+    "text/turtle":           "turtle",
+    "application/x-turtle":  "turtle",
+    "application/n-triples": "nt",
+    "text/plain":            "nt",
+    "text/n3":               "n3",
+    "application/ld+json":   "json-ld",
+}
+
+# SPARQL requests (longer queries are POSTed)
+SPARQL_ACCEPT = "application/sparql-results+json"
+SPARQL_GET_LIMIT = 2000
+
+# Streamed answers (line based formats are parsed as they arrive)
+RDF_STREAM_ACCEPT = ", ".join(["application/n-triples",
+                               "text/plain;q=0.9",
+                               "application/rdf+xml;q=0.8",
+                               "text/turtle;q=0.7",
+                               "application/ld+json;q=0.5"])
+RDF_STREAM_FORMATS = ("application/n-triples", "text/plain")
+SPARQL_STREAM_ACCEPT = "text/tab-separated-values, application/sparql-results+json;q=0.9"
+SPARQL_STREAM_FORMAT = "text/tab-separated-values"
+STREAM_CHUNK = 1 << 18  # Bytes parsed (and delivered) at once
+
+XSD = "http://www.w3.org/2001/XMLSchema#"
+TSV_NUMBER = regex_compile(r"^[+-]?(\d+|\d*\.\d+)([eE][+-]?\d+)?$")
+
+# Persistent cache (set up before forking the workers)
+DOCUMENT_CACHE = None
+REQUEST_ARCHIVE = None
+
+
+class Backend(Enum):
+    """
+    Sets up where triples are stored
+    """
+    RDFLib = 0  # rdflib in-memory Graph
+    Native = 1  # Dictionary-encoded TripleStore
+
+    @classmethod
+    def parse(cls, backend: str):
+        """
+        String -> Backend enum
+        """
+        backend = backend.lower()
+
+        if "native".startswith(backend):
+            return Backend.Native
+        return Backend.RDFLib
+
+    @classmethod
+    def to_string(cls, backend):
+        """ Backend enum -> string """
+        if backend == Backend.Native:
+            return "Native"
+        return "RDFLib"
+
+
+class _StableBNodes(dict):
+    """
+    Blank node context for N-Triples parsers, so labels get the same BNode on
+      every parse (rdflib makes up new BNodes per parse).
+    Labels are kept, or hashed along a document name (for parsing it by chunks).
+    """
+
+    def __init__(self, doc=None):
+        super().__init__()
+        self.doc = doc
+
+    def get(self, label, default=None):
+        if self.doc is None:
+            return label
+        return sha1(("%s %s" % (self.doc, label)).encode("utf-8")).hexdigest()
+
+
+class Chunk:
+    """
+    Triples of a streamed answer's chunk, as they were added to a graph
+    Parser sink (add) forwarding to a store, with the neighbors lookup of ASLDGraph
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self.triples = []
+
+    def __len__(self):
+        return len(self.triples)
+
+    def add(self, spo):
+        """Adds a triple to the store, keeping it on the chunk"""
+        self.store.add(spo)
+        self.triples.append(spo)
+
+    def neighbors(self, node, predicates=None, direction=Direction.forward):
+        """Yields the (P, neighbor) pairs of a node on the chunk (see ASLDGraph.neighbors)"""
+        forward = direction == Direction.forward
+        for (S, P, O) in self.triples:
+            if (S if forward else O) == node  and  (predicates is None  or  P in predicates):
+                yield (P, O if forward else S)
+
+
+class _Dump:
+    """Parser sink adding triples to a store, writing the new ones out (see ASLDGraph.dumpTo)"""
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, store, out):
+        self.store = store
+        self.out = out
+
+    def add(self, spo):
+        """Adds a triple to the store, writing it if it was new"""
+        if spo not in self.store:
+            self.store.add(spo)
+            self.out.write(spo)
+
+
 class ASLDGraph:
     """
     RDF Graph
@@ -57,17 +194,32 @@ class ASLDGraph:
         """
         Answer for a iri request
         Acts as a named tuple
+
+        Triples travel packed (see ASLDGraph.pack), as rebuilding a pickled
+          rdflib Graph costs the parent more than parsing N-Triples.
+
+        Streamed requests send partial answers (holding a chunk of triples)
+          before the last one. The last answer holds the triples not sent yet
+          and its size counts every triple of the request.
         """
         # pylint: disable=too-few-public-methods
 
-        def __init__(self, g, iri, index, reqTime):
-            self.g = g
+        def __init__(self, data, size, iri, index, reqTime, cached=False, partial=False):
+            # pylint: disable=too-many-arguments
+            self.data = data
+            self.size = size
             self.iri = iri
             self.index = index
             self.reqTime = reqTime
+            self.cached = cached
+            self.partial = partial
 
         def __len__(self):
-            return len(self.g)
+            return self.size
+
+        def graph(self) -> Graph:
+            """Unpacks the answer"""
+            return ASLDGraph.unpack(self.data)
 
         def __str__(self):
             return "RequestAnswer<%s>" % self.iri
@@ -79,65 +231,496 @@ class ASLDGraph:
         print("%80s (%-40s) %50s" % (Color.RED(s), Color.GREEN(p), Color.YELLOW(o)))
 
     @classmethod
-    def pure_load_SPARQL(cls, iri, queryString: str) -> Graph:
+    def use_cache(cls, cache: DocumentCache):
         """
-        Expands using SPARQL query against a known endpoint.
+        Sets up the persistent cache used by the (blocking) loaders.
+        Must be called before the worker pool is created.
         """
-        g = Graph()
+        # pylint: disable=global-statement
+        global DOCUMENT_CACHE
+        DOCUMENT_CACHE = cache
+
+    @classmethod
+    def use_archive(cls, archive: RequestArchive):
+        """
+        Sets up the archive requests are recorded to (or replayed from).
+        Must be called before the worker pool is created.
+        """
+        # pylint: disable=global-statement
+        global REQUEST_ARCHIVE
+        REQUEST_ARCHIVE = archive
+
+    @classmethod
+    def replays(cls) -> bool:
+        """Checks if answers come from a request archive (instead of the network)"""
+        return REQUEST_ARCHIVE is not None  and  REQUEST_ARCHIVE.mode == ArchiveMode.Replay
+
+    @classmethod
+    def replay(cls, iri__i__qf):
+        """
+        Answers a request from the archive (requests missing from it get empty answers).
+
+        Returns a RequestAnswer whose reqTime is the latency still to be waited
+        """
+        (iri, i, queryString) = iri__i__qf
+
+        record = REQUEST_ARCHIVE.get(iri, queryString)
+        if record is None:
+            return ASLDGraph.RequestAnswer(b"", 0, iri, i, 0)
+
+        (data, size, latency) = record
+        if REQUEST_ARCHIVE.latency == ReplayLatency.Zero:
+            latency = 0
+        elif latency is None  or  REQUEST_ARCHIVE.latency == ReplayLatency.Modeled:
+            latency = ASLDGraph.sample_delay()
+        return ASLDGraph.RequestAnswer(data, size, iri, i, latency)
+
+    @classmethod
+    def record(cls, iri__i__qf, reqAns, data=None):
+        """
+        Stores an answer on the archive (if recording)
+        data, if given, is the whole answer (streamed answers were sent by chunks)
+        """
+        if REQUEST_ARCHIVE is None  or  REQUEST_ARCHIVE.mode != ArchiveMode.Record:
+            return
+        (iri, _, queryString) = iri__i__qf
+        if data is None:
+            data = reqAns.data
+        REQUEST_ARCHIVE.put(iri, queryString, data, reqAns.size,
+                            None if reqAns.cached else reqAns.reqTime)
+
+    @classmethod
+    def pack(cls, g: Graph) -> bytes:
+        """
+        Compact representation of a graph (compressed N-Triples, one triple per line)
+        Empty graphs are packed as b""
+        """
+        if len(g) == 0:
+            return b""
+        return zlib.compress(g.serialize(format="nt", encoding="utf-8"))
+
+    @classmethod
+    def packed_len(cls, data: bytes) -> int:
+        """Number of triples in a packed graph"""
+        if not data:
+            return 0
+        return zlib.decompress(data).count(b"\n")
+
+    @classmethod
+    def pure_join_packed(cls, chunks) -> bytes:
+        """Packs many packed graphs as one"""
+        chunks = [zlib.decompress(data) for data in chunks if data]
+        if not chunks:
+            return b""
+        return zlib.compress(b"".join(chunks))
+
+    @classmethod
+    def unpack(cls, data: bytes, g=None) -> Graph:
+        """Rebuilds a packed graph (into g if given)"""
+        if g is None:
+            g = Graph()
+        if data:
+            W3CNTriplesParser(NTGraphSink(g)).parse(BytesIO(zlib.decompress(data)),
+                                                    bnode_context=_StableBNodes())
+        return g
+
+    @classmethod
+    def rdf_format(cls, contentType: str) -> str:
+        """Picks an rdflib parser for a Content-Type"""
+        return RDF_FORMATS.get(contentType, "xml")
+
+    @classmethod
+    def SPARQL_term(cls, binding: dict):
+        """Builds an RDF term from a SPARQL JSON result binding"""
+        kind = binding["type"]
+        if kind == "uri":
+            return URIRef(binding["value"])
+        if kind == "bnode":
+            return BNode(binding["value"])
+        return Literal(binding["value"],
+                       lang=binding.get("xml:lang"),
+                       datatype=binding.get("datatype"))
+
+    @classmethod
+    def SPARQL_tsv_term(cls, term: str) -> str:
+        """
+        N-Triples form of a term from SPARQL TSV results
+        Returns "" for unbound variables (and unsupported Turtle shorthands)
+        """
+        if not term  or  term[0] in "<\"_":
+            return term
+        if term in ("true", "false"):
+            return "\"%s\"^^<%sboolean>" % (term, XSD)
+
+        m = TSV_NUMBER.match(term)
+        if m is None:
+            return ""
+        if m.group(2):
+            return "\"%s\"^^<%sdouble>" % (term, XSD)
+        if "." in term:
+            return "\"%s\"^^<%sdecimal>" % (term, XSD)
+        return "\"%s\"^^<%sinteger>" % (term, XSD)
+
+    @classmethod
+    def SPARQL_endpoint(cls, iri):
+        """Returns the known SPARQL endpoint for an IRI (or None)"""
         for r, endpoint in SPARQL_ENDPOINTS:
             if r.match(iri):
-                se = SPARQLWrapper(endpoint)
-                se.setQuery(queryString)
-                se.setReturnFormat(JSON)
-
-                for _ in range(2):  # Try twice before failing
-                    # pylint: disable=broad-except
-
-                    try:
-                        results = se.query().convert()
-                        results = results["results"]["bindings"]
-
-                        for result in results:
-                            # pylint: disable=bare-except
-                            try:
-                                S = URIRef(result["s"]["value"])
-                                P = URIRef(result["p"]["value"])
-                                O =       (result["o"]["value"])
-                                if O.startswith("http"):
-                                    O = URIRef(O)
-                                g.add((S, P, O))
-                            except:
-                                pass
-                        return g
-
-                    except Exception as e:
-                        Color.RED.print("SPARQL Query failed '%s'" % e)
-
-                #pylint: disable=line-too-long
-                Color.RED.print("SPARQL Request '%s%s" % (Color.GREEN(queryString), Color.RED("' failed")))
-                Color.YELLOW.print("The server's SPARQL endpoint (%s) is unavailable" % endpoint)
+                return endpoint
+        return None
+
+    @classmethod
+    def request_host(cls, iri) -> str:
+        """
+        Server that will answer a request for an IRI
+        (its SPARQL endpoint if known, its host otherwise)
+        """
+        endpoint = ASLDGraph.SPARQL_endpoint(iri)
+        if endpoint is not None:
+            return endpoint
+        return urlsplit(iri).netloc
+
+    @classmethod
+    def cached_entry(cls, key):
+        """
+        Returns a (packed graph, entry) pair from the persistent cache.
+        The packed graph is only given for fresh entries, stale entries may be revalidated.
+        """
+        if DOCUMENT_CACHE is None:
+            return (None, None)
+
+        entry = DOCUMENT_CACHE.get(key)
+        if entry is not None  and  entry.isFresh(DOCUMENT_CACHE.ttl):
+            return (entry.data, entry)
+        return (None, entry)
+
+    @classmethod
+    def cached_answer(cls, iri, queryString: str):
+        """
+        Looks an expansion up on the persistent cache (its SPARQL answer, then
+          its document) regardless of freshness.
+
+        Returns a (packed graph, size) pair, or None if nothing was stored
+        """
+        if DOCUMENT_CACHE is None:
+            return None
+
+        entry = None
+        endpoint = ASLDGraph.SPARQL_endpoint(iri)
+        if endpoint is not None:
+            entry = DOCUMENT_CACHE.get(DocumentCache.key(iri, queryString, endpoint))
+            size = 0 if entry is None else ASLDGraph.packed_len(entry.data)
+            if size > 0:
+                return (entry.data, size)
+
+        document = DOCUMENT_CACHE.get(DocumentCache.key(iri))
+        if document is not None:
+            return (document.data, ASLDGraph.packed_len(document.data))
+        if entry is not None:
+            return (b"", 0)
+        return None
+
+    @classmethod
+    def revalidation_headers(cls, entry, accept=RDF_ACCEPT) -> dict:
+        """Headers for a (conditional) document request"""
+        headers = {"Accept": accept}
+        if entry is not None:
+            if entry.etag:
+                headers["If-None-Match"] = entry.etag
+            if entry.modified:
+                headers["If-Modified-Since"] = entry.modified
+        return headers
+
+    @classmethod
+    def SPARQL_request(cls, endpoint, queryString: str, accept=SPARQL_ACCEPT):
+        """Returns the (method, url, headers, body) of a SPARQL request"""
+        query = urlencode({"query": queryString})
+        headers = {"Accept": accept}
+
+        if len(query) <= SPARQL_GET_LIMIT:
+            return ("GET", "%s?%s" % (endpoint, query), headers, None)
+
+        headers["Content-Type"] = "application/x-www-form-urlencoded"
+        return ("POST", endpoint, headers, query.encode("utf-8"))
+
+    @classmethod
+    def pure_parse_SPARQL(cls, results, g=None) -> Graph:
+        """Builds a graph from the (s, p, o) bindings of SPARQL JSON results (or its text)"""
+        if g is None:
+            g = Graph()
+        if isinstance(results, (bytes, str)):
+            results = json_loads(results)
+
+        for result in results["results"]["bindings"]:
+            # pylint: disable=bare-except
+            try:
+                S = ASLDGraph.SPARQL_term(result["s"])
+                P = ASLDGraph.SPARQL_term(result["p"])
+                O = ASLDGraph.SPARQL_term(result["o"])
+                g.add((S, P, O))
+            except:
+                pass
         return g
 
     @classmethod
-    def delay(cls, _t0):
+    def SPARQL_batch_query(cls, batchFormat: str, iris) -> str:
+        """Fills a batched query format (see State.SPARQL_batch_format)"""
+        return batchFormat.replace("$IRIS", " ".join(["<%s>" % iri for iri in iris]))
+
+    @classmethod
+    def pure_split_SPARQL(cls, results, iris) -> dict:
         """
-        Samples a lower bound on request time and enforces it
+        Splits batched SPARQL JSON results (or its text) by the expanded IRI (?x)
+        Returns a str(IRI) -> Graph dict
+        """
+        if isinstance(results, (bytes, str)):
+            results = json_loads(results)
+
+        graphs = {str(iri): Graph() for iri in iris}
+        for result in results["results"]["bindings"]:
+            # pylint: disable=bare-except
+            try:
+                g = graphs.get(result["x"]["value"])
+                if g is None:
+                    continue
+                S = ASLDGraph.SPARQL_term(result["s"])
+                P = ASLDGraph.SPARQL_term(result["p"])
+                O = ASLDGraph.SPARQL_term(result["o"])
+                g.add((S, P, O))
+            except:
+                pass
+        return graphs
+
+    @classmethod
+    def pure_parse_document(cls, body: bytes, contentType: str, url: str, g=None) -> Graph:
+        """Parses a dereferenced document"""
+        if g is None:
+            g = Graph()
+        g.parse(data=body, format=ASLDGraph.rdf_format(contentType), publicID=url)
+        return g
+
+    @classmethod
+    def pure_pack_SPARQL(cls, results) -> tuple:
+        """Parses SPARQL JSON results into a (packed graph, size) pair"""
+        g = ASLDGraph.pure_parse_SPARQL(results)
+        return (ASLDGraph.pack(g), len(g))
+
+    @classmethod
+    def pure_pack_split_SPARQL(cls, results, iris) -> dict:
+        """Splits batched SPARQL JSON results into a str(IRI) -> (packed graph, size) dict"""
+        graphs = ASLDGraph.pure_split_SPARQL(results, iris)
+        return {iri: (ASLDGraph.pack(g), len(g)) for (iri, g) in graphs.items()}
+
+    @classmethod
+    def pure_pack_document(cls, body: bytes, contentType: str, url: str) -> tuple:
+        """Parses a dereferenced document into a (packed graph, size) pair"""
+        g = ASLDGraph.pure_parse_document(body, contentType, url)
+        return (ASLDGraph.pack(g), len(g))
+
+    @classmethod
+    def pure_pack_lines(cls, body: bytes, url: str) -> tuple:
+        """Parses a chunk of complete N-Triples lines into a (packed graph, size) pair"""
+        g = Graph()
+        W3CNTriplesParser(NTGraphSink(g)).parse(BytesIO(body), bnode_context=_StableBNodes(url))
+        return (ASLDGraph.pack(g), len(g))
+
+    @classmethod
+    def pure_pack_SPARQL_tsv(cls, body: bytes, head: bytes, endpoint: str) -> tuple:
+        """
+        Parses a chunk of complete SPARQL TSV result rows into a (packed graph, size) pair
+        head is the header row, naming the columns
+        """
+        columns = [c.strip().lstrip("?") for c in head.decode("utf-8").split("\t")]
+        spo = [columns.index(v) for v in ("s", "p", "o")]
+
+        g = Graph()
+        parser = W3CNTriplesParser(NTGraphSink(g))
+        bnodes = _StableBNodes(endpoint)
+        for line in body.decode("utf-8").split("\n"):
+            row = line.rstrip("\r").split("\t")
+            if len(row) < len(columns):
+                continue
+
+            terms = [ASLDGraph.SPARQL_tsv_term(row[c]) for c in spo]
+            if not all(terms):
+                continue
+            # pylint: disable=bare-except
+            try:
+                parser.parsestring("%s %s %s .\n" % tuple(terms), bnode_context=bnodes)
+            except:
+                pass
+        return (ASLDGraph.pack(g), len(g))
+
+    @classmethod
+    def pure_load_SPARQL(cls, iri, queryString: str):
+        """
+        Expands using SPARQL query against a known endpoint.
+
+        Returns a (packed graph, size, cached) triple
+        """
+        endpoint = ASLDGraph.SPARQL_endpoint(iri)
+        if endpoint is None:
+            return (b"", 0, False)
+
+        key = DocumentCache.key(iri, queryString, endpoint)
+        (data, _) = ASLDGraph.cached_entry(key)
+        if data is not None:
+            return (data, ASLDGraph.packed_len(data), True)
+
+        (method, url, headers, body) = ASLDGraph.SPARQL_request(endpoint, queryString)
+        for _ in range(2):  # Try twice before failing
+            # pylint: disable=broad-except
+
+            try:
+                res = shared_pool().request(method, url, headers, body)
+                if res.status != 200:
+                    raise ConnectionError("HTTP %d" % res.status)
+
+                (data, size) = ASLDGraph.pure_pack_SPARQL(res.body)
+
+                if DOCUMENT_CACHE is not None:
+                    DOCUMENT_CACHE.put(key, data, iri, endpoint)
+                return (data, size, False)
+
+            except Exception as e:
+                Color.RED.print("SPARQL Query failed '%s'" % e)
+
+        #pylint: disable=line-too-long
+        Color.RED.print("SPARQL Request '%s%s" % (Color.GREEN(queryString), Color.RED("' failed")))
+        Color.YELLOW.print("The server's SPARQL endpoint (%s) is unavailable" % endpoint)
+        return (b"", 0, False)
+
+    @classmethod
+    def pure_load_SPARQL_batch(cls, requests, batchFormat: str) -> dict:
+        """
+        Expands many IRIs (sharing endpoint and State) with a single SPARQL query.
+        Answers are cached as if they were requested one by one.
+
+        Returns a str(IRI) -> (packed graph, size, cached) dict (failed IRIs are missing)
+        """
+        endpoint = ASLDGraph.SPARQL_endpoint(requests[0][0])
+
+        answers = {}
+        missed = []
+        for (iri, _, queryString) in requests:
+            key = DocumentCache.key(iri, queryString, endpoint)
+            (data, _) = ASLDGraph.cached_entry(key)
+            if data is not None:
+                answers[str(iri)] = (data, ASLDGraph.packed_len(data), True)
+            else:
+                missed.append((iri, key))
+
+        if not missed:
+            return answers
+
+        queryString = ASLDGraph.SPARQL_batch_query(batchFormat, [iri for (iri, _) in missed])
+        (method, url, headers, body) = ASLDGraph.SPARQL_request(endpoint, queryString)
+        for _ in range(2):  # Try twice before failing
+            # pylint: disable=broad-except
+
+            try:
+                res = shared_pool().request(method, url, headers, body)
+                if res.status != 200:
+                    raise ConnectionError("HTTP %d" % res.status)
+
+                packed = ASLDGraph.pure_pack_split_SPARQL(res.body, [iri for (iri, _) in missed])
+                for (iri, key) in missed:
+                    (data, size) = packed[str(iri)]
+                    answers[str(iri)] = (data, size, False)
+                    if DOCUMENT_CACHE is not None:
+                        DOCUMENT_CACHE.put(key, data, iri, endpoint)
+                return answers
+
+            except Exception as e:
+                Color.RED.print("Batched SPARQL Query failed '%s'" % e)
+
+        Color.YELLOW.print("The server's SPARQL endpoint (%s) is unavailable" % endpoint)
+        return answers
+
+    @classmethod
+    def pure_load_document(cls, iri):
+        """
+        Dereferences an IRI.
+        Stale cached documents are revalidated with a conditional request.
+
+        Returns a (packed graph, size, cached) triple
+        """
+        key = DocumentCache.key(iri)
+        (data, entry) = ASLDGraph.cached_entry(key)
+        if data is not None:
+            return (data, ASLDGraph.packed_len(data), True)
+
+        headers = ASLDGraph.revalidation_headers(entry)
+        for _ in range(2):
+            # pylint: disable=bare-except
+            try:
+                res = shared_pool().request("GET", iri, headers)
+
+                if res.status == 304  and  entry is not None:
+                    DOCUMENT_CACHE.touch(key)
+                    return (entry.data, ASLDGraph.packed_len(entry.data), True)
+                if res.status != 200:
+                    continue
+
+                (data, size) = ASLDGraph.pure_pack_document(res.body, res.content_type(), res.url)
+                if DOCUMENT_CACHE is not None:
+                    DOCUMENT_CACHE.put(key, data, iri,
+                                       etag=res.headers.get("etag"),
+                                       modified=res.headers.get("last-modified"))
+                return (data, size, False)
+            except:
+                pass
+        return (b"", 0, False)
+
+    @classmethod
+    def simulates_delay(cls, iri) -> bool:
+        """Checks if requests for an IRI get simulated network delays"""
+        if DELAYS:
+            for r in DELAY_IRI_REGEX:
+                if r.match(iri):
+                    return True
+        return False
+
+    @classmethod
+    def sample_delay(cls, rng=None) -> float:
+        """
+        Samples a lower bound on request time (0 without delay data)
+        rng is a random.Random, for reproducible samples
+        """
+        if DELAYS is None:
+            return 0
+
+        delay_simulated = (randint if rng is None else rng.randint)(0, DELAY_MAX)+1
+        return bisect_right(DELAYS, delay_simulated)*DELAY_RESOLUTION
+
+    @classmethod
+    def delay_time(cls, _t0) -> float:
+        """
+        Samples a lower bound on request time.
+        Returns the time still left to wait.
         """
 
         # pick sample
-        delay_simulated = randint(0, DELAY_MAX)+1
-        delay = bisect_right(DELAYS, delay_simulated)*DELAY_RESOLUTION
+        delay = ASLDGraph.sample_delay()
 
         spent_time = time() - _t0
         wait_time = delay - spent_time
 
+        if wait_time <= 0:
+            # no wait was needed
+            print("waiting %7.4fs < spent %7.4fs" % (delay, spent_time))
+        return wait_time
+
+    @classmethod
+    def delay(cls, _t0):
+        """
+        Samples a lower bound on request time and enforces it
+        """
+        wait_time = ASLDGraph.delay_time(_t0)
         if wait_time > 0:
             # wait
             # print("wating for %5.2fs (%5.2fs)" % (delay, wait_time))
             sleep(wait_time)
-        else:
-            # no wait was needed
-            print("waiting %7.4fs < spent %7.4fs" % (delay, spent_time))
 
     @classmethod
     def pure_loadB(cls, iri__i__qf):
@@ -151,48 +734,124 @@ class ASLDGraph:
         (iri, i, sparqlFormat) = iri__i__qf
         assert isinstance(iri, URIRef)
 
+        if ASLDGraph.replays():
+            reqAns = ASLDGraph.replay(iri__i__qf)
+            sleep(reqAns.reqTime)
+            return reqAns
+
         _t0 = time()
         # Get new triples
-        g = ASLDGraph.pure_load_SPARQL(iri, sparqlFormat)
+        (data, size, cached) = ASLDGraph.pure_load_SPARQL(iri, sparqlFormat)
 
         # Get the document if SPARQL failed
-        if len(g) == 0:
-            for _ in range(2):
-                # pylint: disable=bare-except
-                try:
-                    g.load(iri)
-                    break
-                except:
-                    pass
+        if size == 0:
+            (data, size, cached) = ASLDGraph.pure_load_document(iri)
 
         # Simulate network delays (there is no compensation on longer delays)
-        if DELAYS:
-            for r in DELAY_IRI_REGEX:
-                if r.match(iri):
-                    ASLDGraph.delay(_t0)
-                    break
+        if not cached  and  ASLDGraph.simulates_delay(iri):
+            ASLDGraph.delay(_t0)
 
 
-        return ASLDGraph.RequestAnswer(g, iri, i, time()-_t0)
+        reqAns = ASLDGraph.RequestAnswer(data, size, iri, i, time()-_t0, cached)
+        ASLDGraph.record(iri__i__qf, reqAns)
+        return reqAns
 
+    @classmethod
+    def pure_loadB_batch(cls, requests__bf):
+        """
+        Expands many IRIs with one batched SPARQL query (see pure_load_SPARQL_batch).
+        Without a batch format requests are expanded one by one.
+
+        Returns a list of RequestAnswers
+        """
+        # Unwrap parameters
+        (requests, batchFormat) = requests__bf
+        if batchFormat is None  or  len(requests) == 1:
+            return [ASLDGraph.pure_loadB(r) for r in requests]
+
+        if ASLDGraph.replays():
+            # The batch takes as long as its slowest request
+            answers = [ASLDGraph.replay(r) for r in requests]
+            t = max(reqAns.reqTime for reqAns in answers)
+            sleep(t)
+            for reqAns in answers:
+                reqAns.reqTime = t
+            return answers
+
+        _t0 = time()
+        answers = ASLDGraph.pure_load_SPARQL_batch(requests, batchFormat)
+
+        loaded = []
+        delayed = False
+        for (iri, i, _) in requests:
+            (data, size, cached) = answers.get(str(iri), (b"", 0, False))
+
+            # Get the document if SPARQL failed
+            if size == 0:
+                (data, size, cached) = ASLDGraph.pure_load_document(iri)
+
+            delayed = delayed  or  (not cached  and  ASLDGraph.simulates_delay(iri))
+            loaded.append((data, size, iri, i, cached))
+
+        # Simulate a single network delay for the batch
+        if delayed:
+            ASLDGraph.delay(_t0)
+
+        t = time()-_t0
+        answers = [ASLDGraph.RequestAnswer(data, size, iri, i, t, cached)
+                   for (data, size, iri, i, cached) in loaded]
+        for (req, reqAns) in zip(requests, answers):
+            ASLDGraph.record(req, reqAns)
+        return answers
 
 
-    def __init__(self):
-        self.g      = Graph()
-        self.loaded = set()
+
+    def __init__(self, backend=Backend.RDFLib):
+        self.backend = backend
+        self.g      = TripleStore() if backend == Backend.Native else Graph()
+        self.loaded = {}  # IRI -> States its request covered
         self.failed = set()
+        self.sink = self.g  # Where triples are added (the store, or a _Dump on it)
 
     def __len__(self):
         return len(self.g)
 
+    def dumpTo(self, out):
+        """
+        Writes the graph's triples to an NTriplesWriter, and the new ones as they
+          are added until the dump is stopped (out is None)
+        """
+        if out is None:
+            self.sink = self.g
+            return
+        out.writeAll(self.g)
+        self.sink = _Dump(self.g, out)
+
     def add(self, spo):
         """Add an RDF triple to the graph"""
-        self.g.add(spo)
+        self.sink.add(spo)
+
+    def addPacked(self, data: bytes):
+        """Adds a whole packed graph (see pack) in one call"""
+        ASLDGraph.unpack(data, self.sink)
+
+    def addChunk(self, data: bytes) -> Chunk:
+        """Adds a packed chunk of a streamed answer in one call, returns its triples"""
+        chunk = Chunk(self.sink)
+        ASLDGraph.unpack(data, chunk)
+        return chunk
+
+    def packAll(self) -> bytes:
+        """Packs the whole graph (see pack), on any backend"""
+        if len(self.g) == 0:
+            return b""
+        lines = ("%s %s %s .\n" % (s.n3(), p.n3(), o.n3()) for (s, p, o) in self.g)
+        return zlib.compress("".join(lines).encode("utf-8"))
 
 
     def loadB(self, iri: URIRef) -> bool:
         """
-        Loads resource data if needed
+        Loads resource data if needed (every triple on the IRI, see pure_loadB)
         """
         assert isinstance(iri, URIRef)
 
@@ -201,8 +860,13 @@ class ASLDGraph:
 
         # pylint: disable=broad-except
         try:
+            query = State.SPARQL_format(set(), set()).format("<%s>" % iri)
+            reqAns = ASLDGraph.pure_loadB((iri, 0, query))
+            if reqAns.size == 0:
+                raise ConnectionError("no triples")
+
             old = len(self.g)
-            self.g.load(iri)
+            self.addPacked(reqAns.data)
             incr = len(self.g)-old
 
             return (True, incr)
@@ -244,6 +908,24 @@ class ASLDGraph:
         for S,P,O in self.g.triples((s, p, o)):
             yield (S, P, O)
 
+    def neighbors(self, node, predicates=None, direction=Direction.forward):
+        """
+        Yields the (P, neighbor) pairs of a node in a direction.
+        Only the predicates on the set are looked up (every predicate if None).
+        """
+        if direction == Direction.forward:
+            patterns = [(node, p, None) for p in predicates] if predicates is not None \
+                       else [(node, None, None)]
+            for pattern in patterns:
+                for _,P,O in self.g.triples(pattern):
+                    yield (P, O)
+        else:
+            patterns = [(None, p, node) for p in predicates] if predicates is not None \
+                       else [(None, None, node)]
+            for pattern in patterns:
+                for S,P,_ in self.g.triples(pattern):
+                    yield (P, S)
+
     def queryB(self, s=None, p=None, o=None):
         """ Queries the graph after requesting s or o """
         if o is None:
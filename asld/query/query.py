@@ -24,6 +24,7 @@ class Query:
         self.states = {}
         self.startState = self.add_state(name, ff, af)
         self.startNode  = iri
+        self.w = 1  # Heuristic weight (set by QueryBuilder.build)
 
 
     def __str__(self) -> str:
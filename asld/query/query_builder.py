@@ -5,7 +5,7 @@ from rdflib.term import URIRef
 from asld.query.transition import Direction
 from asld.query.query import Query
 from asld.query.filter import Filter
-from asld.query.filter import NodeFilter, NodeFilter_any
+from asld.query.filter import NodeFilter, NodeFilter_any, NodeFilter_only
 from asld.query.filter import ArcFilter, ArcFilter_any, ArcFilter_whitelist, ArcFilter_blacklist
 
 from asld.utils.heap import Heap
@@ -187,4 +187,51 @@ class QueryBuilder:
         for s in states:
             s.prepare()
 
+        self.a.w = w
         return self.a
+
+    @classmethod
+    def reverse(cls, query: Query):
+        """
+        Builds the reversed automaton of a built Query: it searches from the goal
+          node back to the start node, through the transitions reversed.
+
+        The Query needs a single final State accepting a single node (e.g. with
+          NodeFilter_only), otherwise None is returned.
+
+        Returns a (Query, twin) pair, twin maps the States and Transitions of
+          each automaton to those of the other.
+        """
+        finals = [s for s in query.states.values() if s.isFinal()]
+        if len(finals) != 1:
+            return None
+        goals = finals[0].acceptingFunction.inverse()
+        if goals is None  or  len(goals) != 1:
+            return None
+        (goal,) = goals
+
+        def name(s):
+            return "%s^-1" % s.name
+
+        startAF = NodeFilter_only(query.startNode)
+        b = QueryBuilder(goal, name(finals[0]), finals[0].filterFunction,
+                         startAF if finals[0] is query.startState else None)
+        twin = {}
+        for s in query.states.values():
+            twin[s] = b.a.add_state(name(s), s.filterFunction,
+                                    startAF if s is query.startState else None)
+            twin[twin[s]] = s
+
+        for s in query.states.values():
+            for t in s.next_transitions_f | s.next_transitions_b:
+                rt = b.a.add_transition(name(t.dst), t.arc_filter, t.direction.reversed(),
+                                        name(t.src))
+                twin[t] = rt
+                twin[rt] = t
+
+        # pylint: disable=broad-except
+        try:
+            return (b.build(query.w), twin)
+        except Exception as e:
+            Color.RED.print("Couldn't reverse the query: %s" % e)
+            return None
@@ -12,6 +12,7 @@ class State:
     # pylint: disable=too-many-instance-attributes
 
     _fine_grained_sparql_queries = True
+    _merged_formats = {}  # frozenset(States) -> SPARQL format
 
     _explain_allowance          = False
     _explain_allowance_trivial  = False
@@ -55,6 +56,12 @@ class State:
         self.predicates_f = set()  # Predicates on Forward Transitions
         self.predicates_b = set()  # Predicates on Backward Transitions
 
+        # Local lookups
+        # -------------
+        # Predicates allowed by any outgoing transition (None if any predicate may be)
+        self.lookup_b = None
+        self.lookup_f = None
+
 
     def _prev(self):
         """ States that can reach this one """
@@ -178,22 +185,32 @@ class State:
         # Save original heuristic value
         self._h = self.h
 
+        # Neighbor lookups
+        (self.lookup_b, self.lookup_f) = self._next_P()
+
         # SPARQL query
         # ------------
         # Forward and Backward predicates might be needed
         # Predicates might have a known inverse
+        self._sparql_format = State.SPARQL_format(self.predicates_f, self.predicates_b)
 
-        self._sparql_format = ""
+    @classmethod
+    def SPARQL_format(cls, predicates_f, predicates_b) -> str:
+        """
+        Builds a format for SPARQL queries fetching the needed predicates.
+        On each direction predicates are None if not needed, or empty if any might be.
+        """
+        sparql_format = ""
         # Prepare filters
         # $\bigvee_{i \in P}  sameTERM(?P, p_i)$
 
         # Build forward  filter string
         forward_flt = None
-        if self.predicates_f is not None:
+        if predicates_f is not None:
             # Forward  predicates are needed
-            if State._fine_grained_sparql_queries and len(self.predicates_f):
+            if State._fine_grained_sparql_queries and len(predicates_f):
                 # There is a known inverse
-                forward_flt  = " || ".join( ["sameTERM(?P, <%s>)"%p for p in self.predicates_f] )
+                forward_flt  = " || ".join( ["sameTERM(?P, <%s>)"%p for p in sorted(predicates_f)] )
                 forward_flt = " && (%s)" % forward_flt    # prepend the &&
             else:
                 # Every predicate might be useful
@@ -201,11 +218,11 @@ class State:
 
         # Build backward filter string
         backward_flt = None
-        if self.predicates_b is not None:
+        if predicates_b is not None:
             # Backward predicates are needed
-            if State._fine_grained_sparql_queries and len(self.predicates_b):
+            if State._fine_grained_sparql_queries and len(predicates_b):
                 # There is a known inverse
-                backward_flt = " || ".join( ["sameTERM(?P, <%s>)"%p for p in self.predicates_b] )
+                backward_flt = " || ".join( ["sameTERM(?P, <%s>)"%p for p in sorted(predicates_b)] )
                 backward_flt = "&& (%s)" % backward_flt  # Prepend the &&
             else:
                 # Every predicate might be useful
@@ -213,7 +230,7 @@ class State:
 
         if forward_flt and backward_flt:
             # Both directions are needed
-            self._sparql_format = """
+            sparql_format = """
             select ?s ?p ?o where {{
                 {{ ?s ?p ?o.  filter (sameTERM(?s, {0})  %s) }}
               union
@@ -221,19 +238,58 @@ class State:
             }}
             """ % (forward_flt, backward_flt)
         elif forward_flt:
-            self._sparql_format = """
+            sparql_format = """
             select ?s ?p ?o where {{
               ?s ?p ?o.
               filter (sameTERM(?s, {0}) %s)
             }}
             """ % forward_flt
         elif backward_flt:
-            self._sparql_format = """
+            sparql_format = """
             select ?s ?p ?o where {{
               ?s ?p ?o.
               filter (sameTERM(?o, {0}) %s)
             }}
             """ % backward_flt
+        return sparql_format
+
+    @classmethod
+    def _merge_needs(cls, a, b):
+        """Predicates needed by two States on a direction (see SPARQL_format)"""
+        if a is None:
+            return b
+        if b is None:
+            return a
+        if not a  or  not b:
+            return set()  # Any predicate
+        return a | b
+
+    @classmethod
+    def SPARQL_merged_format(cls, states) -> str:
+        """
+        Builds a format for SPARQL queries fetching the predicates needed by
+          every State (on a node they share)
+        """
+        key = frozenset(states)
+        sparql_format = State._merged_formats.get(key)
+        if sparql_format is None:
+            states = list(key)
+            predicates_f = states[0].predicates_f
+            predicates_b = states[0].predicates_b
+            for q in states[1:]:
+                predicates_f = State._merge_needs(predicates_f, q.predicates_f)
+                predicates_b = State._merge_needs(predicates_b, q.predicates_b)
+
+            sparql_format = State.SPARQL_format(predicates_f, predicates_b)
+            State._merged_formats[key] = sparql_format
+        return sparql_format
+
+    @classmethod
+    def covers(cls, states, q) -> bool:
+        """Checks if a query fetching the needs of states also fetches the needs of q"""
+        if q in states:
+            return True
+        return State.SPARQL_merged_format(states) == State.SPARQL_merged_format(states | {q})
 
     def register_outgoing_transition(self, t):
         """
@@ -254,3 +310,23 @@ class State:
         assert self._ready, "%s was not yet ready" % (self)
 
         return self._sparql_format.format("<%s>" % iri)
+
+    @classmethod
+    def SPARQL_merged_query(cls, states, iri):
+        """
+        Builds a SPARQL query to expand a Node on many States at once
+        """
+        return State.SPARQL_merged_format(states).format("<%s>" % iri)
+
+    @classmethod
+    def SPARQL_batch_format(cls, sparql_format):
+        """
+        Builds a SPARQL query to expand many Nodes at once (from a single Node format).
+
+        The IRIs go in a VALUES block (replacing the $IRIS placeholder) and
+          each answer binds ?x to the IRI it expands.
+        """
+        query = sparql_format.format("?x")
+        query = query.replace("select ?s ?p ?o", "select ?x ?s ?p ?o", 1)
+        # VALUES go on every pattern, so ?x is in scope for its filter
+        return query.replace("?s ?p ?o.", "values ?x { $IRIS }  ?s ?p ?o.")
@@ -14,6 +14,10 @@ class Direction(Enum):
     forward  = True,
     backward = False
 
+    def reversed(self):
+        """The opposite direction"""
+        return Direction.backward if self is Direction.forward else Direction.forward
+
 
 class Transition:
     """
@@ -361,6 +361,17 @@ def gubichev_NATO_business_r(n=YAGO["Berlin"], w=1):
     return b.build(w)
 
 
+# Q27
+def coauthor_chain(n=mStonebraker, m=DBLP_Authors["Jennifer_Widom"], w=1):
+    """Coauthor chain to another author"""
+    b = QueryBuilder(n, "Author")
+    b.frm("Author").through(DC["creator"]).backwards_to("Paper")
+    b.frm("Paper").through(DC["creator"]).to("CoAuth", None, NodeFilter_only(m))
+    b.frm("CoAuth").through(DC["creator"]).backwards_to("Paper")
+
+    return b.build(w)
+
+
 # Q31
 def gubichev_europe(n=YAGO["wikicat_Capitals_in_Europe"], w=1):
     """Europe"""
@@ -423,7 +434,7 @@ automatons = [
     (movies_by_coactor_IRI__ANY,       "Coactor_movies_IRI__ANY"),      #24x
     (movies_by_coactor_star_ANY,       "CoactorStar_movies__ANY"),      #25x  ** query1
     (movies_by_coactor_star__dbPedia,  "CoactorStar_movies__dbPedia"),  #26
-    (None, ""),                                                         #27
+    (coauthor_chain,                   "CoauthorChain"),                #27
     (None, ""),                                                         #28
     (None, ""),                                                         #29
 
@@ -7,29 +7,39 @@ import os
 import gc
 
 from sys import stdout
-from copy import copy
-from time import time
+from copy import deepcopy
+from time import time, sleep
+from itertools import count
 from shutil import get_terminal_size
-from json import dump
 from enum import Enum
 
 import psutil
 
 from rdflib.term import URIRef, Literal, BNode
 
-from asld.graph import ASLDGraph
-from asld.query.query import Query
+from asld.graph import ASLDGraph, Backend, Chunk
+from asld.async_fetch import AsyncFetchPool
+from asld.sim_fetch import SimulatedFetchPool
 from asld.query.state import State
 from asld.query.transition import Transition, Direction
+from asld.query.query_builder import QueryBuilder
 
-from asld.utils.heap import Heap
+from asld.utils import checkpoint
+from asld.utils.heap import BucketQueue, SpillingBucketQueue
+from asld.utils.node_table import NodeTable, Bitmap, NONE
+from asld.utils.stats_history import History, Sampler
+from asld.utils.writers import NDJSONWriter, NTriplesWriter, PathWriter
 from asld.utils.color_print import Color
 from asld.utils.async_timeout_pool import AsyncTimeOutPool
+from asld.utils.host_scheduler import HostScheduler
+from asld.utils.virtual_clock import VirtualClock
 
 
 INFTY = float("inf")
 
 DUMP_DATA = True
+DUMP_ANSWERS = "last-ans.ndjson"  # Answers, as written on run logs
+DUMP_DB = "last-db.nt"
 
 # Default limits
 # ==============
@@ -38,6 +48,26 @@ _L_TIME = 30*60
 _L_TRIPLES = 1e5
 
 
+# Memory bound
+# ============
+FORGET_TO = 0.9  # Fraction of the NodeState budget kept after forgetting
+
+
+# Stats
+# =====
+STATS_INTERVAL = 0.5      # Seconds between memory samples
+STATS_HISTORY  = 1 << 18  # Snapshots kept in memory
+STATS_SPILL    = None     # File for older snapshots (dropped if None)
+
+def configure_stats(interval=STATS_INTERVAL, history=STATS_HISTORY, spill=None):
+    """Sets the memory sampling interval, and the history bound and spill file"""
+    # pylint: disable=global-statement
+    global STATS_INTERVAL, STATS_HISTORY, STATS_SPILL
+    STATS_INTERVAL = interval
+    STATS_HISTORY = history
+    STATS_SPILL = spill
+
+
 # Output Helpers
 # ==============
 TERM_SIZE = get_terminal_size((80, 20))
@@ -72,9 +102,10 @@ def printPath(path):
 
 
 _proc_self = psutil.Process(os.getpid())
-def getMemory():
-    """ Returns memory usage in MB (after calling the GC) """
-    gc.collect()
+def getMemory(collect=True):
+    """ Returns memory usage in MB (after calling the GC, if collect) """
+    if collect:
+        gc.collect()
     return _proc_self.memory_info().rss/1024/1024
 
 
@@ -127,62 +158,136 @@ class Algorithm(Enum):
 
         return "(Alg)"
 
+class Fetcher(Enum):
+    """
+    Sets up how requests are sent
+    """
+    Processes = 0  # One blocking request per worker process
+    AsyncIO   = 1  # Event loop with a parsing process pool
+    Simulated = 2  # Cached answers with simulated latencies (virtual clock)
+
+    @classmethod
+    def parse(cls, fetcher: str):
+        """
+        String -> Fetcher enum
+        """
+        fetcher = fetcher.lower()
+
+        if "asyncio".startswith(fetcher):
+            return Fetcher.AsyncIO
+        if "simulated".startswith(fetcher):
+            return Fetcher.Simulated
+        return Fetcher.Processes
+
+    @classmethod
+    def to_string(cls, fetcher):
+        """ Fetcher enum -> string """
+        if fetcher == Fetcher.AsyncIO:
+            return "AsyncIO"
+        if fetcher == Fetcher.Simulated:
+            return "Simulated"
+        return "Processes"
+
+
 class ASLDSearch:
     """
     Search
 
     Holds:
       - query:  Query
+      - queries: Queries searched at once (multi-source search, see _fetchStates)
       - g:      ASLDGraph
       - stats:  ASLDSearch.Stats
 
-      - open:   Heap<NodeState>
-      - closed: Set<NodeState>
-      - states: (Node, State) -> NodeState
+      - open:   BucketQueue<NodeState> (SpillingBucketQueue if spilling)
+      - closed: Bitmap<NodeState handle>
+      - table:  NodeTable, (Node, State) pairs reached
 
       - Setup:
          - w:           Weight to use on the heuristic
          - quick_goal:  Use quick goal declaration
+         - fetcher:     How requests are sent
+         - parsers:     Parsing processes (AsyncIO fetcher only)
+         - sparql_batch: Most IRIs expanded by a single SPARQL query
+         - backend:     Triple store
+         - stream:      Expand nodes as their answers arrive (AsyncIO fetcher only)
+         - sharedGraph: Graph shared with other searches (owned by the caller)
+         - sharedPool:  Pool shared with other searches, with the AsyncFetchPool
+                        interface (owned by the caller, close only detaches)
+         - checkpointPath: File to checkpoint the search to (see ASLDSearch.resume)
+         - checkpointInterval: Seconds between checkpoints
+         - weights:     Anytime heuristic weights left (A* only, see _nextWeight)
+         - maxNodes:    NodeStates kept in memory (see _forget)
+         - maxRSS:      Memory [MB] that sets maxNodes once reached
+         - spill:       NodeStates on open kept in memory, higher f-layers are
+                        spilled to disk (see SpillingBucketQueue)
+         - spillDir:    Directory for the spilled runs (default: temp directory)
+         - reverse:     Reversed Query, searched backward from the goal node
+                        (bidirectional search, see _meet)
+         - costModel:   CostModel learning request costs, its estimates break
+                        ties on open (see _priority)
     """
     # pylint: disable=too-many-instance-attributes
 
     class NodeState:
-        """Search Node, a (Node, State) pair"""
-
-        def __init__(self,
-                     node,
-                     state:  State,
-                     parent,
-                     P:      URIRef,
-                     t:      Transition,
-                     d:      Direction,
-                     g=float("inf")):
-            # pylint: disable=too-many-arguments
-
-            assert valid_node(node), "%s not a valid node" % node
-
-            self.n = node
-            self.q = state
-
-            # Path data
-            self.parent = parent
-
-            self.P = P
-            self.t = t
-            self.d = d
+        """
+        Search Node, a (Node, State) pair
 
-            # Node cost
-            self.g = g
+        A view over a row of a NodeTable (h is its handle), so it can be built
+          and dropped as needed.
+        """
+        __slots__ = ("table", "h")
+
+        def __init__(self, table: NodeTable, h: int):
+            self.table = table
+            self.h = h
+
+        @property
+        def n(self):
+            """Node"""
+            return self.table.node[self.h]
+
+        @property
+        def q(self) -> State:
+            """State"""
+            return self.table.values[self.table.state[self.h]]
+
+        @property
+        def g(self):
+            """Node cost"""
+            return self.table.g[self.h]
+
+        # Path data
+        @property
+        def parent(self):
+            """Parent NodeState (None at the start)"""
+            parent = self.table.parent[self.h]
+            return None if parent == NONE else ASLDSearch.NodeState(self.table, parent)
+
+        @property
+        def P(self) -> URIRef:
+            """Predicate that reached the node"""
+            return self.table.value(self.table.P[self.h])
+
+        @property
+        def t(self) -> Transition:
+            """Transition that reached the node"""
+            return self.table.value(self.table.t[self.h])
+
+        @property
+        def d(self) -> Direction:
+            """Direction of the transition"""
+            return self.table.value(self.table.d[self.h])
 
 
         def __lt__(self, other):
-            return self.n < other.n
+            return self.h < other.h
 
         def __eq__(self, other):
-            return self.n == other.n  and  self.q == other.q
+            return self.h == other.h  and  self.table is other.table
 
         def __hash__(self):
-            return hash(self.n) ^ (hash(self.q)+1)
+            return self.h
 
 
         def str_n(self):
@@ -228,6 +333,48 @@ class ASLDSearch:
             return self.q.SPARQL_query(self.n)
 
 
+    class MetStep(NodeState):
+        """
+        Step of a path on its backward half (see _meet): a NodeState of the
+          reversed Query, seen forward.
+
+        via is the backward NodeState reached from it (the previous step), prev
+          the previous step of the path and twin maps the reversed States and
+          Transitions to the Query's.
+        """
+        __slots__ = ("via", "prev", "twin")
+
+        def __init__(self, ns, via, prev, twin):
+            super().__init__(ns.table, ns.h)
+            self.via = via
+            self.prev = prev
+            self.twin = twin
+
+        @property
+        def q(self) -> State:
+            return self.twin[self.table.values[self.table.state[self.h]]]
+
+        @property
+        def g(self):
+            return self.prev.g + 1
+
+        @property
+        def parent(self):
+            return self.prev
+
+        @property
+        def P(self) -> URIRef:
+            return self.via.P
+
+        @property
+        def t(self) -> Transition:
+            return self.twin[self.via.t]
+
+        @property
+        def d(self) -> Direction:
+            return self.via.d.reversed()
+
+
     class Stats:
         """
         Manages the series of statistics for a search run
@@ -245,11 +392,18 @@ class ASLDSearch:
 
                 self.memory = 0
 
+                self.forgotten = 0  # NodeStates forgotten (memory bound)
+
+                # Anytime search
+                self.weight = 1.0  # Heuristic weight in use
+                self.bound = 1.0   # Suboptimality bound of the answers found
+
                 # Search
                 self.goals = 0       # Goals found
                 self.expansions = 0  # Expansions done
                 self.local_expansions = 0
                 self.remote_expansions = 0
+                self.cache_hits = 0  # Remote expansions answered by the persistent cache
 
                 # DB
                 self.triples = 0  # Triples on the Main DB
@@ -267,45 +421,74 @@ class ASLDSearch:
             def __repr__(self) -> str:
                 return str(self)
 
-            def json(self) -> dict:
-                """
-                Returns the json object representation of the Snapshot
-                """
-                return {
+            # (json key, attribute, History typecode)
+            FIELDS = (
+                ("wallClock", "wallClock", "d"),
+                ("batchID",   "batch",     "l"),
+
+                ("memory",    "memory",    "d"),
+
+                ("weight", "weight", "d"),
+                ("bound",  "bound",  "d"),
 
-                    "wallClock": self.wallClock,
-                    "batchID": self.batch,
+                ("goals_found",       "goals",             "l"),
+                ("expansions",        "expansions",        "l"),
+                ("local_expansions",  "local_expansions",  "l"),
+                ("remote_expansions", "remote_expansions", "l"),
+                ("cache_hits",        "cache_hits",        "l"),
+                ("forgotten",         "forgotten",         "l"),
 
-                    "memory": self.memory,
+                ("triples", "triples", "l"),
 
-                    "goals_found": self.goals,
-                    "expansions": self.expansions,
-                    "local_expansions": self.local_expansions,
-                    "remote_expansions": self.remote_expansions,
+                ("requestTriples",   "requestTriples", "l"),
+                ("requestTime",      "requestTime",    "d"),
+                ("requestTotalTime", "requestAccTime", "d"),
+                ("requestIRI",       "requestIRI",     None)
+            )
 
-                    "triples": self.triples,
+            def row(self) -> tuple:
+                """Values of the Snapshot, in FIELDS order"""
+                fields = ASLDSearch.Stats.Snapshot.FIELDS
+                return tuple(getattr(self, attr) for (_, attr, _) in fields)
 
-                    "requestTriples":   self.requestTriples,
-                    "requestTime":      self.requestTime,
-                    "requestTotalTime": self.requestAccTime,
-                    "requestIRI":       self.requestIRI
-                }
+            def json(self) -> dict:
+                """
+                Returns the json object representation of the Snapshot
+                """
+                return {key: str(v) if key == "requestIRI" else v
+                        for ((key, _, _), v) in zip(ASLDSearch.Stats.Snapshot.FIELDS, self.row())}
 
             def __lt__(self, o) -> bool:
                 return self.requestTime < o.requestTime
 
 
-        def __init__(self, s):
+        def __init__(self, s, clock=time):
             self.status = ASLDSearch.Stats.Snapshot()
-            self.history = []
+            fields = ASLDSearch.Stats.Snapshot.FIELDS
+            self.history = History([(key, code) for (key, _, code) in fields],
+                                   STATS_HISTORY, STATS_SPILL)
+            self.sampler = Sampler(self._sample, STATS_INTERVAL)
             self.search = s
-            self.t0 = time()
+            self.sink = None
+            self.clock = clock
+            self.t0 = self.clock()
+            self.offset = 0  # Time run before a resume
             self.g = s.g
+            self.status.memory = getMemory()
             self.snap()
 
         def tick(self):
-            """Start timing"""
-            self.t0 = time()
+            """Start timing (and sampling)"""
+            self.t0 = self.clock()
+            self.sampler.start()
+
+        def stop(self):
+            """Stops sampling"""
+            self.sampler.stop()
+
+        def _sample(self):
+            """Reads the values too slow for every snapshot (runs on the sampler)"""
+            self.status.memory = getMemory(collect=False)
 
         def __str__(self) -> str:
             return "LastStatus: %s" % str(self.status)
@@ -315,28 +498,64 @@ class ASLDSearch:
 
 
         def snap(self):
-            """Adds a new stats snapshot to the history"""
-            self.status.memory = getMemory()
+            """Adds a new stats snapshot to the history (memory is the last sampled)"""
             self.status.triples = len(self.g)
-            self.status.wallClock = time()-self.t0
-            self.history.append(copy(self.status))
+            self.status.wallClock = self.clock()-self.t0 + self.offset
+            self.history.append(self.status.row())
+            if self.sink is not None:
+                self.sink.write({"stats": self.status.json()})
+
+        def attach(self, sink):
+            """Writes the snapshots (past and future) to an NDJSONWriter"""
+            for snapshot in self.json():
+                sink.write({"stats": snapshot})
+            self.sink = sink
+
+        def restore(self, status, rows):
+            """Continues a checkpointed history (see ASLDSearch.writeCheckpoint)"""
+            fields = ASLDSearch.Stats.Snapshot.FIELDS
+            self.history = History([(key, code) for (key, _, code) in fields],
+                                   STATS_HISTORY, STATS_SPILL)
+            for row in rows:
+                self.history.append(tuple(row[key] for (key, _, _) in fields))
+            self.status = status
+            self.offset = status.wallClock
+
+        def json(self) -> list:
+            """Returns the history as a list of json snapshots"""
+            history = list(self.history.rows())
+            for snapshot in history:
+                snapshot["requestIRI"] = str(snapshot["requestIRI"])
+            return history
 
         def goal(self):
             """Count another goal found"""
             self.status.goals += 1
 
+        def anytime(self, weight, bound):
+            """Sets the heuristic weight and the suboptimality bound"""
+            self.status.weight = weight
+            self.status.bound = bound
+
+        def forget(self, n):
+            """Count NodeStates forgotten"""
+            self.status.forgotten += n
+
         def batch(self):
             """Count another batch"""
             self.status.batch += 1
 
-        def expand(self, iri, lG, t, local):
+        def expand(self, iri, lG, t, local, cached=False):
             """ Marks an expansion """
+            # pylint: disable=too-many-arguments
             self.status.expansions += 1
             if local:
                 self.status.local_expansions += 1
             else:
                 self.status.remote_expansions += 1
-            self.status.requestIRI = str(iri)
+                if cached:
+                    self.status.cache_hits += 1
+            self.status.requestIRI = iri
             self.status.requestTriples = lG
             self.status.requestTime = t
             self.status.requestAccTime += t
@@ -360,21 +579,98 @@ class ASLDSearch:
 
 
 
-    def __init__(self, queryAutomaton: Query, quick_goal=True, alg=Algorithm.AStar):
+    def __init__(self, queryAutomaton, quick_goal=True, alg=Algorithm.AStar,
+                 fetcher=Fetcher.Processes, parsers=2, sparql_batch=1, backend=Backend.RDFLib,
+                 stream=False, pipeline=True, graph=None, pool=None,
+                 checkpoint=None, checkpoint_interval=60, anytime=None,
+                 max_nodes=None, max_rss=None, spill=None, spill_dir=None,
+                 bidirectional=False, cost_model=None):
+        # pylint: disable=too-many-arguments
         # Search setup
-        self.query = queryAutomaton
+        # A list of Queries (one per start node, same automaton) are searched at
+        #  once, sharing the graph and requests. Each answer starts on its source.
+        self.queries = queryAutomaton if isinstance(queryAutomaton, list) else [queryAutomaton]
+        self.query = self.queries[0]
+        self.proto = {}  # State of a Query -> same State on the first one
+        for query in self.queries[1:]:
+            for q in query.states.values():
+                if q.name in self.query.states:
+                    self.proto[q] = self.query.states[q.name]
+        self.backend = backend
+        self.sharedGraph = graph
+        self.sharedPool = pool
+
+        # Anytime search (ARA*-like): the weight is lowered as answers are proven
+        #  weight-suboptimal, the search ends with weight 1
+        self.anytime = bool(anytime)  and  alg == Algorithm.AStar
+        self.weights = []
+        self.weight = 1.0
+        if self.anytime:
+            if any(getattr(query, "w", 1) != 1 for query in self.queries):
+                # Query heuristics are already weighted, the schedule wouldn't end on 1
+                raise ValueError("Anytime search needs queries built with w=1")
+            self.weights = [float(w) for w in anytime]
+            if self.weights[-1] != 1:
+                self.weights.append(1.0)
+            self.weight = self.weights.pop(0)
+        self.incons = set()     # Closed NodeStates improved on this weight
+        self.bestGoal = None    # Least g of the goals found on this weight
+
+        # Memory bound (SMA*-like): the worst NodeStates on open are forgotten
+        self.maxNodes = max_nodes
+        self.maxRSS = max_rss
+        self.regenerate = set()  # Parents put back on open to regenerate children
+        self._forgetAt = 0       # NodeStates for the next forget (when over the budget)
+
+        # External memory open list
+        self.spill = spill
+        self.spillDir = spill_dir
+
+        # Bidirectional search: NodeStates of the reversed Query share the table
+        self.reverse = None
+        self.twin = {}
+        if bidirectional  and  len(self.queries) > 1:
+            Color.YELLOW.print("Bidirectional search needs a single source, searching forward only")
+        elif bidirectional:
+            reversal = QueryBuilder.reverse(self.query)
+            if reversal is None:
+                Color.YELLOW.print("Bidirectional search needs a single goal node, "
+                                   "searching forward only")
+            else:
+                (self.reverse, self.twin) = reversal
+
+        # Learned request costs: NodeStates on cheaper directions go first
+        self.costModel = cost_model
+        self.costs = {}  # State -> time in requests to a final State (estimated)
+        self.fanouts = {}  # Request index -> {predicate: triples} on its answer so far
+
+        # Simulations run on a virtual clock
+        self.clock = VirtualClock() if fetcher == Fetcher.Simulated else time
         self.g = None
         self.stats = None
-        self._reset()
 
         # Options
         self.alg = alg
         self.quick_goal = quick_goal
+        self.fetcher = fetcher
+        self.parsers = parsers
+        self.sparql_batch = sparql_batch
+        self.stream = stream
+        self.pipeline = pipeline
+        self.checkpointPath = checkpoint
+        self.checkpointInterval = checkpoint_interval
+        self._checkpointed = self.clock()
+        self.resumed = False
+        self.resubmit = []  # (IRI, NodeStates) requests in flight at the checkpoint resumed
+        self.politeness = HostScheduler(self.clock)  # Host limits across batches (see _polite)
+        self.fetched = 0  # Triples on the answers received (triples limit on shared graphs)
+        self._reset()
+
 
         # Search
-        self.open   = Heap()
-        self.closed = set()
-        self.states = {}
+        self.open   = self._newOpen()
+        self.closed = Bitmap()
+        self.table  = NodeTable()
         self.startNS = None
 
         if self.quick_goal:
@@ -382,32 +678,55 @@ class ASLDSearch:
             self._advanceHeuristic()
         else:
             Color.BLUE.print("Using regular goal declaration")
+        self._estimateCosts()
 
     def _reset(self):
         """ Clears all search info and call the GC """
-        self.g = ASLDGraph()
-        self.stats = ASLDSearch.Stats(self.g)
+        if self.stats is not None:
+            self.stats.stop()
+        self.g = self.sharedGraph if self.sharedGraph is not None else ASLDGraph(self.backend)
+        self.stats = ASLDSearch.Stats(self.g, self.clock)
+        self.stats.anytime(self.weight, self.weight)
         self._setup_search()
         gc.collect()
 
     def _setup_search(self):
-        self.open   = Heap()
-        self.closed = set()
-        self.states = {}
-
-        n0 = self.query.startNode
-        q0 = self.query.startState
-        ns = ASLDSearch.NodeState(n0, q0, None, None, None, None)
-        self.states[(n0, q0)] = ns
-
-        self.startNS   = ns
-        self.startNS.g = 0
+        self.open   = self._newOpen()
+        self.closed = Bitmap()
+        self.table  = NodeTable()
+
+        self.roots = []
+        for query in self.queries:
+            n0 = query.startNode
+            q0 = query.startState
+            assert valid_node(n0), "%s not a valid node" % n0
+            self.roots.append(ASLDSearch.NodeState(self.table, self.table.add(n0, q0, 0)))
+        self.startNS = self.roots[0]
+
+        self.goalNS = None
+        self.bestMet = INFTY  # Cost of the best path met (bidirectional)
+        if self.reverse is not None:
+            h = self.table.add(self.reverse.startNode, self.reverse.startState, 0)
+            self.goalNS = ASLDSearch.NodeState(self.table, h)
+
+    def _newOpen(self):
+        """Empty open list, spilling to disk if set"""
+        if self.spill is None:
+            return BucketQueue()
+        # A* breaks ties by (request time left, -g) with a CostModel (see _priority)
+        pairs = self.alg == Algorithm.AStar  and  self.costModel is not None
+        return SpillingBucketQueue(lambda ns: ns.h,
+                                   lambda h: ASLDSearch.NodeState(self.table, h),
+                                   capacity=self.spill, path=self.spillDir, pairs=pairs)
 
     def _advanceHeuristic(self):
         """
         Shift heuristic to avoid computing best children on every expansion
         """
-        for s in self.query.states.values():
+        states = [q for query in self.queries for q in query.states.values()]
+        if self.reverse is not None:
+            states += self.reverse.states.values()
+        for s in states:
             h = INFTY
 
             # pylint: disable=protected-access
@@ -416,23 +735,21 @@ class ASLDSearch:
                     h = ns._h
             s.h = h
         Color.GREEN.print("Queue-Skipping Heuristic:")
-        for s in self.query.states.values():
+        for s in states:
             Color.GREEN.print("  * %s" % s)
 
-
-    def _get(self, n, q, parent, P, t, d):
-        """
-        Gets the *Unique* NodeState for a (node, state) pair.
-        It builds new NodeStates as needed.
-        """
-        # pylint: disable=too-many-arguments
-
-        if (n, q) not in self.states:
-            if P is None  or  t is None  or  d is None:
-                raise Exception("First get MUST init the new NodeState")
-            self.states[(n, q)] = ASLDSearch.NodeState(n,q, parent, P,t,d)
-
-        return self.states[(n, q)]
+    def _estimateCosts(self):
+        """Estimates the request time left from each State (see CostModel.estimates)"""
+        if self.costModel is None:
+            return
+        queries = self.queries + ([self.reverse] if self.reverse is not None else [])
+        self.costs = {}
+        for query in queries:
+            self.costs.update(self.costModel.estimates(query))
+        Color.GREEN.print("Request cost estimates (%s):" % self.costModel)
+        for query in queries:
+            for s in sorted(query.states.values()):
+                Color.GREEN.print("  * %s %8.3fs" % (s, self.costs[s]))
 
 
     def _pop(self):
@@ -467,30 +784,96 @@ class ASLDSearch:
         BFS could also be lighter (no tie-breaking), but on the web, CPU use
           is negligible when considering the communication delay.
         """
-        if   self.alg == Algorithm.AStar:
-            # Least f
-            # Tie break towards greater g
-            k = (ns.g + ns.q.h, -ns.g)
-        elif self.alg == Algorithm.Dijkstra:
-            # Least g
-            # Tie break towards lower h
-            #k = (ns.g, ns.q.h)
-            k = (ns.g, 0)
-        elif self.alg == Algorithm.DFS:
-            # Most g
-            # Tie break towards lower h
-            #k = (-ns.g, ns.q.h)
-            k = (-ns.g, 0)
-
         if ns.q.h < INFTY:
             # quick_goal marks useless expansions with h=INFTY
-            self.open.push(k, ns)
+            self.open.push(self._priority(ns), ns)
 
-        if self.quick_goal and ns.isGoal():
-            return ns
+        if self.quick_goal:
+            return self._goal(ns)
 
         return None
 
+    def _enqueueStart(self):
+        """Puts the start NodeStates (and the goal one, if bidirectional) on open"""
+        for ns in self.roots:
+            self._enqueue(ns)
+        if self.goalNS is not None:
+            self._enqueue(self.goalNS)
+
+    def _goal(self, ns):
+        """Returns the goal to declare on reaching ns (None if it isn't one)"""
+        if self.reverse is not None:
+            goal = self._meet(ns)
+        else:
+            goal = ns if ns.isGoal() else None
+
+        if goal is not None:
+            self._goalReached(goal)
+        return goal
+
+    def _meet(self, ns):
+        """
+        Bidirectional search: joins ns to its twin NodeState (same node, on the
+          twin State) if the other direction reached it.
+        As the goal is a single NodeState, paths are only declared when they
+          cost less than those met before (as a forward search declares the goal
+          again when it's reached for less). Paths visiting a NodeState twice
+          are dropped.
+
+        Returns the last step of the path (see MetStep), or None
+        """
+        h = self.table.find(ns.n, self.twin[ns.q])
+        if h is None  or  ns.g + self.table.g[h] >= self.bestMet:
+            return None
+        other = ASLDSearch.NodeState(self.table, h)
+        (f, b) = (other, ns) if ns.q in self.reverse.states.values() else (ns, other)
+
+        step = f
+        via = b
+        x = b.parent
+        while x is not None:
+            step = ASLDSearch.MetStep(x, via, step, self.twin)
+            via = x
+            x = x.parent
+
+        path = ASLDSearch.getPath(step)
+        if len(set((s.n, s.q) for s in path)) < len(path):
+            return None
+        self.bestMet = f.g + b.g
+        return step
+
+    def _priority(self, ns):
+        """
+        Key of a NodeState on open (see _enqueue)
+        With a CostModel, ties break towards the least request time left
+        """
+        if   self.alg == Algorithm.AStar:
+            # Least f
+            # Tie break towards greater g (after the least request time left, if known)
+            if self.costModel is None:
+                return (ns.g + self.weight*ns.q.h, -ns.g)
+            return (ns.g + self.weight*ns.q.h, (self._costLeft(ns), -ns.g))
+        if self.alg == Algorithm.Dijkstra:
+            # Least g
+            # Tie break towards lower h
+            #return (ns.g, ns.q.h)
+            return (ns.g, 0 if self.costModel is None else self._costLeft(ns))
+        # DFS: Most g
+        # Tie break towards lower h
+        #return (-ns.g, ns.q.h)
+        return (-ns.g, 0 if self.costModel is None else self._costLeft(ns))
+
+    def _costLeft(self, ns) -> int:
+        """
+        Time [ms] in requests to reach a goal from a NodeState: its own request
+          (if its node isn't loaded) and the estimate of its State
+        Rounded, so NodeStates on open share few tie keys.
+        """
+        cost = self.costs.get(ns.q, 0.0)
+        if isinstance(ns.n, URIRef)  and  not self._isLoaded(ns):
+            cost += self.costModel.latency(ASLDGraph.request_host(ns.n))
+        return int(round(cost * 1000))
+
     def _reach(self, ns, P, cN,cQ, t, d):
         """
         Reaches (cN, cQ) from ns using t on direction d
@@ -505,30 +888,34 @@ class ASLDSearch:
         if not cQ(cN):
             return None  # Destination Node not allowed by q
 
-        cns = self._get(cN,cQ, parent=ns, P=P, t=t, d=d)
-        if cns in self.closed:
+        newCost = ns.g + 1
+
+        # NodeStates are only stored once reached
+        h = self.table.find(cN, cQ)
+        if h is None:
+            assert valid_node(cN), "%s not a valid node" % cN
+            h = self.table.add(cN, cQ, newCost, ns.h, P, t, d)
+            return self._enqueue(ASLDSearch.NodeState(self.table, h))
+
+        if h in self.closed:
+            if self.anytime  and  newCost < self.table.g[h]:
+                self._improveClosed(h, newCost, ns.h, P, t, d)
             return None  # target node already expanded
 
         # Reach
-        newCost = ns.g + 1
-        if newCost >= cns.g:
+        if newCost >= self.table.g[h]:
             return None  # Nothing to see here...
 
         # Update child
-        cns.parent = ns
-
-        cns.g = newCost
-
-        cns.P = P
-        cns.t = t
-        cns.d = d
+        self.table.update(h, newCost, ns.h, P, t, d)
 
         # Enqueue child
-        return self._enqueue(cns)
+        return self._enqueue(ASLDSearch.NodeState(self.table, h))
 
-    def _expand(self, ns):
+    def _expand(self, ns, graph=None):
         """
         Reaches all the neighborhood and does early goal check.
+        The neighborhood is taken from graph (the whole graph by default).
 
         It prefers Forward Transitions as they may bring data
           for computing the backward transitions.
@@ -537,55 +924,278 @@ class ASLDSearch:
         """
 
         goalsFound = []
-        if not self.quick_goal:
-            if ns.isGoal():
-                goalsFound = [ns]
-
-        for t in ns.q.next_transitions_f:
-            for _,P,O in self.g.query(ns.n):
-                g = self._reach(ns, P, cN=O,cQ=t.dst, t=t, d=Direction.forward)
-                if g and self.quick_goal:
-                    goalsFound.append(g)
+        regenerated = ns.h in self.regenerate
+        if regenerated:
+            self.regenerate.discard(ns.h)
+        if not self.quick_goal  and  not regenerated:
+            goal = self._goal(ns)
+            if goal is not None:
+                goalsFound = [goal]
+
+        return goalsFound + self._reach_neighbors(ns, self.g if graph is None else graph)
+
+    def _reach_neighbors(self, ns, graph):
+        """Reaches the neighbors of ns on graph, returns the goals found (quick goal)"""
+        goalsFound = []
 
-        for t in ns.q.next_transitions_b:
-            for S,P,_ in self.g.query(None, None, ns.n):
-                g = self._reach(ns, P, cN=S,cQ=t.dst, t=t, d=Direction.backward)
-                if g and self.quick_goal:
-                    goalsFound.append(g)
+        # Each direction is looked up once, only for the predicates some transition allows
+        lookups = [(ns.q.next_transitions_f, ns.q.lookup_f, Direction.forward),
+                   (ns.q.next_transitions_b, ns.q.lookup_b, Direction.backward)]
+        for (transitions, predicates, d) in lookups:
+            if not transitions:
+                continue
+            for (P, N) in graph.neighbors(ns.n, predicates, d):
+                for t in transitions:
+                    g = self._reach(ns, P, cN=N,cQ=t.dst, t=t, d=d)
+                    if g and self.quick_goal:
+                        goalsFound.append(g)
 
         return goalsFound
 
 
+    def _add_chunk(self, data) -> Chunk:
+        """Adds a chunk of a streamed answer (packed), returns its triples"""
+        return self.g.addChunk(data)
+
+    def _pool(self, parallelRequests):
+        """Builds the pool that sends the requests"""
+        if self.sharedPool is not None:
+            return self.sharedPool
+        if self.fetcher == Fetcher.AsyncIO:
+            return AsyncFetchPool(parallelRequests, parsers=self.parsers, timeout=15,
+                                  stream=self.stream)
+        if self.fetcher == Fetcher.Simulated:
+            return SimulatedFetchPool(parallelRequests, self.clock)
+        return AsyncTimeOutPool(parallelRequests, timeout=15)
+
+    def _request(self, pool, requests, batches):
+        """Sends requests and batches through the pool, yielding answers as they come"""
+        if self.fetcher in (Fetcher.AsyncIO, Fetcher.Simulated):
+            yield from pool.map(requests, batches)
+        elif not batches:
+            yield from pool.map(ASLDGraph.pure_loadB, requests)
+        else:
+            singles = [([req], None) for req in requests]
+            for answers in pool.map(ASLDGraph.pure_loadB_batch, singles + batches):
+                yield from answers
+
+    def _submit(self, pool, requests, batches):
+        """Starts sending requests and batches through the pool, see _poll"""
+        if self.fetcher in (Fetcher.AsyncIO, Fetcher.Simulated):
+            pool.submit(requests, batches)
+            return
+        for req in requests:
+            pool.submit(ASLDGraph.pure_loadB, req)
+        for batch in batches:
+            pool.submit(ASLDGraph.pure_loadB_batch, batch)
+
+    def _poll(self, pool, timeout=None):
+        """
+        Takes the answers that arrived, waiting up to timeout for the first one
+          (or until it arrives, if None). Failed requests get empty answers.
+        """
+        if self.fetcher in (Fetcher.AsyncIO, Fetcher.Simulated):
+            return pool.poll(timeout)
+
+        answers = []
+        for (req, answer, e) in pool.poll(timeout):
+            (reqs, _) = req if isinstance(req[0], list) else ([req], None)
+            if e is not None:
+                Color.RED.print("\nA fetch terminated on: (%s) %s" % (type(e), e))
+                answers.extend(ASLDGraph.RequestAnswer(b"", 0, iri, i, 0) for (iri, i, _) in reqs)
+            elif isinstance(answer, list):
+                answers.extend(answer)
+            else:
+                answers.append(answer)
+        return answers
+
+    def _receive(self, reqAns, fetches, streamed):
+        """
+        Adds a request's answer to the graph and expands the NodeStates waiting
+          on it (partial answers only reach the neighbors on them).
+        fetches maps request indices to (IRI, NodeStates) pairs, and streamed holds
+          the indices of requests that got partial answers.
+
+        Yields the goals found
+        """
+        (iri, nss) = fetches[reqAns.index]
+        if reqAns.partial:
+            # Reach the neighbors on the chunk while the rest arrives
+            streamed.add(reqAns.index)
+            chunk = self._add_chunk(reqAns.data)
+            self._countFanout(reqAns.index, chunk)
+            for ns in nss:
+                yield from self._reach_neighbors(ns, chunk)
+            return
+
+        # Unpack and recover the NodeStates (were not copied around)
+        # Searches sharing the graph may have loaded the IRI meanwhile
+        for ns in nss:
+            assert self.sharedGraph is not None  or  not self._isLoaded(ns), \
+                "%s was already loaded." % ns
+        # The answer is shared, other NodeStates are expanded locally
+        self.stats.expand(iri, len(reqAns), reqAns.reqTime, local=False, cached=reqAns.cached)
+        self.fetched += len(reqAns)
+        for ns in nss[1:]:
+            self.stats.expand(iri, 0, 0, local=True)
+
+        # Finish expansion on the nodes
+        self._setLoaded(iri, nss)
+        if self.costModel is not None  and  not reqAns.cached:
+            self.costModel.request(ASLDGraph.request_host(iri),
+                                   set(ns.P for ns in nss if ns.P is not None),
+                                   reqAns.reqTime)
+
+        if len(reqAns) == 0:
+            # Nothing was obtained, nothing to do
+            clearLine()
+            Color.RED.print("Request for '%s' failed" % iri)
+            return
+
+        # Add new data and expand node
+        if reqAns.index in streamed:
+            # Only the last chunk is left to reach
+            streamed.discard(reqAns.index)
+            chunk = self._add_chunk(reqAns.data)
+            self._countFanout(reqAns.index, chunk)
+        elif self.costModel is not None:
+            self._countFanout(reqAns.index, self.g.addChunk(reqAns.data))
+            chunk = None
+        else:
+            self.g.addPacked(reqAns.data)
+            chunk = None
+        if self.costModel is not None:
+            self.costModel.document(ASLDGraph.request_host(iri),
+                                    self.fanouts.pop(reqAns.index, {}))
+
+        for ns in nss:
+            yield from self._expand(ns, chunk)
+
+    def _countFanout(self, index, chunk):
+        """Counts the predicates on (a chunk of) an answer, for the CostModel"""
+        if self.costModel is None:
+            return
+        triples = self.fanouts.setdefault(index, {})
+        for (_, P, _) in chunk.triples:
+            triples[P] = triples.get(P, 0) + 1
+
+    def _batch(self, requests, fetches):
+        """
+        Groups requests for the same SPARQL endpoint and query format into batched queries
+
+        Returns a (requests, batches) pair
+        """
+        if self.sparql_batch <= 1:
+            return (requests, [])
+
+        groups = {}
+        singles = []
+        for req in requests:
+            (iri, nss) = fetches[req[1]]
+            endpoint = ASLDGraph.SPARQL_endpoint(iri)
+            if endpoint is None:
+                singles.append(req)
+            else:
+                sparqlFormat = State.SPARQL_merged_format(self._fetchStates(nss))
+                groups.setdefault((endpoint, sparqlFormat), []).append(req)
+
+        batches = []
+        for ((_, sparqlFormat), reqs) in groups.items():
+            for k in range(0, len(reqs), self.sparql_batch):
+                chunk = reqs[k:k+self.sparql_batch]
+                if len(chunk) == 1:
+                    singles.append(chunk[0])
+                else:
+                    batches.append((chunk, State.SPARQL_batch_format(sparqlFormat)))
+
+        return (singles, batches)
+
+
+    def _fetches(self, netNodes):
+        """
+        Groups NodeStates by IRI, so each IRI is requested once for all its States
+
+        Returns a list of (IRI, NodeStates) pairs
+        """
+        groups = {}
+        for ns in netNodes:
+            groups.setdefault(ns.n, []).append(ns)
+        return list(groups.items())
+
+    def _fetchStates(self, nss):
+        """
+        States to fetch NodeStates for. On multi-source searches the States of
+          every Query are taken as those of the first one, so loaded IRIs and
+          SPARQL formats are shared (instead of growing with the sources).
+        """
+        return [self.proto.get(ns.q, ns.q) for ns in nss]
+
+    def _isLoaded(self, ns) -> bool:
+        """Checks if the IRI of a NodeState was fetched with the needs of its State"""
+        states = self.g.loaded.get(ns.n)
+        return states is not None  and  State.covers(states, self.proto.get(ns.q, ns.q))
+
+    def _setLoaded(self, iri, nss):
+        """Marks an IRI as fetched for the States of some NodeStates"""
+        self.g.loaded[iri] = self.g.loaded.get(iri, frozenset()).union(self._fetchStates(nss))
+
+
+    def _polite(self, fetches):
+        """
+        Orders a batch round-robin across hosts (by priority within each host).
+
+        The process and simulated pools can't hold requests back, so NodeStates
+          beyond their host's cap (or rate) are put back on open for a later batch.
+        Rate limits hold across batches (the scheduler is kept on the search),
+          a batch with every host out of tokens waits for the first one.
+        """
+        scheduler = self.politeness
+        for (i, (iri, nss)) in enumerate(fetches):
+            scheduler.push(ASLDGraph.request_host(iri), i, (iri, nss))
+
+        batch = []
+        hosts = []
+        while True:
+            nxt = scheduler.pop()
+            if nxt is None:
+                if batch  or  scheduler.wait_time() is None:
+                    break
+                self._sleep(scheduler.wait_time())
+                continue
+            hosts.append(nxt[0])
+            batch.append(nxt[1])
+
+        for (_, nss) in scheduler.drain():
+            for ns in nss:
+                self.closed.remove(ns.h)
+                self._enqueue(ns)
+
+        # Batches finish before the next one is built
+        for host in hosts:
+            scheduler.done(host)
+        return batch
+
+
     def _extractTopF(self, batchSize):
         # Extract at most batchSize from top-f nodes
-        (topF, _) = self.open.peekKey()  # key: (f, -g)
-
         netFreeNodes = []
         netNodes = []
         gls = []
-        expansions = 0
 
 
         # Build top Slice
         # ===============
-        f = topF
         pendingExpansions = 0
-        while self.open  and  (batchSize==0 or expansions<batchSize):
-            (f, _) = self.open.peekKey()
-            if f>topF:
-                break
-
-            ns = self._pop()
+        for (_, ns) in self.open.popLayer(batchSize):  # key: (f, -g)
             assert isinstance(ns, ASLDSearch.NodeState), "ns should be a NodeState"
 
-            if ns in self.closed:
+            if ns.h in self.closed:
                 if __debug__:
                     Color.RED.print("Discarding a closed node found on open")
                 continue
-            self.closed.add(ns)
+            self.closed.add(ns.h)
 
 
-            expansions += 1
             pendingExpansions += 1
 
             if IS_TTY:
@@ -601,7 +1211,7 @@ class ASLDSearch:
 
             # Add to batch
             if isinstance(ns.n, URIRef):
-                if ns in self.g.loaded:
+                if self._isLoaded(ns):
                     netFreeNodes.append(ns)  # Already gathered IRIs are faster to expand locally
                 else:
                     netNodes.append(ns)
@@ -611,46 +1221,516 @@ class ASLDSearch:
         return (netFreeNodes, netNodes, gls, pendingExpansions)
 
 
+    # Anytime search
+    # ==============
+    def _goalReached(self, ns):
+        if self.bestGoal is None  or  ns.g < self.bestGoal:
+            self.bestGoal = ns.g
+
+    def _improveClosed(self, h, g, parent, P, t, d):
+        """
+        Takes a better path to a closed NodeState (an inflated heuristic may close
+          NodeStates too early). It's reopened when the weight is lowered, or right
+          away on the last weight.
+        """
+        # pylint: disable=too-many-arguments
+        self.table.update(h, g, parent, P, t, d)
+        if self.weights:
+            self.incons.add(h)
+        else:
+            self.closed.discard(h)
+            self._enqueue(ASLDSearch.NodeState(self.table, h))
+
+    def _weightDone(self) -> bool:
+        """
+        Checks if the answers on this weight are proven weight-suboptimal: the
+          best goal costs no more than the least (weighted) f on open
+        """
+        if not self.weights  or  self.bestGoal is None:
+            return False
+        return not self.open  or  self.open.peekKey()[0] >= self.bestGoal
+
+    def _nextWeight(self):
+        """
+        Lowers the weight: NodeStates improved after being closed are reopened
+          and open is sorted again, the graph and the NodeStates reached are kept.
+        """
+        # Bound: least unweighted f of what is left to expand
+        table = self.table
+        fMin = min((table.g[ns.h] + ns.q.h for (_, ns) in self.open.items()),
+                   default=INFTY)
+        fMin = min([fMin] + [table.g[h] + table.values[table.state[h]].h for h in self.incons])
+        bound = self.weight
+        if 0 < fMin < INFTY:
+            bound = min(self.weight, max(1.0, self.bestGoal / fMin))
+
+        self.weight = self.weights.pop(0)
+        queued = [ns for (_, ns) in self.open.items()]
+        self.open.close()
+        self.open = self._newOpen()
+        for h in self.incons:
+            self.closed.discard(h)
+            queued.append(ASLDSearch.NodeState(table, h))
+        for ns in queued:
+            self._enqueue(ns)
+        self.incons = set()
+        self.bestGoal = None
+
+        self.stats.anytime(self.weight, bound)
+        clearLine()
+        Color.BLUE.print("Anytime: answers so far are %.2f-suboptimal, weight lowered to %.2f" %
+                         (bound, self.weight))
+
+
+    # Memory bound
+    # ============
+    def _overBudget(self) -> bool:
+        if self.maxRSS is not None  and  self.maxNodes is None  and  \
+           self.stats.memory() > self.maxRSS:
+            # Memory isn't given back as NodeStates are forgotten (their rows are
+            #  reused instead), so the NodeStates held now become the budget
+            self.maxNodes = self.table.live()
+            clearLine()
+            Color.YELLOW.print("Reached %dMB, keeping at most %d NodeStates" %
+                               (self.maxRSS, self.maxNodes))
+        return self.maxNodes is not None  and  \
+            self.table.live() > max(self.maxNodes, self._forgetAt)
+
+    def _forget(self, pending=()):
+        """
+        Forgets the worst NodeStates on open (leaves of the search tree) until
+          FORGET_TO of the budget is left, backing their f up into their parents.
+        Parents go back on open with the least f backed up, and regenerate the
+          children forgotten when expanded again (locally, their data is kept).
+
+        Goals already declared (quick goal), and children of pending NodeStates
+          (waiting on requests, with streamed children) are not forgotten.
+        The least-f layer is never forgotten (it would be regenerated right away),
+          neither are closed NodeStates, kept to detect duplicates. When those
+          alone go over the target, forgetting waits for them to grow again.
+        """
+        target = int(self.maxNodes * FORGET_TO)
+        pending = set(ns.h for ns in pending)
+        kept = []
+        removed = set()
+        forgotten = 0
+        worst = None
+        if not self.open:
+            return
+        layer = self.open.peekKey()[0]
+        while self.open  and  self.table.live() > target:
+            (k, ns) = self.open.popLast()
+            if k[0] <= layer:
+                kept.append((k, ns))
+                break
+            if self.table.kids[ns.h]  or  self.table.parent[ns.h] == NONE  or  \
+               self.table.parent[ns.h] in pending  or  \
+               (self.quick_goal  and  ns.isGoal()):
+                kept.append((k, ns))
+                continue
+
+            worst = k if worst is None else max(worst, k)
+            self.regenerate.discard(ns.h)
+            self.incons.discard(ns.h)
+            parent = self.table.remove(ns.h)
+            removed.add(ns.h)
+            forgotten += 1
+            if parent != NONE:
+                self._backup(ASLDSearch.NodeState(self.table, parent), k[0])
+
+        for (k, ns) in kept:
+            if ns.h not in removed  and  ns not in self.open:
+                self.open.push(k, ns)
+        self._forgetAt = int(self.table.live() / FORGET_TO)
+
+        self.stats.forget(forgotten)
+        if forgotten:
+            clearLine()
+            Color.YELLOW.print("Forgot %d NodeStates (keys up to %s), %d left" %
+                               (forgotten, worst, self.table.live()))
+
+    def _backup(self, parent, f):
+        """Puts a parent back on open with the f of a forgotten child (if less)"""
+        k = (f, self._priority(parent)[1])
+        old = self.open.key(parent)
+        if old is not None:
+            k = min(old, k)
+        else:
+            self.closed.discard(parent.h)
+        self.regenerate.add(parent.h)
+        self.open.push(k, parent)
+
+
+    # Checkpoints
+    # ===========
+    def _checkpointDue(self) -> bool:
+        return self.checkpointPath is not None  and  \
+            self.clock() - self._checkpointed >= self.checkpointInterval
+
+    def writeCheckpoint(self, pending=(), inflight=()):
+        """
+        Writes the search state (query, NodeStates, open, closed, best path met,
+          requests in flight, graph, loaded and failed IRIs, and stats) to the
+          checkpoint file.
+
+        pending are NodeStates taken from open but not expanded yet (waiting on
+          a request slot), they are saved as if they were still on open.
+        inflight are the (IRI, NodeStates) pairs of the requests sent, they are
+          sent again first on resume (see _resubmitted).
+        """
+        _t0 = self.clock()
+        closed = deepcopy(self.closed)
+        opened = [ns.h for (_, ns) in self.open.items()]
+        for ns in pending:
+            closed.discard(ns.h)
+            opened.append(ns.h)
+
+        state = {
+            "query":  self.query,
+            "queries": self.queries,
+            "reverse": (self.reverse, self.twin),
+            "table":  self.table,
+            "open":   opened,
+            "closed": closed,
+            "bestMet": self.bestMet,
+            "inflight": [(iri, [ns.h for ns in nss]) for (iri, nss) in inflight],
+            "graph":  self.g.packAll(),
+            "loaded": self.g.loaded,
+            "failed": self.g.failed,
+            "stats":  (self.stats.status, list(self.stats.history.rows()))
+        }
+        size = checkpoint.save(self.checkpointPath, state)
+        self._checkpointed = self.clock()
+
+        clearLine()
+        Color.BLUE.print("Checkpoint written to %s (%.1fMB, %.2fs)" %
+                         (self.checkpointPath, size/1024/1024, self._checkpointed - _t0))
+
+    def _resubmitted(self):
+        """Takes the requests in flight at the checkpoint resumed (see writeCheckpoint)"""
+        (resubmit, self.resubmit) = (self.resubmit, [])
+        return resubmit
+
+    @classmethod
+    def _pipelined(cls, waiting, inflight, late):
+        """NodeStates held by the pipelined loop (see _pipelined_paths)"""
+        pending = [ns for nss in waiting.values() for ns in nss]
+        pending += [ns for (_, nss) in inflight.values() for ns in nss]
+        pending += [ns for nss in late.values() for ns in nss]
+        return pending
+
+    @classmethod
+    def resume(cls, path, **options):
+        """
+        Rebuilds a checkpointed search (options as for ASLDSearch), so it goes on
+          without fetching again what it had. Checkpoints keep going to the same
+          file unless another one is given.
+        Limits (time, answers) count again from the resume.
+        """
+        state = checkpoint.load(path)
+        options.setdefault("checkpoint", path)
+        search = cls(state.get("queries", state["query"]), **options)
+        search._restore(state)  # pylint: disable=protected-access
+        return search
+
+    def _restore(self, state):
+        (self.reverse, self.twin) = state.get("reverse", (None, {}))
+        self._estimateCosts()
+        self.table = state["table"]
+        self.closed = state["closed"]
+        self.open = self._newOpen()
+        for h in state["open"]:
+            ns = ASLDSearch.NodeState(self.table, h)
+            self.open.push(self._priority(ns), ns)
+        self.roots = [ASLDSearch.NodeState(self.table, h) for h in range(len(self.queries))]
+        self.startNS = self.roots[0]
+        self.goalNS = None
+        if self.reverse is not None:
+            h = self.table.find(self.reverse.startNode, self.reverse.startState)
+            self.goalNS = ASLDSearch.NodeState(self.table, h)
+        self.bestMet = state.get("bestMet", INFTY)
+        self.resubmit = [(iri, [ASLDSearch.NodeState(self.table, h) for h in hs])
+                         for (iri, hs) in state.get("inflight", ())]
+
+        self.g.addPacked(state["graph"])
+        self.g.loaded = state["loaded"]
+        self.g.failed = state["failed"]
+        self.stats.restore(*state["stats"])
+        self.resumed = True
+
+        Color.BLUE.print("Resumed a search with %d NodeStates (%d on open) and %d triples" %
+                         (len(self.table), len(self.open), len(self.g)))
+
+
+    def _triples(self) -> int:
+        """
+        Triples counted by the triples limit: the graph's, or the ones fetched
+          by this search if the graph is shared (it grows with every search)
+        """
+        if self.sharedGraph is None:
+            return len(self.g)
+        return self.fetched
+
+    def _limitReached(self, answers, deadline, limit_time, limit_ans, limit_triples) -> bool:
+        """Checks (and reports) if a search limit was reached, so requests must stop"""
+        # pylint: disable=too-many-arguments
+        if answers > limit_ans:
+            clearLine()
+            Color.YELLOW.print("Reached the %d-goal-limit (%d)" % (limit_ans, answers))
+            return True
+        if self._triples() > limit_triples:
+            clearLine()
+            Color.YELLOW.print("Reached the %d-triples limit (%d)" % (limit_triples,
+                                                                       self._triples()))
+            return True
+        if deadline and self.clock() > deadline:
+            clearLine()
+            Color.YELLOW.print("Reached the %ds time limit" % (limit_time))
+            return True
+        return False
+
+    def _sleep(self, seconds):
+        """Waits on the search's clock (virtually on simulations)"""
+        if isinstance(self.clock, VirtualClock):
+            self.clock.sleep(seconds)
+        else:
+            sleep(seconds)
+
+    def _expandLocally(self, ns):
+        """Expands a NodeState without requests, returns the goals found"""
+        _t0_localExpand = self.clock()
+        goalsFound = self._expand(ns)
+        self.stats.expand(ns.n, 0, self.clock()-_t0_localExpand, local=True)
+        return goalsFound
+
+    def _pipelined_paths(self, parallelRequests, batchSize,
+                         limit_time, limit_ans, limit_triples):
+        """
+        paths without batch barriers: parallelRequests requests are kept in flight,
+          refilled by priority as each one completes.
+
+        NodeStates are popped from open while requests are out. Those that need a
+          request wait for a free slot (up to parallelRequests of them, held by host
+          on a HostScheduler), the rest are expanded right away. At most batchSize
+          are popped between checks for answers.
+        """
+        # pylint: disable=too-many-arguments,too-many-statements,too-many-locals,too-many-branches
+        deadline = None
+        if limit_time:
+            deadline = self.clock() + limit_time
+
+        # Initialize search
+        _t0_search = self.clock()
+        self._enqueueStart()
+        pool = self._pool(parallelRequests)
+
+        answers = 0
+        requestsAllowed = True
+
+        scheduler = HostScheduler(self.clock)  # IRIs waiting for a slot
+        waiting = {}    # IRI -> NodeStates waiting for a slot
+        inflight = {}   # request index -> (IRI, NodeStates)
+        fetching = {}   # IRI -> (request index, host)
+        late = {}       # IRI -> NodeStates popped while their IRI was in flight
+        streamed = set()
+        indices = count()
+        order = count()  # Pop order (priority on the scheduler)
+        received = 0
+
+        # Requests in flight at the checkpoint resumed go first
+        for (iri, nss) in self._resubmitted():
+            waiting[iri] = nss
+            scheduler.push(ASLDGraph.request_host(iri), next(order), iri)
+
+        while self.open  or  waiting  or  inflight:
+            if self._weightDone():
+                self._nextWeight()
+            if self._overBudget():
+                self._forget(ASLDSearch._pipelined(waiting, inflight, late))
+
+            if requestsAllowed  and  self._checkpointDue():
+                self.writeCheckpoint(ASLDSearch._pipelined(waiting, {}, late), inflight.values())
+
+            # Limits check
+            if requestsAllowed  and  self._limitReached(answers, deadline, limit_time,
+                                                        limit_ans, limit_triples):
+                requestsAllowed = False
+                if self.checkpointPath is not None:
+                    # NodeStates needing requests are dropped from now on
+                    self.writeCheckpoint(ASLDSearch._pipelined(waiting, {}, late),
+                                         inflight.values())
+                # Requests not sent yet are dropped
+                list(scheduler.drain())
+                waiting.clear()
+
+
+            # Pop by priority (expanding locally when possible)
+            # ===============
+            popped = 0
+            while self.open  and  popped < batchSize  and  len(waiting) < parallelRequests:
+                ns = self._pop()
+                if ns.h in self.closed:
+                    continue
+                self.closed.add(ns.h)
+                popped += 1
+
+                iri = ns.n
+                if not isinstance(iri, URIRef)  or  self._isLoaded(ns):
+                    # Early declare goals (Unless we implement blocking filters :c)
+                    for g in self._expandLocally(ns):
+                        answers += 1
+                        self.stats.goal()
+                        yield ASLDSearch.getPath(g)
+                elif iri in fetching:
+                    late.setdefault(iri, []).append(ns)
+                elif iri in waiting:
+                    waiting[iri].append(ns)
+                elif requestsAllowed:
+                    waiting[iri] = [ns]
+                    scheduler.push(ASLDGraph.request_host(iri), next(order), iri)
+
+
+            # Fill the free slots
+            # ===================
+            fetches = {}
+            while len(inflight) + len(fetches) < parallelRequests:
+                nxt = scheduler.pop()
+                if nxt is None:
+                    break
+                (host, iri) = nxt
+                i = next(indices)
+                fetches[i] = (iri, waiting.pop(iri))
+                fetching[iri] = (i, host)
+
+            if fetches:
+                # IRIs are fetched once for every State waiting on them
+                requests = [(iri, i, State.SPARQL_merged_query(self._fetchStates(nss), iri))
+                            for (i, (iri, nss)) in fetches.items()]
+                (requests, batches) = self._batch(requests, fetches)
+                self._submit(pool, requests, batches)
+                inflight.update(fetches)
+                self.stats.batch()
+
+
+            # Take answers
+            # ============
+            if not inflight:
+                wait = scheduler.wait_time()
+                if wait  and  popped == 0:
+                    # Every waiting host is rate limited
+                    self._sleep(wait)
+                continue
+
+            # Only wait when there is nothing else to do (and not past the deadline)
+            timeout = None
+            if self.open  and  len(waiting) < parallelRequests:
+                timeout = 0
+            elif waiting  and  len(inflight) < parallelRequests:
+                # Free slots wait for the next rate limited host (full ones for answers)
+                timeout = scheduler.wait_time()
+            if requestsAllowed  and  deadline:
+                left = max(0, deadline - self.clock())
+                timeout = left if timeout is None else min(timeout, left)
+
+            for reqAns in self._poll(pool, timeout):
+                assert isinstance(reqAns, ASLDGraph.RequestAnswer)
+                (iri, _) = inflight[reqAns.index]
+                for g in self._receive(reqAns, inflight, streamed):
+                    answers += 1
+                    self.stats.goal()
+                    yield ASLDSearch.getPath(g)
+
+                if not reqAns.partial:
+                    received += 1
+                    del inflight[reqAns.index]
+                    (_, host) = fetching.pop(iri)
+                    scheduler.done(host)
+
+                    # NodeStates popped meanwhile are expanded now (or requested again
+                    #  if their States needed more than what was asked)
+                    for ns in late.pop(iri, ()):
+                        if self._isLoaded(ns):
+                            for g in self._expandLocally(ns):
+                                answers += 1
+                                self.stats.goal()
+                                yield ASLDSearch.getPath(g)
+                        else:
+                            self.closed.discard(ns.h)
+                            self._enqueue(ns)
+
+                    if received % parallelRequests == 0:
+                        clearLine()
+                        print("[%8s| ans:%5d  expansions: %6d  db:%7d (%3dMB)  t:%6.2fs] "
+                              "%3d requests in flight" %
+                              (self.alg,
+                               answers,
+                               self.stats.expansions(),
+                               self.stats.db_triples(),
+                               self.stats.memory(),
+                               self.stats.wallClock(),
+                               len(inflight))
+                             )
+                        stdout.flush()
+
+        _t_search = self.clock() - _t0_search
+
+        clearLine()
+        Color.BLUE.print("Search took %4.2fs" % _t_search)
+        print()
+        Color.GREEN.print("Open was emptied, there are no more paths")
+        pool.close()
+
     def paths(self, parallelRequests=40, batchSize=160,
               limit_time=_L_TIME, limit_ans=_L_ANS, limit_triples=_L_TRIPLES):
         """
         Performs search using parallel requests to expand top-f value NodeStates
 
+        Unless pipelined (see _pipelined_paths), the top-f slice is expanded in
+          batches of batchSize, waiting for all its requests before the next one.
+
         Reaching limits causes the search to stop doing requests, but it may
           find a few answers more with whats left.
         """
         # pylint: disable=too-many-arguments,too-many-statements,too-many-locals,too-many-branches
+        if self.pipeline:
+            yield from self._pipelined_paths(parallelRequests, batchSize,
+                                             limit_time, limit_ans, limit_triples)
+            return
 
         deadline = None
         if limit_time:
-            deadline = time() + limit_time
+            deadline = self.clock() + limit_time
 
         # Initialize search
-        _t0_search = time()
-        self._enqueue(self.startNS)
-        pool = AsyncTimeOutPool(parallelRequests, timeout=15)
+        _t0_search = self.clock()
+        self._enqueueStart()
+        for (_, nss) in self._resubmitted():
+            # Batches are built from open
+            for ns in nss:
+                self.closed.discard(ns.h)
+                self._enqueue(ns)
+        pool = self._pool(parallelRequests)
 
         answers = 0
         requestsAllowed = True
 
         # Empty open...
         while self.open:
+            if self._weightDone():
+                self._nextWeight()
+            if self._overBudget():
+                self._forget()
+
+            if requestsAllowed  and  self._checkpointDue():
+                self.writeCheckpoint()
+
             # Limits check
-            if requestsAllowed:
-                if answers > limit_ans:
-                    clearLine()
-                    Color.YELLOW.print("Reached the %d-goal-limit (%d)" % (limit_ans,
-                                                                           answers))
-                    requestsAllowed = False
-                if len(self.g) > limit_triples:
-                    clearLine()
-                    Color.YELLOW.print("Reached the %d-triples limit (%d)" % (limit_triples,
-                                                                              len(self.g)))
-                    requestsAllowed = False
-                if deadline and time() > deadline:
-                    clearLine()
-                    Color.YELLOW.print("Reached the %ds time limit" % (limit_time))
-                    requestsAllowed = False
+            if requestsAllowed  and  self._limitReached(answers, deadline, limit_time,
+                                                        limit_ans, limit_triples):
+                requestsAllowed = False
+                if self.checkpointPath is not None:
+                    # NodeStates needing requests are dropped from now on
+                    self.writeCheckpoint()
 
             (netFreeNodes, netNodes, _, pendingExpansions) = self._extractTopF(batchSize)
             self.stats.batch()
@@ -661,7 +1741,7 @@ class ASLDSearch:
             # Blocking goal check will ruin this, also, goal states should rank further
             if netFreeNodes:
                 expansionsDone = 0
-                _t0_localExpansions = time()
+                _t0_localExpansions = self.clock()
                 for ns in netFreeNodes:
                     expansionsDone += 1
                     pendingExpansions -= 1
@@ -672,7 +1752,7 @@ class ASLDSearch:
 
                     # Expand nodes
                     # Early declare goals (Unless we implement blocking filters :c)
-                    _t0_localExpand = time()
+                    _t0_localExpand = self.clock()
                     goalsFound = self._expand(ns)
                     for g in goalsFound:
                         answers += 1
@@ -680,9 +1760,9 @@ class ASLDSearch:
                         yield ASLDSearch.getPath(g)
 
                     #assert ns in self.g.loaded, "%s was already loaded." % ns
-                    self.stats.expand(ns.n, 0, time()-_t0_localExpand, local=True)
+                    self.stats.expand(ns.n, 0, self.clock()-_t0_localExpand, local=True)
 
-                _t_end = time()
+                _t_end = self.clock()
                 _t_localExpansions = _t_end - _t0_localExpansions
 
                 clearLine()
@@ -693,60 +1773,47 @@ class ASLDSearch:
             # ===============
             if requestsAllowed and netNodes:
                 newTriples = 0
-                _t0_parallelExpand = time()
+                _t0_parallelExpand = self.clock()
 
-                requests = [(ns.n, i, ns.SPARQL_query()) for (i, ns) in enumerate(netNodes)]
+                # IRIs are fetched once for every State waiting on them
+                fetches = self._fetches(netNodes)
+                if self.fetcher in (Fetcher.Processes, Fetcher.Simulated):
+                    # Their pools don't hold requests back (AsyncIO ones do)
+                    deferred = len(netNodes)
+                    fetches = self._polite(fetches)
+                    pendingExpansions -= deferred - sum(len(nss) for (_, nss) in fetches)
+
+                requests = [(iri, i, State.SPARQL_merged_query(self._fetchStates(nss), iri))
+                            for (i, (iri, nss)) in enumerate(fetches)]
+                (requests, batches) = self._batch(requests, fetches)
 
                 requestsFullfilled = 0
                 requestsCorrectlyFullfilled = 0
-                for reqAns in pool.map(ASLDGraph.pure_loadB, requests):
-                    requestsFullfilled += 1
-                    pendingExpansions -= 1
-                    # Use answers as they become available
-                    # Using the main thread seems better as it avoids most sync
-
-                    # Unpack and recover the NodeState (was not copied around)
+                streamed = set()  # Requests with partial answers
+                for reqAns in self._request(pool, requests, batches):
                     assert isinstance(reqAns, ASLDGraph.RequestAnswer)
-                    reqGraph = reqAns.g
-                    t = reqAns.reqTime
-                    iri = reqAns.iri
-                    ns = netNodes[reqAns.index]
-                    assert ns not in self.g.loaded, "%s was already loaded." % ns
-                    self.stats.expand(iri, len(reqGraph), t, local=False)
+                    if not reqAns.partial:
+                        requestsFullfilled += 1
+                        pendingExpansions -= len(fetches[reqAns.index][1])
+                        if len(reqAns) > 0:
+                            requestsCorrectlyFullfilled += 1
+                            newTriples += len(reqAns)
+
+                        # Report progress
+                        if IS_TTY:
+                            clearLine()
+                            print("\r  || expansions (%4d): " % pendingExpansions, end="")
+                            print("[%s" % ("#"*requestsFullfilled), end="")
+                            print("%s]" % ("."*pendingExpansions), end="")
+                            stdout.flush()
 
-
-                    # Report progress
-                    if IS_TTY:
-                        clearLine()
-                        print("\r  || expansions (%4d): " % pendingExpansions, end="")
-                        print("[%s" % ("#"*requestsFullfilled), end="")
-                        print("%s]" % ("."*pendingExpansions), end="")
-                        stdout.flush()
-
-
-                    # Finish expansion on the node
-                    self.g.loaded.add(ns)
-
-                    if len(reqGraph) == 0:
-                        # Nothing was obtained, nothing to do
-                        clearLine()
-                        Color.RED.print("Request for '%s' failed" % iri)
-                        continue
-                    requestsCorrectlyFullfilled += 1
-
-                    # Add new data
-                    newTriples += len(reqGraph)
-                    for spo in reqGraph:
-                        self.g.add(spo)
-
-                    # Expand node
-                    goalsFound = self._expand(ns)
-                    for g in goalsFound:
+                    # Use answers as they become available
+                    for g in self._receive(reqAns, fetches, streamed):
                         answers += 1
                         self.stats.goal()
                         yield ASLDSearch.getPath(g)
 
-                _t_end = time()
+                _t_end = self.clock()
                 _t_parallelExpand = _t_end - _t0_parallelExpand
 
                 clearLine()
@@ -762,8 +1829,8 @@ class ASLDSearch:
                      )
                 stdout.flush()
 
-        _t_end = time()
-        _t_search = time() - _t0_search
+        _t_end = self.clock()
+        _t_search = self.clock() - _t0_search
 
         clearLine()
         Color.BLUE.print("Search took %4.2fs" % _t_search)
@@ -775,10 +1842,10 @@ class ASLDSearch:
             limit_time=_L_TIME, limit_ans=_L_ANS):
         """Intended only for interactive CLI use"""
         r = []
-        if self.closed:
+        if self.closed  and  not self.resumed:
             self._setup_search()
 
-        _t0 = time()
+        _t0 = self.clock()
         try:
             answers = 0
             self.stats.tick()  # Adjust stats clock
@@ -791,7 +1858,7 @@ class ASLDSearch:
                 if answers >= limit_ans:
                     Color.BLUE.print("Reached the %d-Answer limit" % limit_ans)
                     break
-                if time()-_t0 >= limit_time:
+                if self.clock()-_t0 >= limit_time:
                     Color.BLUE.print("Reached the %.2fs time limit" % limit_time)
                     break
 
@@ -800,11 +1867,13 @@ class ASLDSearch:
             Color.BLUE.print("Terminating search.")
         #except Exception as e:
             #Color.RED.print("Terminated Search.run on: %s" % e)
-        t = time() - _t0
+        self.stats.stop()
+        self.open.close()
+        t = self.clock() - _t0
         Color.GREEN.print("\nSearch took %.2fs. Gathered %d triples and got back %d paths." %
                           (t,
                            len(self.g), len(r)))
-        return (r, answers, time()-_t0)
+        return (r, answers, self.clock()-_t0)
 
     @classmethod
     def _native_path(cls, path):
@@ -812,42 +1881,75 @@ class ASLDSearch:
         Builds a simplified path representation using native types
         It's serializable (=
         """
-        _path = []
-        for n in path:
+        return [ASLDSearch._native_step(n) for n in path]
 
-            transition = None
-            if n.parent:
-                d = ""
-                if n.d is Direction.forward:
-                    d = ">"
-                else:
-                    d = "<"
-                transition = {
-                    "P": str(n.P),
-                    "d": d
-                }
-
-            step = {
-                "transition": transition,
-                "state": n.q.name,
-                "node": str(n.n)
+    @classmethod
+    def _native_step(cls, n):
+        """Serializable representation of a path's step (see _native_path)"""
+        transition = None
+        if n.parent:
+            d = ""
+            if n.d is Direction.forward:
+                d = ">"
+            else:
+                d = "<"
+            transition = {
+                "P": str(n.P),
+                "d": d
             }
-            _path.append(step)
 
-        return _path
+        return {
+            "transition": transition,
+            "state": n.q.name,
+            "node": str(n.n)
+        }
+
+    @classmethod
+    def _step_key(cls, n):
+        return n.h
+
+    @classmethod
+    def _source(cls, path) -> str:
+        """Start node of a path (its source, on multi-source searches)"""
+        return str(path[0].n)
 
     def test(self, parallelRequests=40,
-             limit_time=_L_TIME, limit_ans=_L_ANS, limit_triples=_L_TRIPLES):
-        """ Non-interactive runs """
+             limit_time=_L_TIME, limit_ans=_L_ANS, limit_triples=_L_TRIPLES, log=None):
+        """
+        Non-interactive runs
+
+        Given a log (NDJSONWriter, see asld.utils.writers), answers and stats are
+          written to it as they come instead of being returned.
+        """
+        # pylint: disable=too-many-arguments
         if limit_time is None:
             limit_time = float("inf")
         elif limit_time <= 0:
             limit_time = float("inf")
 
-        self._reset()
-
-        _ans = []
-        _t0 = time()
+        if not self.resumed:
+            self._reset()
+
+        out = log
+        if log is None  and  DUMP_DATA:
+            out = NDJSONWriter(DUMP_ANSWERS)
+        multiSource = len(self.queries) > 1
+        answers = None
+        if out is not None:
+            answers = PathWriter(out, ASLDSearch._step_key, ASLDSearch._native_step,
+                                 ASLDSearch._source if multiSource else None)
+        if log is not None:
+            self.stats.attach(log)
+        db = None
+        if DUMP_DATA:
+            # Triples are written as they are added (see ASLDGraph.dumpTo)
+            db = NTriplesWriter(DUMP_DB)
+            self.g.dumpTo(db)
+
+        ans = []
+        pathCount = 0
+        sources = {str(query.startNode): 0 for query in self.queries}
+        _t0 = self.clock()
         try:
 
             self.stats.tick()  # Adjust stats clock
@@ -855,31 +1957,38 @@ class ASLDSearch:
                                    limit_time=limit_time,
                                    limit_ans=limit_ans,
                                    limit_triples=limit_triples):
-                _ans.append(path)
+                pathCount += 1
+                sources[ASLDSearch._source(path)] += 1
+                if answers is not None:
+                    answers.write(path)
+                if log is None:
+                    ans.append(ASLDSearch._native_path(path))
                 # printPath(path)
 
         except KeyboardInterrupt:
             Color.BLUE.print("\nTerminating search.")
         #except Exception as e:
             #Color.RED.print("Terminated Search.test on: %s" % e)
-        t = time() - _t0
-
-        ans = [ASLDSearch._native_path(path) for path in _ans]
+        self.stats.stop()
+        self.open.close()
+        t = self.clock() - _t0
 
         Color.GREEN.print("\nSearch took %.2fs. Gathered %d triples and got back %d paths." %
                           (t,
-                           len(self.g), len(ans)))
+                           len(self.g), pathCount))
 
         if DUMP_DATA:
-            with open("last-db.json", 'w') as f:
-                db = [{"s": s, "p": p, "o": o} for (s,p,o) in self.g.g]
-                dump(db, f, indent=2)
-            with open("last-ans.json", 'w') as f:
-                dump(ans, f, indent=2)
+            if log is None:
+                out.close()
+            self.g.dumpTo(None)
+            db.close()
 
-        return {
+        result = {
             "Paths": ans,
-            "PathCount": len(ans),
-            "StatsHistory": [h.json() for h in self.stats.history],
+            "PathCount": pathCount,
+            "StatsHistory": self.stats.json(),
             "Time": t
         }
+        if multiSource:
+            result["Sources"] = sources
+        return result
@@ -0,0 +1,117 @@
+"""
+HTTP/JSON front end for the search service
+
+Serves on a TCP port (localhost) or on a UNIX socket:
+  GET  /queries  Sample queries, as {"queries": [{"id": k, "name": ..., "doc": ...}]}
+  GET  /stats    SearchService statistics
+  POST /query    Runs a query, streaming its records as NDJSON (see asld.utils.writers):
+                   {"id": k, "start": IRI}  (sample query, optionally on another start node)
+                   {"query": {...}}         (definition, see asld.service.build_query)
+                 Optional: "w", "alg", "parallelRequests", "limits": {"time", "ans", "triples"}
+"""
+import os
+
+from json import dumps, loads
+from socketserver import ThreadingMixIn, UnixStreamServer
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from asld.search import Algorithm, _L_TIME, _L_ANS, _L_TRIPLES
+from asld.service import SearchService, sample_query, build_query
+from asld.sample_queries import automatons
+from asld.utils.color_print import Color
+
+
+class SearchHandler(BaseHTTPRequestHandler):
+    """Handles requests to the server's SearchService"""
+
+    def log_message(self, format, *args):
+        # pylint: disable=redefined-builtin
+        Color.BLUE.print("[%s] %s" % (self.log_date_time_string(), format % args))
+
+    def address_string(self):
+        # UNIX sockets have no client address
+        return str(self.client_address[0]) if self.client_address else "local"
+
+
+    def _send_json(self, obj, code=200):
+        body = dumps(obj).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _error(self, code, message):
+        self._send_json({"error": message}, code)
+
+
+    def do_GET(self):
+        """Sample queries and statistics"""
+        # pylint: disable=invalid-name
+        if self.path == "/queries":
+            self._send_json({"queries": [{"id": k, "name": name, "doc": query.__doc__}
+                                         for (k, (query, name)) in enumerate(automatons)
+                                         if query is not None]})
+        elif self.path == "/stats":
+            self._send_json(self.server.service.json())
+        else:
+            self._error(404, "Unknown path '%s'" % self.path)
+
+    def do_POST(self):
+        """Runs a query"""
+        # pylint: disable=invalid-name
+        if self.path != "/query":
+            self._error(404, "Unknown path '%s'" % self.path)
+            return
+
+        try:
+            body = loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+            w = int(body.get("w", 1))
+            if "query" in body:
+                (query, name) = build_query(body["query"], w)
+            else:
+                (query, name) = sample_query(int(body["id"]), body.get("start"), w)
+            limits = body.get("limits", {})
+            params = {
+                "alg":              Algorithm.parse(body.get("alg", "a*")),
+                "parallelRequests": int(body.get("parallelRequests", 40)),
+                "limit_time":       limits.get("time", _L_TIME),
+                "limit_ans":        limits.get("ans", _L_ANS),
+                "limit_triples":    limits.get("triples", _L_TRIPLES)
+            }
+        except KeyError as e:
+            self._error(400, "Missing or unknown query: %s" % e)
+            return
+        except ValueError as e:
+            self._error(400, str(e))
+            return
+
+        job = self.server.service.start(query, name, **params)
+
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.end_headers()
+        try:
+            for record in job:
+                self.wfile.write(dumps(record).encode("utf-8"))
+                self.wfile.write(b"\n")
+                self.wfile.flush()
+        except (BrokenPipeError, ConnectionResetError):
+            job.cancel()
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    """ThreadingHTTPServer on a UNIX socket"""
+    daemon_threads = True
+
+
+def make_server(service: SearchService, port=8080, socket=None):
+    """Builds a server for a SearchService, on a UNIX socket if given (or on localhost:port)"""
+    if socket is not None:
+        if os.path.exists(socket):
+            os.remove(socket)
+        server = UnixHTTPServer(socket, SearchHandler)
+    else:
+        server = ThreadingHTTPServer(("127.0.0.1", port), SearchHandler)
+    server.service = service
+    return server
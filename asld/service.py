@@ -0,0 +1,315 @@
+"""
+Search service
+
+Runs many queries at once over a single triple store and a single fetch pool,
+  so concurrent searches reuse each other's data and requests.
+
+Searches run on their own threads, but only one does search work at a time
+  (they hold the service lock), the lock is released while a search waits
+  for answers.
+"""
+from time import sleep
+from queue import Queue, Empty
+from itertools import count
+from threading import Thread, Lock, Event
+
+from rdflib.term import URIRef
+
+from asld.graph import ASLDGraph, Backend
+from asld.async_fetch import AsyncFetchPool
+from asld.search import ASLDSearch, Algorithm, Fetcher
+from asld.search import _L_TIME, _L_ANS, _L_TRIPLES
+from asld.sample_queries import automatons
+from asld.query.query_builder import QueryBuilder
+from asld.query.filter import NodeFilter_any
+from asld.utils.writers import PathWriter
+from asld.utils.color_print import Color
+
+
+class Cancelled(Exception):
+    """Raised on a search whose client went away"""
+
+
+def sample_query(queryID: int, start=None, w=1):
+    """Builds a query of sample_queries.automatons (on another start node, if given)"""
+    if not 0 <= queryID < len(automatons)  or  automatons[queryID][0] is None:
+        raise KeyError("No sample query %s" % queryID)
+
+    (query, name) = automatons[queryID]
+    if start is None:
+        return (query(w=w), name)
+    return (query(URIRef(start), w=w), name)
+
+
+def build_query(definition: dict, w=1):
+    """
+    Builds a query from its json definition:
+      {"start": IRI, "initial": name,
+       "transitions": [{"from": name, "to": name,
+                        "through": [IRI, ...] | "not": [IRI, ...],  (any predicate if missing)
+                        "backwards": bool, "final": bool}, ...]}
+
+    Malformed definitions raise ValueError.
+    """
+    try:
+        b = QueryBuilder(URIRef(definition["start"]), definition.get("initial", "s0"))
+        for tr in definition["transitions"]:
+            s = b.frm(tr["from"])
+            if "through" in tr:
+                s = s.through(set(URIRef(p) for p in tr["through"]))
+            elif "not" in tr:
+                s = s.through_not(set(URIRef(p) for p in tr["not"]))
+
+            af = NodeFilter_any() if tr.get("final", False) else None
+            if tr.get("backwards", False):
+                s.backwards_to(tr["to"], None, af)
+            else:
+                s.to(tr["to"], None, af)
+
+        return (b.build(w), definition.get("name", "Custom"))
+    # pylint: disable=broad-except
+    except Exception as e:
+        raise ValueError("Invalid query definition: %s" % e) from e
+
+
+class SearchService:
+    """
+    Shared graph and AsyncFetchPool for many searches
+
+    Each search sees the fetch pool through a SearchService.Pool. Requests
+      are renumbered on the shared pool, and identical requests in flight are
+      sent once, their answer going to every search that asked for it.
+    Streaming is not used, as a request can't be shared once it sent chunks.
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    class Pool:
+        """A search's view of the service's fetch pool (see AsyncFetchPool)"""
+
+        def __init__(self, service):
+            self.service = service
+            self.answers = Queue()
+            self.cancelled = Event()
+            self.closed = False
+
+        def submit(self, requests, batches=()):
+            """Starts fetching requests and batches, their answers are taken with poll"""
+            self.service._submit(self, requests, batches)
+
+        def poll(self, timeout=None):
+            """
+            Takes the answers available, waiting up to timeout for the first one
+              (or until it arrives, if None). Other searches run meanwhile.
+            """
+            lock = self.service.lock
+            lock.release()
+            try:
+                if timeout is not None  and  timeout <= 0:
+                    sleep(0)  # Let other searches in
+                answers = []
+                try:
+                    item = self.answers.get(timeout is None  or  timeout > 0, timeout)
+                    while True:
+                        answers.append(item)
+                        item = self.answers.get_nowait()
+                except Empty:
+                    pass
+            finally:
+                lock.acquire()
+
+            if self.cancelled.is_set():
+                raise Cancelled()
+            return answers
+
+        def close(self):
+            """Detaches from the service (answers still in flight are dropped)"""
+            self.closed = True
+
+
+    class Job:
+        """A running search, its records are taken as they are written"""
+
+        def __init__(self, pool):
+            self.pool = pool
+            self.records = Queue()
+            self.thread = None
+
+        def write(self, obj):
+            """Adds a record (NDJSONWriter interface)"""
+            self.records.put(obj)
+
+        def __iter__(self):
+            """Yields the records (run, step, path, stats and result) until the search ends"""
+            while True:
+                record = self.records.get()
+                if record is None:
+                    return
+                yield record
+
+        def cancel(self):
+            """Stops the search at its next wait"""
+            self.pool.cancelled.set()
+
+
+    def __init__(self, parallelRequests=200, parsers=2, backend=Backend.RDFLib, timeout=15):
+        self.parallelRequests = parallelRequests
+        self.g = ASLDGraph(backend)
+        self.fetchPool = AsyncFetchPool(parallelRequests, parsers=parsers, timeout=timeout)
+        self.lock = Lock()  # Held by the search doing work
+
+        self._mutex = Lock()  # Routes and counters
+        self._routes = {}   # shared index -> (request key, [(Pool, index)])
+        self._pending = {}  # request key -> shared index
+        self._indices = count()
+
+        self.queries = 0
+        self.active = 0
+        self.requests = 0  # Requests sent
+        self.shared = 0    # Requests answered by a request of another search
+
+        self._stop = Event()
+        self._router = Thread(target=self._route, daemon=True)
+        self._router.start()
+
+    def __str__(self):
+        return "SearchService<queries: %d, requests: %d, shared: %d>" % (self.queries,
+                                                                         self.requests,
+                                                                         self.shared)
+
+    def close(self):
+        """Stops routing answers and closes the fetch pool"""
+        self._stop.set()
+        self._router.join()
+        self.fetchPool.close()
+
+
+    def _submit(self, pool, requests, batches):
+        """Renumbers requests and batches for the shared pool, joining identical ones"""
+        renumbered = []
+        with self._mutex:
+            for (iri, i, queryString) in requests:
+                key = (iri, queryString)
+                k = self._pending.get(key)
+                if k is not None:
+                    self._routes[k][1].append((pool, i))
+                    self.shared += 1
+                    continue
+                k = next(self._indices)
+                self._pending[key] = k
+                self._routes[k] = (key, [(pool, i)])
+                renumbered.append((iri, k, queryString))
+
+            renumberedBatches = []
+            for (reqs, batchFormat) in batches:
+                batch = []
+                for (iri, i, queryString) in reqs:
+                    k = next(self._indices)
+                    self._routes[k] = (None, [(pool, i)])
+                    batch.append((iri, k, queryString))
+                renumberedBatches.append((batch, batchFormat))
+
+            self.requests += len(renumbered) + sum(len(reqs) for (reqs, _) in batches)
+
+        self.fetchPool.submit(renumbered, renumberedBatches)
+
+    def _route(self):
+        """Hands the shared pool's answers to the searches that asked for them"""
+        while not self._stop.is_set():
+            for reqAns in self.fetchPool.poll(0.5):
+                with self._mutex:
+                    (key, targets) = self._routes.pop(reqAns.index)
+                    if key is not None:
+                        del self._pending[key]
+
+                for (pool, i) in targets:
+                    if not pool.closed:
+                        pool.answers.put(ASLDGraph.RequestAnswer(reqAns.data, reqAns.size,
+                                                                 reqAns.iri, i, reqAns.reqTime,
+                                                                 reqAns.cached))
+
+
+    def start(self, query, name="", alg=Algorithm.AStar, parallelRequests=40,
+              limit_time=_L_TIME, limit_ans=_L_ANS, limit_triples=_L_TRIPLES):
+        """
+        Starts a search on its own thread, returns its Job.
+
+        Records are written as on run logs (see asld.utils.writers).
+        The triples limit counts the triples each search fetched (not the
+          shared graph, which keeps every search's).
+        """
+        # pylint: disable=too-many-arguments
+        job = SearchService.Job(SearchService.Pool(self))
+        job.write({"run": {
+            "query": name,
+            "params": {
+                "limits": {
+                    "time":    limit_time,
+                    "triples": limit_triples,
+                    "ans":     limit_ans,
+                },
+                "algorithm":        Algorithm.to_string(alg),
+                "parallelRequests": parallelRequests,
+            }
+        }})
+
+        job.thread = Thread(target=self._run, daemon=True,
+                            args=(job, query, alg, parallelRequests,
+                                  limit_time, limit_ans, limit_triples))
+        job.thread.start()
+        return job
+
+    def _run(self, job, query, alg, parallelRequests, limit_time, limit_ans, limit_triples):
+        """Runs a search, writing its records on the Job"""
+        # pylint: disable=too-many-arguments
+        with self._mutex:
+            self.queries += 1
+            self.active += 1
+        pathCount = 0
+        search = None
+        try:
+            with self.lock:
+                search = ASLDSearch(query, alg=alg, fetcher=Fetcher.AsyncIO,
+                                    graph=self.g, pool=job.pool)
+                search._setup_search()  # pylint: disable=protected-access
+                answers = PathWriter(job, ASLDSearch._step_key, ASLDSearch._native_step)
+
+                search.stats.tick()
+                for path in search.paths(parallelRequests, parallelRequests,
+                                         limit_time=limit_time,
+                                         limit_ans=limit_ans,
+                                         limit_triples=limit_triples):
+                    pathCount += 1
+                    answers.write(path)
+                    if job.pool.cancelled.is_set():
+                        break
+        except Cancelled:
+            Color.BLUE.print("\nA client left, its search was stopped")
+        # pylint: disable=broad-except
+        except Exception as e:
+            Color.RED.print("\nA search terminated on: (%s) %s" % (type(e), e))
+        finally:
+            job.pool.close()
+            with self._mutex:
+                self.active -= 1
+
+            if search is not None:
+                search.stats.stop()
+                search.open.close()
+                job.write({"stats": search.stats.status.json()})
+                job.write({"result": {"PathCount": pathCount,
+                                      "Time": search.stats.wallClock()}})
+            job.write(None)
+
+    def json(self) -> dict:
+        """Service statistics"""
+        with self.lock:
+            triples = len(self.g)
+            loaded = len(self.g.loaded)
+        return {
+            "queries":  self.queries,
+            "active":   self.active,
+            "requests": self.requests,
+            "shared":   self.shared,
+            "triples":  triples,
+            "loaded":   loaded
+        }
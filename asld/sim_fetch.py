@@ -0,0 +1,119 @@
+"""
+Simulated fetcher
+
+Answers are served from the persistent cache and request latencies are
+  simulated on a virtual clock, instead of being waited for.
+"""
+import heapq
+
+from time import time
+from itertools import count
+from random import Random
+
+from asld.graph import ASLDGraph
+from asld.utils.virtual_clock import VirtualClock
+from asld.utils.color_print import Color
+
+
+class SimulatedFetchPool:
+    """
+    Discrete-event simulation of a pool with `slots` requests in flight.
+
+    Requests and batches are as for AsyncFetchPool. Each one takes a latency
+      sampled from the delay data (see ASLDGraph.sample_delay), so runs with
+      the same seed get the same timing.
+    Answers missing from the cache are empty (counted as misses), or fetched
+      for real if `live`: one at a time on the search's thread, only their
+      time is discounted.
+    When replaying a request archive, answers and latencies come from it instead
+      (see ASLDGraph.replay).
+    """
+
+    def __init__(self, slots, clock: VirtualClock, live=False, seed=0):
+        self.slots = max(1, slots)
+        self.clock = clock
+        self.live = live
+        self.rng = Random(seed)
+
+        self.misses = 0  # Requests not found on the cache
+
+        self.free = [0.0] * self.slots  # Time each slot becomes free
+        self.events = []                # heap of (end, seq, start, answers)
+        self._seq = count()
+
+    def __str__(self):
+        return "SimulatedFetchPool<slots: %d, misses: %d>" % (self.slots, self.misses)
+
+
+    def map(self, requests, batches=()):
+        """Simulates lists of requests and batches, yielding answers as they complete"""
+        self.submit(requests, batches)
+        while self.events:
+            yield from self.poll()
+
+    def submit(self, requests, batches=()):
+        """Starts requests and batches at the current virtual time, see poll"""
+        jobs = [[req] for req in requests] + [list(reqs) for (reqs, _) in batches]
+
+        # Lookups happen on the workers of a real pool, off the search's clock
+        _t0 = time()
+        answers = [[self._load(req) for req in job] for job in jobs]
+        self.clock.discount(time() - _t0)
+
+        # Jobs take the first free slot
+        now = self.clock()
+        for job in answers:
+            start = max(now, heapq.heappop(self.free))
+            latency = max((t for (_, _, _, _, t) in job if t is not None), default=None)
+            if latency is None:
+                latency = ASLDGraph.sample_delay(self.rng)
+            end = start + latency
+            heapq.heappush(self.free, end)
+            heapq.heappush(self.events, (end, next(self._seq), start, job))
+
+    def poll(self, timeout=None):
+        """
+        Takes the answers of the jobs done by now, waiting (virtually) up to
+          timeout for the first one (or until it's done, if None).
+        """
+        if self.events:
+            end = self.events[0][0]
+            if timeout is not None:
+                end = min(end, self.clock() + timeout)
+            self.clock.wait_until(end)
+
+        answers = []
+        now = self.clock()
+        while self.events  and  self.events[0][0] <= now:
+            (end, _, start, job) = heapq.heappop(self.events)
+            for (data, size, iri, i, _) in job:
+                answers.append(ASLDGraph.RequestAnswer(data, size, iri, i, end-start))
+        return answers
+
+    def close(self):
+        """Nothing to release"""
+
+
+    def _load(self, req):
+        """
+        Returns the (packed graph, size, IRI, index, latency) answer for a request
+        (latency is None unless replayed)
+        """
+        (iri, i, queryString) = req
+        if ASLDGraph.replays():
+            reqAns = ASLDGraph.replay(req)
+            return (reqAns.data, reqAns.size, iri, i, reqAns.reqTime)
+
+        answer = ASLDGraph.cached_answer(iri, queryString)
+        if answer is None:
+            if not self.misses  and  not self.live:
+                Color.YELLOW.print("\nAnswers missing from the cache are empty on simulations "
+                                   "(first: '%s')" % iri)
+            self.misses += 1
+            answer = (b"", 0)
+            if self.live:
+                reqAns = ASLDGraph.pure_loadB(req)
+                answer = (reqAns.data, reqAns.size)
+
+        (data, size) = answer
+        return (data, size, iri, i, None)
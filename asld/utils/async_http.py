@@ -0,0 +1,314 @@
+"""
+Minimal asyncio HTTP/1.1 client
+
+Just enough HTTP for dereferencing Linked Data and querying SPARQL endpoints
+  without spending an OS process (or thread) per request in flight.
+"""
+import asyncio
+
+from ssl import create_default_context
+from urllib.parse import urlsplit, urljoin
+
+
+REDIRECTS = (301, 302, 303, 307, 308)
+NO_BODY = (204, 304)
+
+_SSL_CONTEXT = None
+
+
+def ssl_context():
+    """Shared SSL context"""
+    # pylint: disable=global-statement
+    global _SSL_CONTEXT
+    if _SSL_CONTEXT is None:
+        _SSL_CONTEXT = create_default_context()
+    return _SSL_CONTEXT
+
+
+class HTTPResponse:
+    """
+    Received answer
+    Acts as a named tuple
+    """
+    # pylint: disable=too-few-public-methods
+
+    def __init__(self, url, status, headers, body):
+        self.url = url
+        self.status = status
+        self.headers = headers  # lower-case names
+        self.body = body
+
+    def __str__(self):
+        return "HTTPResponse<%d %s>" % (self.status, self.url)
+
+    def content_type(self) -> str:
+        """Media type, without parameters"""
+        return self.headers.get("content-type", "").split(";")[0].strip().lower()
+
+
+class HTTPStream(HTTPResponse):
+    """
+    Received answer whose body is read as it arrives (body stays None)
+
+    The connection goes back to its pool once the body is fully read,
+      streams that are abandoned must be closed.
+    """
+
+    def __init__(self, url, status, headers, method, pool, conn):
+        # pylint: disable=too-many-arguments
+        super().__init__(url, status, headers, None)
+        self.method = method
+        self._pool = pool
+        self._conn = conn  # (scheme, netloc, reader, writer, reused)
+
+    def __str__(self):
+        return "HTTPStream<%d %s>" % (self.status, self.url)
+
+    @property
+    def reused(self) -> bool:
+        """Checks if the request was sent on an already open connection"""
+        return self._conn is not None  and  self._conn[4]
+
+    async def chunks(self, chunkSize=1 << 16):
+        """Yields the body as it arrives"""
+        (scheme, netloc, reader, writer, _) = self._conn
+        try:
+            async for chunk in iter_body(reader, self.status, self.headers, self.method, chunkSize):
+                yield chunk
+        except BaseException:
+            self.close()
+            raise
+
+        self._conn = None
+        if _reusable(self.status, self.headers, self.method):
+            self._pool._release(scheme, netloc, reader, writer)  # pylint: disable=protected-access
+        else:
+            writer.close()
+
+    async def read(self) -> bytes:
+        """Reads the whole body"""
+        return b"".join([chunk async for chunk in self.chunks()])
+
+    def close(self):
+        """Drops the connection if the body wasn't fully read"""
+        if self._conn is not None:
+            self._conn[3].close()
+            self._conn = None
+
+
+async def _read_head(reader):
+    """Reads the status line and the headers"""
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError("Connection closed before the response")
+
+    status = int(line.split()[1])
+
+    headers = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        (name, _, value) = line.decode("latin-1").partition(":")
+        name = name.strip().lower()
+        value = value.strip()
+        if name in headers:
+            headers[name] += ", " + value
+        else:
+            headers[name] = value
+
+    return (status, headers)
+
+
+async def iter_body(reader, status, headers, method="GET", chunkSize=1 << 16):
+    """Yields the body as it arrives"""
+    if method == "HEAD"  or  status in NO_BODY  or  100 <= status < 200:
+        return
+
+    if "chunked" in headers.get("transfer-encoding", "").lower():
+        while True:
+            line = await reader.readline()
+            size = int(line.split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                # Skip trailers
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass
+                return
+            yield await reader.readexactly(size)
+            await reader.readline()
+
+    elif "content-length" in headers:
+        left = int(headers["content-length"])
+        while left > 0:
+            chunk = await reader.read(min(left, chunkSize))
+            if not chunk:
+                raise ConnectionError("Connection closed with %d bytes missing" % left)
+            left -= len(chunk)
+            yield chunk
+
+    else:
+        while True:
+            chunk = await reader.read(chunkSize)
+            if not chunk:
+                return
+            yield chunk
+
+
+def _request_head(method, url, headers, body) -> bytes:
+    """Serializes the request line and headers"""
+    u = urlsplit(url)
+    path = u.path or "/"
+    if u.query:
+        path += "?" + u.query
+
+    lines = ["%s %s HTTP/1.1" % (method, path),
+             "Host: %s" % u.netloc,
+             "Connection: keep-alive"]
+    for (name, value) in (headers or {}).items():
+        lines.append("%s: %s" % (name, value))
+    if body is not None:
+        lines.append("Content-Length: %d" % len(body))
+
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+def _reusable(status, headers, method) -> bool:
+    """Checks if the connection can take another request after this response"""
+    if headers.get("connection", "").lower() == "close":
+        return False
+    if method == "HEAD"  or  status in NO_BODY  or  100 <= status < 200:
+        return True
+    return ("chunked" in headers.get("transfer-encoding", "").lower()
+            or  "content-length" in headers)
+
+
+class AsyncHTTPPool:
+    """
+    Per-host pool of keep-alive connections (asyncio)
+
+    Connections exceeding the host's pool size are opened as needed and closed
+      after being used. Must be used from a single event loop.
+    """
+
+    def __init__(self, size=8, sizes=None):
+        self.size = size
+        self.sizes = sizes or {}  # netloc -> Idle connections kept
+        self._idle = {}  # (scheme, netloc) -> [(reader, writer)]
+
+        self.opened = 0  # Connections established
+        self.reused = 0  # Requests sent on an already open connection
+
+    def __str__(self):
+        return "AsyncHTTPPool<opened: %d, reused: %d>" % (self.opened, self.reused)
+
+
+    async def _acquire(self, scheme, netloc, host, port):
+        """Returns a (reader, writer, reused) triple"""
+        idle = self._idle.get((scheme, netloc))
+        while idle:
+            (reader, writer) = idle.pop()
+            if reader.at_eof()  or  writer.is_closing():
+                writer.close()
+                continue
+            self.reused += 1
+            return (reader, writer, True)
+
+        self.opened += 1
+        (reader, writer) = await asyncio.open_connection(
+            host, port, ssl=ssl_context() if scheme == "https" else None)
+        return (reader, writer, False)
+
+    def _release(self, scheme, netloc, reader, writer):
+        idle = self._idle.setdefault((scheme, netloc), [])
+        if len(idle) < self.sizes.get(netloc, self.size):
+            idle.append((reader, writer))
+        else:
+            writer.close()
+
+    def close(self):
+        """Closes idle connections"""
+        for idle in self._idle.values():
+            for (_, writer) in idle:
+                writer.close()
+        self._idle = {}
+
+
+    async def _open_once(self, method, url, headers, body) -> HTTPStream:
+        """Sends a request and reads the head of its response"""
+        u = urlsplit(url)
+        https = u.scheme == "https"
+        port = u.port or (443 if https else 80)
+
+        while True:
+            (reader, writer, reused) = await self._acquire(u.scheme, u.netloc, u.hostname, port)
+            try:
+                writer.write(_request_head(method, url, headers, body))
+                if body is not None:
+                    writer.write(body)
+                await writer.drain()
+
+                (status, rheaders) = await _read_head(reader)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if reused:
+                    continue  # The server dropped an idle connection
+                raise
+            except BaseException:
+                # Cancelled (or timed out) mid-response
+                writer.close()
+                raise
+
+            return HTTPStream(url, status, rheaders, method, self,
+                              (u.scheme, u.netloc, reader, writer, reused))
+
+    async def _request_once(self, method, url, headers, body) -> HTTPResponse:
+        while True:
+            res = await self._open_once(method, url, headers, body)
+            try:
+                data = await res.read()
+            except (ConnectionError, asyncio.IncompleteReadError):
+                if res.reused:
+                    continue  # The server dropped an idle connection
+                raise
+            return HTTPResponse(url, res.status, res.headers, data)
+
+    async def request(self, method, url, headers=None, body=None, redirects=5) -> HTTPResponse:
+        """
+        Sends a request following redirects
+
+        Returns the last HTTPResponse (its url is the redirect target)
+        """
+        # pylint: disable=too-many-arguments
+        res = None
+        for _ in range(redirects+1):
+            res = await self._request_once(method, url, headers, body)
+
+            if res.status not in REDIRECTS  or  "location" not in res.headers:
+                break
+
+            url = urljoin(url, res.headers["location"])
+            if res.status == 303  or  (res.status in (301, 302) and method == "POST"):
+                method = "GET"
+                body = None
+        return res
+
+    async def open(self, method, url, headers=None, body=None, redirects=5) -> HTTPStream:
+        """
+        Sends a request following redirects, without reading the last body
+
+        Returns the last HTTPStream (its url is the redirect target)
+        """
+        # pylint: disable=too-many-arguments
+        res = None
+        for _ in range(redirects+1):
+            res = await self._open_once(method, url, headers, body)
+
+            if res.status not in REDIRECTS  or  "location" not in res.headers:
+                break
+            await res.read()
+
+            url = urljoin(url, res.headers["location"])
+            if res.status == 303  or  (res.status in (301, 302) and method == "POST"):
+                method = "GET"
+                body = None
+        return res
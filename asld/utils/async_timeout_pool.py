@@ -3,6 +3,10 @@ Asynchronous Pool with Timeouts
 """
 
 from time import time
+from queue import Queue, Empty
+from functools import partial
+from itertools import count
+from threading import Lock
 from multiprocessing import Pool
 from multiprocessing.context import TimeoutError as TLE
 from signal import SIGINT, SIG_IGN, signal
@@ -20,6 +24,12 @@ class AsyncTimeOutPool:
     def __init__(self, pool_size, timeout=60):
         self.pool = Pool(pool_size, AsyncTimeOutPool.ignoreSIGINT)  # Workaround python mp bug
         self.timeout = timeout
+        self.outcomes = Queue()  # Calls made through submit
+
+        # Calls not finished yet, given up (with a TimeoutError) after timeout
+        self.pending = {}  # call number -> (argument, submit time), oldest first
+        self._calls = count()
+        self._lock = Lock()
 
     def map(self, fun, requests):
         """Maps f onto a list"""
@@ -38,6 +48,56 @@ class AsyncTimeOutPool:
                 Color.RED.print("\nA map result terminated on: (%s) %s" % (type(e), e))
                 continue
 
+    def submit(self, fun, arg):
+        """Calls f on an argument, its outcome is taken with poll"""
+        k = next(self._calls)
+        with self._lock:
+            self.pending[k] = (arg, time())
+        self.pool.apply_async(fun, (arg,),
+                              callback=partial(self._outcome, k, arg, error=None),
+                              error_callback=partial(self._outcome, k, arg, None))
+
+    def _outcome(self, k, arg, result, error):
+        with self._lock:
+            if self.pending.pop(k, None) is None:
+                return  # Given up already
+        self.outcomes.put((arg, result, error))
+
+    def _expire(self):
+        """Gives up the calls older than timeout, returns the time until the next expires"""
+        now = time()
+        with self._lock:
+            for (k, (arg, t0)) in list(self.pending.items()):
+                if now - t0 < self.timeout:
+                    return t0 + self.timeout - now
+                del self.pending[k]
+                self.outcomes.put((arg, None, TimeoutError("No answer after %ds" % self.timeout)))
+        return None
+
+    def poll(self, timeout=None):
+        """
+        Takes the (argument, result, exception) outcomes of finished calls, waiting
+          up to timeout for the first one (or until it arrives, if None).
+        Calls running for longer than the pool's timeout fail with a TimeoutError.
+        """
+        deadline = None if timeout is None else time() + timeout
+        outcomes = []
+        while not outcomes:
+            wait = self._expire()
+            if deadline is not None:
+                left = max(0, deadline - time())
+                wait = left if wait is None else min(wait, left)
+            try:
+                outcome = self.outcomes.get(wait is None  or  wait > 0, wait)
+                while True:
+                    outcomes.append(outcome)
+                    outcome = self.outcomes.get_nowait()
+            except Empty:
+                pass
+            if deadline is not None  and  time() >= deadline:
+                break
+        return outcomes
+
     def close(self):
         """Ends the process pool"""
         self.pool.close()
@@ -0,0 +1,34 @@
+"""
+Search checkpoints
+
+A checkpoint is a compressed pickle of a search's state. It is written to a
+  temporary file and moved over the previous one, so a run killed while
+  writing keeps its last complete checkpoint.
+"""
+import os
+import zlib
+import pickle
+
+
+MAGIC = b"ASLD-CHECKPOINT-1\n"
+
+
+def save(path, state):
+    """Writes a checkpoint atomically, returns its size in bytes"""
+    data = zlib.compress(pickle.dumps(state, pickle.HIGHEST_PROTOCOL))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(MAGIC)
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return len(MAGIC) + len(data)
+
+
+def load(path):
+    """Reads a checkpoint (ValueError if the file isn't one)"""
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise ValueError("'%s' is not a search checkpoint" % path)
+        return pickle.loads(zlib.decompress(f.read()))
@@ -0,0 +1,151 @@
+"""
+Request costs learned across runs
+
+Searches record the latency of their requests and the fanout of the documents
+  they get, by host and predicate. The statistics are kept on a JSON file, so
+  later runs can tell expensive directions apart before sending a request.
+"""
+import os
+
+from json import dump, load
+
+from rdflib.term import URIRef
+
+from asld.utils.heap import Heap
+
+
+INFTY = float("inf")
+
+
+class CostModel:
+    """
+    Per host and predicate request statistics
+
+    For each host: requests timed, their total time and documents seen.
+    For each (host, predicate): requests for nodes reached through the predicate,
+      their total time, and triples using the predicate on the host's documents
+      (its fanout, once divided by the documents).
+
+    Estimates are optimistic: a predicate costs its cheapest host, and hosts never
+      seen cost as much as the cheapest known one (nothing when none is known).
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.hosts = {}       # host -> [requests, seconds, documents]
+        self.predicates = {}  # host -> {predicate -> [requests, seconds, triples]}
+
+        if path is not None  and  os.path.exists(path):
+            with open(path) as f:
+                stats = load(f)
+            self.hosts = stats["hosts"]
+            self.predicates = stats["predicates"]
+
+    def __str__(self):
+        return "CostModel<hosts: %d, predicates: %d>" % (
+            len(self.hosts), sum(len(ps) for ps in self.predicates.values()))
+
+    def save(self, path=None):
+        """Writes the statistics (atomically, over the file they were loaded from by default)"""
+        path = path or self.path
+        tmp = path + ".tmp"
+        with open(tmp, "w") as f:
+            dump({"hosts": self.hosts, "predicates": self.predicates}, f)
+        os.replace(tmp, path)
+
+
+    def request(self, host, predicates, seconds):
+        """Records a request to a host, for a node reached through the predicates"""
+        stats = self.hosts.setdefault(host, [0, 0.0, 0])
+        stats[0] += 1
+        stats[1] += seconds
+
+        byPredicate = self.predicates.setdefault(host, {})
+        for P in predicates:
+            stats = byPredicate.setdefault(str(P), [0, 0.0, 0])
+            stats[0] += 1
+            stats[1] += seconds
+
+    def document(self, host, triples):
+        """Records a document from a host, triples maps predicates to their uses on it"""
+        self.hosts.setdefault(host, [0, 0.0, 0])[2] += 1
+
+        byPredicate = self.predicates.setdefault(host, {})
+        for (P, n) in triples.items():
+            byPredicate.setdefault(str(P), [0, 0.0, 0])[2] += n
+
+
+    def latency(self, host):
+        """Mean latency of a host [s] (the least known, if it was never timed)"""
+        stats = self.hosts.get(host)
+        if stats is None  or  not stats[0]:
+            return self.floor()
+        return stats[1] / stats[0]
+
+    def floor(self) -> float:
+        """Least mean latency of a host [s] (0 if none was timed)"""
+        return min((s / n for (n, s, _) in self.hosts.values() if n), default=0.0)
+
+    def fanout(self, host, P) -> float:
+        """Mean triples using a predicate on a host's documents"""
+        documents = self.hosts.get(host, (0, 0, 0))[2]
+        stats = self.predicates.get(host, {}).get(str(P))
+        if stats is None  or  not documents:
+            return 0.0
+        return stats[2] / documents
+
+    def predicateLatencies(self) -> dict:
+        """Least mean latency of the nodes reached through each predicate, by host"""
+        latencies = {}
+        for byPredicate in self.predicates.values():
+            for (P, (n, s, _)) in byPredicate.items():
+                if n:
+                    latencies[URIRef(P)] = min(s / n, latencies.get(URIRef(P), INFTY))
+        return latencies
+
+
+    def predicateFanouts(self) -> dict:
+        """Least fanout of each predicate, by host"""
+        fanouts = {}
+        for (host, byPredicate) in self.predicates.items():
+            for P in byPredicate:
+                f = self.fanout(host, P)
+                fanouts[URIRef(P)] = min(f, fanouts.get(URIRef(P), INFTY))
+        return fanouts
+
+    def estimates(self, query) -> dict:
+        """
+        Time [s] in requests from each State of a Query to a final one
+          (not counting the node on the State itself)
+
+        As the heuristic on QueryBuilder.build, but a step costs the latency of
+          the predicates its Transition allows times their fanout (a request per
+          node reached, at least one), and stepping on a final State is free (the
+          goal is declared before its node is requested).
+        """
+        latencies = self.predicateLatencies()
+        fanouts = self.predicateFanouts()
+        floor = self.floor()
+
+        def stepCost(t):
+            return min((l * max(1.0, fanouts.get(P, 1.0)) for (P, l) in latencies.items()
+                        if t(P)),
+                       default=floor)
+
+        costs = {s: INFTY for s in query.states.values()}
+        _open = Heap()
+        for s in query.states.values():
+            if s.isFinal():
+                costs[s] = 0.0
+                _open.push(0.0, s)
+
+        while _open:
+            (c, s) = _open.pop()
+            if c > costs[s]:
+                continue
+            for t in s.prev_transitions_f | s.prev_transitions_b:
+                cT = c if s.isFinal() else c + stepCost(t)
+                if cT < costs[t.src]:
+                    costs[t.src] = cT
+                    _open.push(cT, t.src)
+        return costs
@@ -0,0 +1,177 @@
+"""
+Persistent on-disk cache for fetched documents and SPARQL answers
+"""
+import os
+import sqlite3
+
+from threading import local
+from time import time
+from hashlib import sha1
+
+
+RECOUNT_PUTS = 256  # Puts between exact counts of the cache size
+
+
+class DocumentCache:
+    """
+    Content-addressed store of already parsed answers
+
+    Entries are keyed by (IRI, SPARQL query, endpoint) and hold an opaque compact
+      payload (ASLDGraph packs triples as compressed N-Triples), along with the
+      validators (ETag/Last-Modified) sent by the server.
+
+    The store is bounded by size, evicting least recently used entries first.
+    Connections are opened lazily on each process (and thread), so a cache can
+      be shared with forked workers.
+    """
+
+    class Entry:
+        """
+        Cached answer
+        Acts as a named tuple
+        """
+        # pylint: disable=too-few-public-methods
+
+        def __init__(self, key, data, stored, etag, modified):
+            # pylint: disable=too-many-arguments
+            self.key = key
+            self.data = data
+            self.stored = stored
+            self.etag = etag
+            self.modified = modified
+
+        def __len__(self):
+            return len(self.data)
+
+        def isFresh(self, ttl) -> bool:
+            """Checks if the entry can be used without revalidation"""
+            return ttl is None  or  time() - self.stored <= ttl
+
+
+    _SCHEMA = """
+    create table if not exists entries (
+      key      text primary key,
+      iri      text,
+      endpoint text,
+      stored   real,
+      used     real,
+      size     integer,
+      etag     text,
+      modified text,
+      data     blob
+    )
+    """
+
+    def __init__(self, path, max_size=1 << 30, ttl=7*24*3600):
+        self.path = path
+        self.max_size = max_size
+        self.ttl = ttl
+
+        os.makedirs(path, mode=0o777, exist_ok=True)
+        self._local = local()
+
+    def __str__(self):
+        return "DocumentCache<%s>" % self.path
+
+    def __getstate__(self):
+        # Connections can't cross process boundaries
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = local()
+
+
+    @classmethod
+    def key(cls, iri, queryString="", endpoint="") -> str:
+        """Builds the content address for a request"""
+        h = sha1()
+        for part in (iri, queryString, endpoint):
+            h.update(str(part or "").encode("utf-8"))
+            h.update(b"\0")
+        return h.hexdigest()
+
+
+    def _conn(self):
+        """Connection for the current process and thread"""
+        conn = self._local
+        if getattr(conn, "pid", None) != os.getpid():
+            conn.db = sqlite3.connect(os.path.join(self.path, "cache.sqlite"),
+                                      timeout=60, isolation_level=None)
+            conn.db.execute("pragma journal_mode=wal")
+            conn.db.execute(DocumentCache._SCHEMA)
+            conn.pid = os.getpid()
+            conn.size = None  # Payload bytes, as last counted plus this connection's puts
+            conn.puts = 0
+        return conn.db
+
+    def __len__(self):
+        (n,) = self._conn().execute("select count(*) from entries").fetchone()
+        return n
+
+    def size(self) -> int:
+        """Bytes used by the payloads"""
+        (s,) = self._conn().execute("select coalesce(sum(size), 0) from entries").fetchone()
+        return s
+
+
+    def get(self, key):
+        """Returns the Entry for a key (or None), marking it as recently used"""
+        db = self._conn()
+        row = db.execute("select data, stored, etag, modified from entries where key=?",
+                         (key,)).fetchone()
+        if row is None:
+            return None
+
+        db.execute("update entries set used=? where key=?", (time(), key))
+        (data, stored, etag, modified) = row
+        return DocumentCache.Entry(key, data, stored, etag, modified)
+
+    def put(self, key, data, iri="", endpoint="", etag=None, modified=None):
+        """Stores an answer, evicting old entries if needed"""
+        # pylint: disable=too-many-arguments
+        now = time()
+        db = self._conn()
+        old = db.execute("select size from entries where key=?", (key,)).fetchone()
+        db.execute(
+            "insert or replace into entries values (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (key, str(iri), endpoint, now, now, len(data), etag, modified, data))
+
+        # Other processes also put entries: the size is recounted every
+        #  RECOUNT_PUTS puts, and before evicting
+        conn = self._local
+        conn.puts += 1
+        if conn.size is None  or  conn.puts % RECOUNT_PUTS == 0:
+            conn.size = self.size()
+        else:
+            conn.size += len(data) - (old[0] if old else 0)
+        if conn.size > self.max_size:
+            conn.size = self.size()
+            self._evict()
+
+    def touch(self, key):
+        """Renews a revalidated entry"""
+        now = time()
+        self._conn().execute("update entries set stored=?, used=? where key=?", (now, now, key))
+
+    def _evict(self):
+        """Removes least recently used entries until the size bound holds"""
+        db = self._conn()
+        excess = self._local.size - self.max_size
+        while excess > 0:
+            victims = db.execute("select key, size from entries order by used limit 64").fetchall()
+            if not victims:
+                break
+            for (key, size) in victims:
+                db.execute("delete from entries where key=?", (key,))
+                self._local.size -= size
+                excess -= size
+                if excess <= 0:
+                    break
+
+    def clear(self):
+        """Drops every entry"""
+        self._conn().execute("delete from entries")
+        self._local.size = 0
@@ -1,7 +1,14 @@
 """
 Wrapper for heap
 """
+import os
 import heapq
+import shutil
+import tempfile
+
+from array import array
+from struct import Struct
+from itertools import islice
 
 
 class Heap:
@@ -47,3 +54,372 @@ class MaxHeap(Heap):
     def pop(self):
         (k, v) = heapq.heappop(self.heap)
         return (-k, v)
+
+
+class BucketQueue:
+    """
+    Two-level bucket queue for (primary, secondary) keys (secondary ones may be pairs).
+
+    Values are bucketed by primary key, then by secondary key, and leave their
+      bucket in insertion order, so values are never compared.
+    Pushing a value already queued moves it (decrease-key), so open holds no
+      stale duplicates.
+
+    Only the few distinct keys are kept on heaps, so operations are O(1) in the
+      number of values.
+    Acts as Heap
+    """
+
+    def __init__(self):
+        self.buckets = {}   # primary -> secondary -> {value: None} (ordered set)
+        self.primary = []   # heap of primary keys with a bucket
+        self.secondary = {} # primary -> heap of secondary keys with a bucket
+        self.where = {}     # value -> key
+
+    def __bool__(self):
+        return bool(self.where)
+
+    def __len__(self):
+        return len(self.where)
+
+    def __contains__(self, v):
+        return v in self.where
+
+    def _top(self):
+        """(primary, secondary) key of the first non empty bucket"""
+        k1 = self.primary[0]
+        return (k1, self.secondary[k1][0])
+
+    def peek(self):
+        k = self._top()
+        return (k, next(iter(self.buckets[k[0]][k[1]])))
+
+    def peekValue(self):
+        (_, v) = self.peek()
+        return v
+
+    def peekKey(self):
+        return self._top()
+
+    def push(self, k, v):
+        """Queues v with key k (moving it if it was already queued)"""
+        old = self.where.get(v)
+        if old is not None:
+            if old == k:
+                return
+            self._remove(old, v)
+
+        (k1, k2) = k
+        layer = self.buckets.get(k1)
+        if layer is None:
+            layer = self.buckets[k1] = {}
+            self.secondary[k1] = []
+            heapq.heappush(self.primary, k1)
+        bucket = layer.get(k2)
+        if bucket is None:
+            bucket = layer[k2] = {}
+            heapq.heappush(self.secondary[k1], k2)
+
+        bucket[v] = None
+        self.where[v] = k
+
+    def _remove(self, k, v):
+        """Takes v out of its bucket, dropping the emptied buckets"""
+        (k1, k2) = k
+        layer = self.buckets[k1]
+        bucket = layer[k2]
+        del bucket[v]
+        del self.where[v]
+        if bucket:
+            return
+
+        del layer[k2]
+        keys2 = self.secondary[k1]
+        if keys2[0] == k2:
+            heapq.heappop(keys2)
+        else:
+            keys2.remove(k2)
+            heapq.heapify(keys2)
+        if layer:
+            return
+
+        del self.buckets[k1]
+        del self.secondary[k1]
+        if self.primary[0] == k1:
+            heapq.heappop(self.primary)
+        else:
+            self.primary.remove(k1)
+            heapq.heapify(self.primary)
+
+    def pop(self):
+        (k, v) = self.peek()
+        self._remove(k, v)
+        return (k, v)
+
+    def popLast(self):
+        """Pops a value with the greatest key (the last one queued with it)"""
+        k1 = max(self.primary)
+        k2 = max(self.secondary[k1])
+        v = next(reversed(self.buckets[k1][k2]))
+        self._remove((k1, k2), v)
+        return ((k1, k2), v)
+
+    def key(self, v):
+        """Key of a queued value (None if it isn't queued)"""
+        return self.where.get(v)
+
+    def popLayer(self, limit=0):
+        """
+        Pops the values with the least primary key (at most limit, if given),
+          in key order.
+        Returns a list of (key, value) pairs
+        """
+        k1 = self.primary[0]
+        popped = []
+        while self.primary  and  self.primary[0] == k1:
+            if limit  and  len(popped) >= limit:
+                break
+            popped.append(self.pop())
+        return popped
+
+    def items(self):
+        """Yields the (key, value) pairs queued, in pop order"""
+        for k1 in sorted(self.buckets):
+            layer = self.buckets[k1]
+            for k2 in sorted(layer):
+                for v in layer[k2]:
+                    yield ((k1, k2), v)
+
+    def isEmpty(self):
+        return len(self.where) == 0
+
+    def clear(self):
+        self.__init__()
+
+    def close(self):
+        """Releases the resources held (none)"""
+
+
+class SpillingBucketQueue(BucketQueue):
+    """
+    BucketQueue keeping only its least primary keys in memory.
+
+    When more than `capacity` values are held in memory, the greatest primary
+      keys are spilled (leaving at least one) to a buffer, written as a sorted
+      run file every `runSize` values. Values pushed with a key above the ones
+      held in memory go to the buffer as well.
+    When memory is emptied, the next primary key is read back from the runs.
+
+    Values are spilled as codes, small non-negative integers (e.g. NodeTable
+      handles): encode and decode map between both, a value must keep its code
+      while queued. Secondary keys are numbers, or (a, b) pairs if `pairs`. Each spilled entry is numbered, and the number of the live
+      one is kept by code, so the entries of a value pushed again are skipped
+      when read back. Spilled values have no known key (see key).
+    Acts as Heap
+    """
+    # pylint: disable=too-many-instance-attributes
+
+    RECORD = Struct("<dddqq")  # primary, secondary (pair), code, entry number
+    CHUNK = 4096             # Records read at a time
+
+    class Run:
+        """A sorted run file, read a primary key at a time"""
+
+        def __init__(self, path, records):
+            self.path = path
+            with open(path, "wb") as f:
+                f.write(b"".join(SpillingBucketQueue.RECORD.pack(*r) for r in records))
+            self.f = open(path, "rb")
+            self.chunk = []
+            self.i = 0
+            self._read()
+
+        def _read(self):
+            data = self.f.read(SpillingBucketQueue.RECORD.size * SpillingBucketQueue.CHUNK)
+            self.chunk = list(SpillingBucketQueue.RECORD.iter_unpack(data))
+            self.i = 0
+
+        def head(self):
+            """Next record (None once read)"""
+            return self.chunk[self.i] if self.i < len(self.chunk) else None
+
+        def take(self, k1):
+            """Yields the records with primary key k1 (the least left)"""
+            while True:
+                r = self.head()
+                if r is None  or  r[0] != k1:
+                    return
+                yield r
+                self.i += 1
+                if self.i == len(self.chunk):
+                    self._read()
+
+        def records(self):
+            """Yields the records left, without reading them"""
+            yield from islice(self.chunk, self.i, None)
+            with open(self.path, "rb") as f:
+                f.seek(self.f.tell())
+                for r in SpillingBucketQueue.RECORD.iter_unpack(f.read()):
+                    yield r
+
+        def close(self):
+            """Closes and deletes the file"""
+            self.f.close()
+            os.remove(self.path)
+
+
+    def __init__(self, encode, decode, capacity=1 << 20, runSize=1 << 18, path=None,
+                 pairs=False):
+        # pylint: disable=too-many-arguments
+        super().__init__()
+        self.encode = encode
+        self.decode = decode
+        self.pairs = pairs
+        self.capacity = max(2, capacity)
+        self.runSize = max(1, runSize)
+        self.path = path
+
+        self.dir = None       # Run files, made on the first spill
+        self.runs = []
+        self.buffer = []      # Records not written yet
+        self.entries = array('q')  # Code -> number of its live spilled entry (0: none)
+        self.spilled = 0      # Values spilled
+        self.numbered = 0     # Spilled entries
+        self.bound = None     # Greatest primary key in memory (None: nothing spilled)
+        self.written = 0      # Values spilled to runs
+
+    def __str__(self):
+        return "SpillingBucketQueue<memory: %d, spilled: %d, runs: %d>" % (len(self.where),
+                                                                           self.spilled,
+                                                                           len(self.runs))
+
+    def __bool__(self):
+        return bool(self.where)  or  self.spilled > 0
+
+    def __len__(self):
+        return len(self.where) + self.spilled
+
+    def __contains__(self, v):
+        return v in self.where  or  self._entry(self.encode(v)) != 0
+
+    def _entry(self, c) -> int:
+        return self.entries[c] if c < len(self.entries) else 0
+
+    def _setEntry(self, c, n):
+        if c >= len(self.entries):
+            if n == 0:
+                return
+            self.entries.frombytes(bytes(8 * max(c+1 - len(self.entries), len(self.entries))))
+        old = self.entries[c]
+        self.entries[c] = n
+        self.spilled += (n != 0) - (old != 0)
+
+
+    def push(self, k, v):
+        """Queues v with key k (moving it if it was already queued, spilled or not)"""
+        c = self.encode(v)
+        if self.bound is not None  and  k[0] > self.bound:
+            old = self.where.get(v)
+            if old is not None:
+                self._remove(old, v)
+            self._spill(k, c)
+            self._refill()
+            return
+
+        self._setEntry(c, 0)
+        super().push(k, v)
+        if len(self.where) > self.capacity:
+            self._spillLayers()
+
+    def _spill(self, k, c):
+        self.numbered += 1
+        self._setEntry(c, self.numbered)
+        (k1, k2) = k
+        (a, b) = k2 if self.pairs else (k2, 0)
+        self.buffer.append((k1, a, b, c, self.numbered))
+        if len(self.buffer) >= self.runSize:
+            self._writeRun()
+
+    def _spillLayers(self):
+        """Spills the greatest primary keys in memory until half the capacity is left"""
+        while len(self.where) > self.capacity // 2  and  len(self.primary) > 1:
+            k1 = max(self.primary)
+            for (k2, bucket) in sorted(self.buckets[k1].items()):
+                for v in list(bucket):
+                    self._remove((k1, k2), v)
+                    self._spill((k1, k2), self.encode(v))
+            self.bound = max(self.primary)
+
+    def _writeRun(self):
+        """Writes the buffer as a sorted run"""
+        if self.dir is None:
+            self.dir = tempfile.mkdtemp(prefix="asld-open-", dir=self.path)
+        self.buffer.sort(key=lambda r: r[:3])  # Stable: insertion order on ties
+        self.written += len(self.buffer)
+        path = os.path.join(self.dir, "run%d" % self.written)
+        self.runs.append(SpillingBucketQueue.Run(path, self.buffer))
+        self.buffer = []
+
+    def _refill(self):
+        """Reads the least spilled primary keys back while memory is empty"""
+        while not self.where  and  self.spilled:
+            if self.buffer:
+                self._writeRun()
+            k1 = min(r.head()[0] for r in self.runs if r.head() is not None)
+            for run in self.runs:
+                for (_, a, b, c, n) in run.take(k1):
+                    if self._entry(c) == n:
+                        self._setEntry(c, 0)
+                        super().push((k1, (a, b) if self.pairs else a), self.decode(c))
+            self.bound = k1
+
+            for run in [r for r in self.runs if r.head() is None]:
+                run.close()
+                self.runs.remove(run)
+
+        if not self.spilled:
+            self._closeRuns()
+            self.entries = array('q')
+            self.bound = None
+
+
+    def pop(self):
+        (k, v) = super().pop()
+        self._refill()
+        return (k, v)
+
+    def popLast(self):
+        """Pops a value with the greatest key in memory (the last one queued with it)"""
+        (k, v) = super().popLast()
+        self._refill()
+        return (k, v)
+
+    def items(self):
+        """Yields the (key, value) pairs queued, in pop order (reading the runs)"""
+        yield from super().items()
+        sources = [r.records() for r in self.runs]
+        sources.append(sorted(self.buffer, key=lambda r: r[:3]))
+        for (k1, a, b, c, n) in heapq.merge(*sources, key=lambda r: r[:3]):
+            if self._entry(c) == n:
+                yield ((k1, (a, b) if self.pairs else a), self.decode(c))
+
+
+    def _closeRuns(self):
+        for run in self.runs:
+            run.close()
+        self.runs = []
+        if self.dir is not None:
+            shutil.rmtree(self.dir, ignore_errors=True)
+            self.dir = None
+
+    def close(self):
+        """Deletes the run files, dropping the values spilled"""
+        self._closeRuns()
+        self.buffer = []
+        self.entries = array('q')
+        self.spilled = 0
+        self.bound = None
+
+    def clear(self):
+        self.close()
+        self.__init__(self.encode, self.decode, self.capacity, self.runSize, self.path)
@@ -0,0 +1,171 @@
+"""
+Politeness scheduler
+
+Spreads requests across hosts, keeping per-host concurrency caps and rate limits.
+"""
+import heapq
+
+from time import time
+from itertools import count
+
+
+# Scheduler setup (None means unlimited)
+HOST_CAP  = None   # Requests in flight per host
+HOST_RATE = None   # Requests per second per host
+HOST_LIMITS = {}   # host -> (cap, rate)
+
+
+def configure(cap=None, rate=None, limits=None):
+    """Sets the default and per-host limits"""
+    # pylint: disable=global-statement
+    global HOST_CAP, HOST_RATE
+    HOST_CAP = cap
+    HOST_RATE = rate
+    if limits:
+        HOST_LIMITS.update(limits)
+
+
+def limits(host):
+    """(cap, rate) pair for a host"""
+    return HOST_LIMITS.get(host, (HOST_CAP, HOST_RATE))
+
+
+class TokenBucket:
+    """Rate limiter allowing short bursts"""
+
+    def __init__(self, rate, burst=None, clock=time):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self.tokens = self.burst
+        self.last = clock()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now-self.last)*self.rate)
+        self.last = now
+
+    def ready(self, now) -> bool:
+        """Checks if a token is available"""
+        self._refill(now)
+        return self.tokens >= 1
+
+    def take(self, now):
+        """Spends a token"""
+        self._refill(now)
+        self.tokens -= 1
+
+    def wait_time(self, now) -> float:
+        """Time until the next token is available"""
+        self._refill(now)
+        if self.tokens >= 1:
+            return 0
+        return (1-self.tokens) / self.rate
+
+
+class HostScheduler:
+    """
+    Queues requests per host and dispatches them round-robin across hosts,
+      by priority (lower first) within each host.
+
+    Hosts that reached their concurrency cap or rate limit are skipped, so a
+      slow host can't take over the global pool.
+
+    Rate limits are kept on the given clock (a VirtualClock on simulated runs).
+    """
+
+    class _Host:
+        """Per-host queue and limits"""
+        # pylint: disable=too-few-public-methods
+
+        def __init__(self, name, clock):
+            self.name = name
+            self.queue = []  # heap of (priority, seq, item)
+            self.active = 0
+            (self.cap, rate) = limits(name)
+            self.bucket = TokenBucket(rate, clock=clock) if rate else None
+
+        def ready(self, now) -> bool:
+            """Checks if the host can take another request"""
+            if not self.queue:
+                return False
+            if self.cap is not None  and  self.active >= self.cap:
+                return False
+            return self.bucket is None  or  self.bucket.ready(now)
+
+
+    def __init__(self, clock=time):
+        self.clock = clock
+        self.hosts = {}    # name -> _Host
+        self.ring = []     # host names, in round-robin order
+        self.next = 0      # ring position to serve next
+        self.queued = 0
+        self._seq = count()
+
+    def __len__(self):
+        return self.queued
+
+    def __bool__(self):
+        return self.queued > 0
+
+    def _host(self, name):
+        h = self.hosts.get(name)
+        if h is None:
+            h = HostScheduler._Host(name, self.clock)
+            self.hosts[name] = h
+            self.ring.append(name)
+        return h
+
+
+    def push(self, host, priority, item):
+        """Queues an item for a host"""
+        heapq.heappush(self._host(host).queue, (priority, next(self._seq), item))
+        self.queued += 1
+
+    def pop(self):
+        """
+        Takes the next dispatchable (host, item) pair, marking it active.
+        Returns None if every host with queued items is at its limits.
+        """
+        now = self.clock()
+
+        for i in range(len(self.ring)):
+            pos = (self.next + i) % len(self.ring)
+            h = self.hosts[self.ring[pos]]
+            if h.ready(now):
+                (_, _, item) = heapq.heappop(h.queue)
+                h.active += 1
+                if h.bucket is not None:
+                    h.bucket.take(now)
+                self.queued -= 1
+                self.next = (pos+1) % len(self.ring)
+                return (h.name, item)
+        return None
+
+    def drain(self):
+        """Removes and yields every queued item (by host, by priority)"""
+        for h in self.hosts.values():
+            while h.queue:
+                (_, _, item) = heapq.heappop(h.queue)
+                self.queued -= 1
+                yield item
+
+    def done(self, host):
+        """Marks a request of a host as completed"""
+        self.hosts[host].active -= 1
+
+    def wait_time(self):
+        """
+        Time until a rate limited host becomes dispatchable.
+        None if nothing is waiting on a rate limit.
+        """
+        now = self.clock()
+
+        wait = None
+        for h in self.hosts.values():
+            if not h.queue  or  h.bucket is None:
+                continue
+            if h.cap is not None  and  h.active >= h.cap:
+                continue
+            w = h.bucket.wait_time(now)
+            if wait is None  or  w < wait:
+                wait = w
+        return wait
@@ -0,0 +1,172 @@
+"""
+Keep-alive HTTP connection pools
+
+Connections are kept open per host and reused by every request sent from the
+  same process, so expanding many IRIs of a server pays TCP (and TLS) setup once.
+"""
+import os
+
+from threading import Lock
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlsplit, urljoin
+
+from asld.utils.async_http import HTTPResponse, REDIRECTS, ssl_context
+
+
+# Pool setup (set up before forking the workers)
+POOL_SIZE = 8     # Idle connections kept per host
+HOST_POOL_SIZES = {}  # host -> Idle connections kept
+
+
+def configure(size=None, sizes=None):
+    """Sets the default and per-host pool sizes"""
+    # pylint: disable=global-statement
+    global POOL_SIZE
+    if size is not None:
+        POOL_SIZE = size
+    if sizes:
+        HOST_POOL_SIZES.update(sizes)
+
+
+def pool_size(host) -> int:
+    """Idle connections kept for a host"""
+    return HOST_POOL_SIZES.get(host, POOL_SIZE)
+
+
+class _HTTPSConnection(HTTPSConnection):
+    """HTTPS connection resuming the last TLS session to its host"""
+
+    def __init__(self, netloc, pool, timeout):
+        super().__init__(netloc, timeout=timeout, context=ssl_context())
+        self.netloc = netloc  # Sessions are kept by netloc (host:port), as on HTTPPool
+        self.pool = pool
+
+    def connect(self):
+        # pylint: disable=protected-access,attribute-defined-outside-init
+        HTTPConnection.connect(self)
+
+        session = self.pool._sessions.get(self.netloc)
+        self.sock = self._context.wrap_socket(self.sock,
+                                              server_hostname=self.host,
+                                              session=session)
+
+
+class HTTPPool:
+    """
+    Per-host pool of keep-alive connections (blocking)
+
+    Connections exceeding the host's pool size are opened as needed and closed
+      after being used.
+    """
+
+    def __init__(self, timeout=15):
+        self.timeout = timeout
+        self._idle = {}      # (scheme, netloc) -> [connection]
+        self._sessions = {}  # netloc -> TLS session
+        self._lock = Lock()
+
+        self.opened = 0  # Connections established
+        self.reused = 0  # Requests sent on an already open connection
+
+    def __str__(self):
+        return "HTTPPool<opened: %d, reused: %d>" % (self.opened, self.reused)
+
+
+    def _acquire(self, scheme, netloc):
+        """Returns a (connection, reused) pair"""
+        with self._lock:
+            idle = self._idle.get((scheme, netloc))
+            if idle:
+                self.reused += 1
+                return (idle.pop(), True)
+            self.opened += 1
+
+        if scheme == "https":
+            return (_HTTPSConnection(netloc, self, self.timeout), False)
+        return (HTTPConnection(netloc, timeout=self.timeout), False)
+
+    def _release(self, scheme, netloc, conn):
+        with self._lock:
+            if scheme == "https"  and  conn.sock is not None:
+                self._sessions[netloc] = conn.sock.session
+
+            idle = self._idle.setdefault((scheme, netloc), [])
+            if len(idle) < pool_size(netloc):
+                idle.append(conn)
+                return
+        conn.close()
+
+    def close(self):
+        """Closes idle connections"""
+        with self._lock:
+            for idle in self._idle.values():
+                for conn in idle:
+                    conn.close()
+            self._idle = {}
+
+
+    def _request_once(self, method, url, headers, body) -> HTTPResponse:
+        u = urlsplit(url)
+        path = u.path or "/"
+        if u.query:
+            path += "?" + u.query
+
+        while True:
+            (conn, reused) = self._acquire(u.scheme, u.netloc)
+            try:
+                conn.request(method, path, body, headers or {})
+                res = conn.getresponse()
+                data = res.read()
+            except (HTTPException, OSError):
+                conn.close()
+                if reused:
+                    continue  # The server dropped an idle connection
+                raise
+
+            rheaders = {}
+            for (name, value) in res.getheaders():
+                name = name.lower()
+                if name in rheaders:
+                    rheaders[name] += ", " + value
+                else:
+                    rheaders[name] = value
+
+            if res.will_close:
+                conn.close()
+            else:
+                self._release(u.scheme, u.netloc, conn)
+            return HTTPResponse(url, res.status, rheaders, data)
+
+    def request(self, method, url, headers=None, body=None, redirects=5) -> HTTPResponse:
+        """
+        Sends a request following redirects
+
+        Returns the last HTTPResponse (its url is the redirect target)
+        """
+        # pylint: disable=too-many-arguments
+        res = None
+        for _ in range(redirects+1):
+            res = self._request_once(method, url, headers, body)
+
+            if res.status not in REDIRECTS  or  "location" not in res.headers:
+                break
+
+            url = urljoin(url, res.headers["location"])
+            if res.status == 303  or  (res.status in (301, 302) and method == "POST"):
+                method = "GET"
+                body = None
+        return res
+
+
+_SHARED = None
+_SHARED_PID = None
+
+
+def shared_pool() -> HTTPPool:
+    """HTTPPool shared by every fetch on the current process"""
+    # pylint: disable=global-statement
+    global _SHARED, _SHARED_PID
+    if _SHARED is None  or  _SHARED_PID != os.getpid():
+        _SHARED = HTTPPool()
+        _SHARED_PID = os.getpid()
+    return _SHARED
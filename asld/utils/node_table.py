@@ -0,0 +1,180 @@
+"""
+Columnar storage for search nodes
+
+Search nodes are (node, State) pairs with path data. Reached pairs add up to
+  millions, so they are kept as rows of parallel arrays instead of objects.
+"""
+from array import array
+
+
+NONE = -1  # Missing handle (or value)
+
+
+class NodeTable:
+    """
+    Rows of (node, state, g, parent, P, t, d) addressed by integer handles.
+
+    Nodes are kept as references (the terms are shared with the graph), parents
+      as handles, and States, predicates, transitions and directions as IDs of a
+      table of interned values (NONE stands for None).
+    Handles are looked up by State, then by node, so no (node, State) tuples
+      are kept around.
+    Leaf rows (no row has them as parent) can be removed, their handles are
+      reused by the rows added next.
+    """
+
+    def __init__(self):
+        self.handles = {}  # State -> node -> handle
+
+        # Columns
+        self.node   = []
+        self.state  = array('i')
+        self.g      = array('q')
+        self.parent = array('i')
+        self.P      = array('i')
+        self.t      = array('i')
+        self.d      = array('i')
+        self.kids   = array('i')  # Rows having this one as parent
+
+        self.free = []  # Handles of removed rows
+
+        # Interned values
+        self.values = []
+        self.ids = {}
+
+    def __len__(self):
+        return len(self.node)
+
+    def __str__(self):
+        return "NodeTable<rows: %d, live: %d, values: %d>" % (len(self), self.live(),
+                                                              len(self.values))
+
+    def live(self) -> int:
+        """Rows not removed"""
+        return len(self.node) - len(self.free)
+
+
+    def intern(self, v) -> int:
+        """ID for a value (NONE for None)"""
+        if v is None:
+            return NONE
+        i = self.ids.get(v)
+        if i is None:
+            i = len(self.values)
+            self.ids[v] = i
+            self.values.append(v)
+        return i
+
+    def value(self, i):
+        """Value for an ID"""
+        return None if i == NONE else self.values[i]
+
+
+    def find(self, node, state):
+        """Handle for a (node, state) pair, None if it was never added"""
+        nodes = self.handles.get(state)
+        if nodes is None:
+            return None
+        return nodes.get(node)
+
+    def add(self, node, state, g, parent=NONE, P=None, t=None, d=None) -> int:
+        """Adds a (node, state) row, returns its handle"""
+        # pylint: disable=too-many-arguments
+        if parent != NONE:
+            self.kids[parent] += 1
+
+        if self.free:
+            h = self.free.pop()
+            self.handles.setdefault(state, {})[node] = h
+            self.node[h] = node
+            self.state[h] = self.intern(state)
+            self.g[h] = g
+            self.parent[h] = parent
+            self.P[h] = self.intern(P)
+            self.t[h] = self.intern(t)
+            self.d[h] = self.intern(d)
+            self.kids[h] = 0
+            return h
+
+        h = len(self.node)
+        self.handles.setdefault(state, {})[node] = h
+
+        self.node.append(node)
+        self.state.append(self.intern(state))
+        self.g.append(g)
+        self.parent.append(parent)
+        self.P.append(self.intern(P))
+        self.t.append(self.intern(t))
+        self.d.append(self.intern(d))
+        self.kids.append(0)
+        return h
+
+    def update(self, h, g, parent, P, t, d):
+        """Sets the cost and path data of a row"""
+        # pylint: disable=too-many-arguments
+        old = self.parent[h]
+        if old != parent:
+            if old != NONE:
+                self.kids[old] -= 1
+            if parent != NONE:
+                self.kids[parent] += 1
+
+        self.g[h] = g
+        self.parent[h] = parent
+        self.P[h] = self.intern(P)
+        self.t[h] = self.intern(t)
+        self.d[h] = self.intern(d)
+
+    def remove(self, h) -> int:
+        """Removes a leaf row, returns its parent's handle"""
+        assert self.kids[h] == 0, "Row %d is a parent" % h
+        del self.handles[self.values[self.state[h]]][self.node[h]]
+        self.node[h] = None
+
+        parent = self.parent[h]
+        if parent != NONE:
+            self.kids[parent] -= 1
+        self.free.append(h)
+        return parent
+
+
+class Bitmap:
+    """
+    Set of handles, one bit each
+    Acts as set
+    """
+
+    def __init__(self):
+        self.bits = bytearray()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __bool__(self):
+        return self.count > 0
+
+    def __contains__(self, h):
+        byte = h >> 3
+        return byte < len(self.bits)  and  bool(self.bits[byte] & (1 << (h & 7)))
+
+    def add(self, h):
+        """Adds a handle"""
+        byte = h >> 3
+        if byte >= len(self.bits):
+            self.bits.extend(bytes(max(byte+1 - len(self.bits), len(self.bits))))
+        if not self.bits[byte] & (1 << (h & 7)):
+            self.bits[byte] |= 1 << (h & 7)
+            self.count += 1
+
+    def remove(self, h):
+        """Removes a handle (KeyError if missing)"""
+        if h not in self:
+            raise KeyError(h)
+        self.bits[h >> 3] &= ~(1 << (h & 7)) & 0xFF
+        self.count -= 1
+
+    def discard(self, h):
+        """Removes a handle if present"""
+        if h in self:
+            self.remove(h)
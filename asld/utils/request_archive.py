@@ -0,0 +1,132 @@
+"""
+Record/replay archive of fetched answers
+
+Makes benchmarks repeatable: a recorded run stores every answer the search got,
+  and replayed runs are served from the archive without touching the network.
+"""
+import os
+import sqlite3
+
+from enum import Enum
+from threading import local
+
+from asld.utils.document_cache import DocumentCache
+
+
+class ArchiveMode(Enum):
+    """Whether an archive is being written or read"""
+    Record = 0
+    Replay = 1
+
+class ReplayLatency(Enum):
+    """Time a replayed answer takes"""
+    Recorded = 0  # As measured when recording (modeled if unknown)
+    Modeled  = 1  # Sampled from the delay data
+    Zero     = 2
+
+    @classmethod
+    def parse(cls, latency: str):
+        """Parses a ReplayLatency from a string"""
+        latency = latency.lower()
+        if latency == "modeled":
+            return ReplayLatency.Modeled
+        if latency in ("zero", "none"):
+            return ReplayLatency.Zero
+        return ReplayLatency.Recorded
+
+    @classmethod
+    def to_string(cls, latency):
+        """Name of a ReplayLatency"""
+        return latency.name.lower()
+
+
+class RequestArchive:
+    """
+    Indexed store of request answers
+
+    Records hold the request (IRI and SPARQL query), its packed answer (see
+      ASLDGraph.pack), the number of triples and the measured latency (None for
+      answers that came from the cache, as they were never timed).
+
+    Lookups match the exact request first, falling back to the largest answer
+      recorded for the IRI, so a run with other batching or query merging
+      settings can still be replayed.
+    Connections are opened lazily on each process (and thread), so an archive
+      can be shared with forked workers.
+    """
+
+    _SCHEMA = """
+    create table if not exists requests (
+      key     text primary key,
+      iri     text,
+      query   text,
+      size    integer,
+      latency real,
+      data    blob
+    )
+    """
+    _INDEX = "create index if not exists requests_iri on requests (iri, size)"
+
+    def __init__(self, path, mode=ArchiveMode.Replay, latency=ReplayLatency.Recorded):
+        self.path = path
+        self.mode = mode
+        self.latency = latency
+
+        if mode == ArchiveMode.Record:
+            os.makedirs(path, mode=0o777, exist_ok=True)
+        elif not os.path.exists(os.path.join(path, "archive.sqlite")):
+            raise FileNotFoundError("No request archive at '%s'" % path)
+        self._local = local()
+
+    def __str__(self):
+        return "RequestArchive<%s, %s>" % (self.path, self.mode.name)
+
+    def __getstate__(self):
+        # Connections can't cross process boundaries
+        state = self.__dict__.copy()
+        del state["_local"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._local = local()
+
+
+    def _conn(self):
+        """Connection for the current process and thread"""
+        conn = self._local
+        if getattr(conn, "pid", None) != os.getpid():
+            conn.db = sqlite3.connect(os.path.join(self.path, "archive.sqlite"),
+                                      timeout=60, isolation_level=None)
+            if self.mode == ArchiveMode.Record:
+                conn.db.execute("pragma journal_mode=wal")
+                conn.db.execute(RequestArchive._SCHEMA)
+                conn.db.execute(RequestArchive._INDEX)
+            conn.pid = os.getpid()
+        return conn.db
+
+    def __len__(self):
+        (n,) = self._conn().execute("select count(*) from requests").fetchone()
+        return n
+
+
+    def get(self, iri, queryString=""):
+        """Returns the (packed graph, size, latency) record for a request (or None)"""
+        db = self._conn()
+        row = db.execute("select data, size, latency from requests where key=?",
+                         (DocumentCache.key(iri, queryString),)).fetchone()
+        if row is None:
+            row = db.execute("select data, size, latency from requests where iri=? "
+                             "order by size desc limit 1", (str(iri),)).fetchone()
+        return row
+
+    def put(self, iri, queryString, data, size, latency=None):
+        """
+        Stores the answer to a request.
+        Unmeasured answers (latency None) don't replace measured ones.
+        """
+        # pylint: disable=too-many-arguments
+        verb = "insert or replace" if latency is not None else "insert or ignore"
+        self._conn().execute(verb + " into requests values (?, ?, ?, ?, ?, ?)",
+                             (DocumentCache.key(iri, queryString), str(iri), queryString or "",
+                              size, latency, data))
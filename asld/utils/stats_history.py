@@ -0,0 +1,99 @@
+"""
+Low overhead statistics
+
+Bounded columnar history of snapshots, and a background sampler for values too
+  expensive to read on every expansion.
+"""
+from array import array
+from json import dumps, loads
+from threading import Thread, Event
+
+
+class History:
+    """
+    Bounded history of rows, stored as one array per field.
+
+    Fields are (name, typecode) pairs, typecode None keeps the values on a list.
+    When `capacity` rows are held, the oldest half is spilled to a JSON lines
+      file (if `spill` is given) or dropped, so appending stays O(1) amortized.
+    """
+
+    def __init__(self, fields, capacity=1 << 18, spill=None):
+        self.names = [name for (name, _) in fields]
+        self.columns = [[] if code is None else array(code) for (_, code) in fields]
+        self.capacity = max(2, capacity)
+        self.spill = spill
+
+        self.spilled = 0
+        self.dropped = 0
+        if spill is not None:
+            open(spill, "w").close()
+
+    def __len__(self):
+        return self.spilled + len(self.columns[0])
+
+    def __str__(self):
+        return "History<rows: %d, spilled: %d, dropped: %d>" % (len(self), self.spilled,
+                                                                self.dropped)
+
+    def append(self, row):
+        """Adds a row (values in field order)"""
+        if len(self.columns[0]) >= self.capacity:
+            self._evict(self.capacity // 2)
+        for (column, v) in zip(self.columns, row):
+            column.append(v)
+
+    def _evict(self, n):
+        """Spills (or drops) the n oldest rows"""
+        if self.spill is not None:
+            with open(self.spill, "a") as f:
+                for row in self._rows(0, n):
+                    f.write(dumps(row))
+                    f.write("\n")
+            self.spilled += n
+        else:
+            self.dropped += n
+
+        for column in self.columns:
+            del column[:n]
+
+    def _rows(self, start, end):
+        for k in range(start, end):
+            yield {name: column[k] for (name, column) in zip(self.names, self.columns)}
+
+    def rows(self):
+        """Yields every row kept (spilled ones first) as a dict"""
+        if self.spilled:
+            with open(self.spill) as f:
+                for line in f:
+                    yield loads(line)
+        yield from self._rows(0, len(self.columns[0]))
+
+
+class Sampler:
+    """Calls a function every `interval` seconds on a daemon thread"""
+
+    def __init__(self, fun, interval):
+        self.fun = fun
+        self.interval = interval
+        self._stop = Event()
+        self._thread = None
+
+    def start(self):
+        """Starts sampling (restarts it if running)"""
+        self.stop()
+        self._stop = Event()
+        self._thread = Thread(target=self._run, args=(self._stop,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Stops sampling"""
+        if self._thread is not None:
+            self._stop.set()
+            self._thread.join()
+            self._thread = None
+
+    def _run(self, stop):
+        self.fun()
+        while not stop.wait(self.interval):
+            self.fun()
@@ -0,0 +1,231 @@
+"""
+Dictionary-encoded triple store
+
+Native alternative to rdflib's in-memory Graph for the access patterns of the
+  search: adding triples in bulk and looking up a node's out and in edges.
+"""
+from io import BytesIO
+from array import array
+from bisect import bisect_left
+
+from rdflib.plugins.parsers.ntriples import W3CNTriplesParser
+
+
+MERGE_MIN = 1 << 12  # Least pairs on an index's delta before merging it
+MERGE_FRACTION = 4   # Delta merged once it holds 1/MERGE_FRACTION of the pairs
+
+
+class _Index:
+    """
+    Map from a term ID to the pairs of IDs it is on, packed as 64 bit ints
+      (x << 32 | y), in compressed sparse rows:
+        keys:  sorted key IDs
+        start: offset of each key's pairs (and the end, last)
+        pairs: pairs, sorted within each key
+
+    New pairs go on a delta (key -> array of pairs) merged into the rows once
+      it grows past a fraction of them, so adding stays amortized O(log n).
+    """
+
+    def __init__(self):
+        self.keys = array('I')
+        self.start = array('Q', [0])
+        self.pairs = array('Q')
+
+        self.delta = {}
+        self.pending = 0  # Pairs on the delta
+
+    def _row(self, k):
+        """(start, end) of a key's pairs on the rows ((0, 0) if it has none)"""
+        i = bisect_left(self.keys, k)
+        if i < len(self.keys)  and  self.keys[i] == k:
+            return (self.start[i], self.start[i+1])
+        return (0, 0)
+
+    def __contains__(self, k):
+        return k in self.delta  or  self._row(k)[1] > 0
+
+    def has(self, k, pair) -> bool:
+        """Checks if a key holds a pair"""
+        (a, b) = self._row(k)
+        i = bisect_left(self.pairs, pair, a, b)
+        if i < b  and  self.pairs[i] == pair:
+            return True
+        delta = self.delta.get(k)
+        return delta is not None  and  pair in delta
+
+    def add(self, k, pair):
+        """Adds a pair to a key (not checking for duplicates)"""
+        delta = self.delta.get(k)
+        if delta is None:
+            delta = self.delta[k] = array('Q')
+        delta.append(pair)
+        self.pending += 1
+        if self.pending >= max(MERGE_MIN, len(self.pairs) // MERGE_FRACTION):
+            self._merge()
+
+    def get(self, k, x=None):
+        """Yields the pairs of a key (those starting with x, if given)"""
+        (pairs, delta) = (self.pairs, self.delta.get(k, ()))
+        (a, b) = self._row(k)
+        if x is not None:
+            a = bisect_left(pairs, x << 32, a, b)
+            b = bisect_left(pairs, (x+1) << 32, a, b)
+        for i in range(a, b):
+            yield pairs[i]
+
+        for pair in delta:
+            if x is None  or  pair >> 32 == x:
+                yield pair
+
+    def __iter__(self):
+        """Yields every key"""
+        yield from self.keys
+        for k in self.delta:
+            if not self._row(k)[1]:
+                yield k
+
+    def _merge(self):
+        """Merges the delta into the rows (rows between new keys are copied in bulk)"""
+        (oldKeys, oldStart, oldPairs) = (self.keys, self.start, self.pairs)
+        keys = array('I')
+        start = array('Q', [0])
+        pairs = array('Q')
+
+        i = 0
+        for k in sorted(self.delta):
+            j = bisect_left(oldKeys, k, i)
+            if j > i:
+                shift = len(pairs) - oldStart[i]
+                keys.extend(oldKeys[i:j])
+                start.extend(map(shift.__add__, oldStart[i+1:j+1]))
+                pairs.extend(oldPairs[oldStart[i]:oldStart[j]])
+
+            row = self.delta[k]
+            if j < len(oldKeys)  and  oldKeys[j] == k:
+                row = oldPairs[oldStart[j]:oldStart[j+1]] + row
+                j += 1
+            keys.append(k)
+            pairs.extend(sorted(row))
+            start.append(len(pairs))
+            i = j
+
+        if i < len(oldKeys):
+            shift = len(pairs) - oldStart[i]
+            keys.extend(oldKeys[i:])
+            start.extend(map(shift.__add__, oldStart[i+1:]))
+            pairs.extend(oldPairs[oldStart[i]:])
+
+        (self.keys, self.start, self.pairs) = (keys, start, pairs)
+        self.delta = {}
+        self.pending = 0
+
+
+class TripleStore:
+    """
+    Interns terms (IRIs, literals and blank nodes) into 32 bit IDs and indexes
+      triples twice (see _Index):
+        spo: subject -> (predicate, object) pairs
+        osp: object  -> (subject, predicate) pairs
+
+    Duplicates are found on spo, so each triple costs two 64 bit ints.
+
+    Exposes the subset of rdflib's Graph used by ASLDGraph:
+      add, triples, parse (N-Triples only), __len__, __iter__ and __contains__
+    """
+
+    def __init__(self):
+        self.terms = []  # ID -> term
+        self.ids = {}    # term -> ID
+
+        self.spo = _Index()
+        self.osp = _Index()
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return self.triples((None, None, None))
+
+    def __contains__(self, spo):
+        ids = self._lookup(spo)
+        if ids is None  or  None in ids:
+            return False
+        (s, p, o) = ids
+        return self.spo.has(s, p << 32 | o)
+
+    def __str__(self):
+        return "TripleStore<terms: %d, triples: %d>" % (len(self.terms), len(self))
+
+
+    def _intern(self, term) -> int:
+        """ID for a term, assigned on first use"""
+        i = self.ids.get(term)
+        if i is None:
+            i = len(self.terms)
+            self.ids[term] = i
+            self.terms.append(term)
+        return i
+
+    def _lookup(self, spo):
+        """IDs for a (s, p, o) pattern (None stays None). None if a term is unknown"""
+        ids = []
+        for term in spo:
+            if term is None:
+                ids.append(None)
+                continue
+            i = self.ids.get(term)
+            if i is None:
+                return None
+            ids.append(i)
+        return ids
+
+
+    def add(self, spo) -> bool:
+        """Adds a triple, returns whether it was new"""
+        (s, p, o) = [self._intern(term) for term in spo]
+
+        if self.spo.has(s, p << 32 | o):
+            return False
+        self.spo.add(s, p << 32 | o)
+        self.osp.add(o, s << 32 | p)
+        self.count += 1
+        return True
+
+    def triple(self, s, p, o):
+        """Parser sink callback"""
+        self.add((s, p, o))
+
+    def parse(self, data: bytes, format="nt"):
+        """Adds the triples of an N-Triples document"""
+        # pylint: disable=redefined-builtin
+        if format != "nt":
+            raise ValueError("TripleStore only parses N-Triples (not '%s')" % format)
+        W3CNTriplesParser(sink=self).parse(BytesIO(data))
+        return self
+
+
+    def triples(self, spo):
+        """Yields the (S, P, O) triples matching a pattern (None matches anything)"""
+        ids = self._lookup(spo)
+        if ids is None:
+            return
+        (s, p, o) = ids
+        terms = self.terms
+        mask = 0xFFFFFFFF
+
+        if s is not None:
+            for po in self.spo.get(s, p):
+                if o is None  or  po & mask == o:
+                    yield (terms[s], terms[po >> 32], terms[po & mask])
+
+        elif o is not None:
+            for sp in self.osp.get(o):
+                if p is None  or  sp & mask == p:
+                    yield (terms[sp >> 32], terms[sp & mask], terms[o])
+
+        else:
+            for S in list(self.spo):
+                for po in self.spo.get(S, p):
+                    yield (terms[S], terms[po >> 32], terms[po & mask])
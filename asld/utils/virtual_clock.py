@@ -0,0 +1,36 @@
+"""
+Virtual clock for simulated runs
+"""
+from time import time
+
+
+class VirtualClock:
+    """
+    Clock that skips simulated waits instead of sleeping.
+
+    Virtual time is the real time plus the waits skipped (minus the work
+      discounted, done off the clock), so the search's own work still counts.
+    Acts as time.time()
+    """
+
+    def __init__(self):
+        self.offset = 0.0
+
+    def __call__(self) -> float:
+        return time() + self.offset
+
+    def __str__(self):
+        return "VirtualClock<%+.2fs>" % self.offset
+
+    def sleep(self, t):
+        """Skips a wait"""
+        if t > 0:
+            self.offset += t
+
+    def wait_until(self, t):
+        """Skips the wait until virtual time t"""
+        self.sleep(t - self())
+
+    def discount(self, t):
+        """Takes back time spent on work that runs elsewhere on a real setup"""
+        self.offset -= t
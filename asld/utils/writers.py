@@ -0,0 +1,146 @@
+"""
+Streaming writers for run logs, answers and DB dumps
+
+Output is written as it is produced (flushed every few seconds), so memory
+  stays flat and killed runs leave usable files. Compression is picked by file
+  extension: .gz (gzip) or .zst (zstd, needs the `zstandard` package).
+
+Run logs are NDJSON, one record per line:
+  {"run":    {"query": ..., "params": {...}}}      header
+  {"stats":  {...}}                                Stats snapshot
+  {"step":   {"id": k, "parent": j, "transition": ..., "state": ..., "node": ...}}
+  {"path":   k}                                    answer ending on step k
+  {"path":   k, "source": IRI}                     (on multi-source searches)
+  {"result": {"PathCount": n, "Time": t}}          footer (missing on killed runs)
+                                                   (and "Sources": {IRI: n} on
+                                                    multi-source searches)
+Answers share their prefixes: each step is written once and refers to its parent.
+"""
+import io
+import gzip
+
+from json import dumps
+from time import time
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+
+FLUSH_INTERVAL = 2.0  # Seconds between flushes
+
+
+def open_text(path, mode="w"):
+    """Opens a text file, compressed according to its extension"""
+    if path.endswith(".gz"):
+        return gzip.open(path, mode+"t", encoding="utf-8")
+    if path.endswith(".zst"):
+        if zstandard is None:
+            raise ImportError("'%s' needs the zstandard package" % path)
+        raw = open(path, mode+"b")
+        if mode == "r":
+            stream = zstandard.ZstdDecompressor().stream_reader(raw, closefd=True)
+        else:
+            stream = zstandard.ZstdCompressor().stream_writer(raw, closefd=True)
+        return io.TextIOWrapper(stream, encoding="utf-8")
+    return open(path, mode, encoding="utf-8")
+
+
+class LineWriter:
+    """Writes lines to a (compressed) file, flushing every FLUSH_INTERVAL seconds"""
+
+    def __init__(self, path):
+        self.path = path
+        self.f = open_text(path)
+        self.lines = 0
+        self._flushed = time()
+
+    def __str__(self):
+        return "%s<%s, lines: %d>" % (self.__class__.__name__, self.path, self.lines)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.close()
+
+    def writeLine(self, line: str):
+        """Writes a line (without its end)"""
+        self.f.write(line)
+        self.f.write("\n")
+        self.lines += 1
+
+        now = time()
+        if now - self._flushed >= FLUSH_INTERVAL:
+            self.f.flush()
+            self._flushed = now
+
+    def close(self):
+        """Flushes and closes the file"""
+        if not self.f.closed:
+            self.f.close()
+
+
+class NDJSONWriter(LineWriter):
+    """Writes an object per line"""
+
+    def write(self, obj):
+        """Writes an object"""
+        self.writeLine(dumps(obj))
+
+
+class NTriplesWriter(LineWriter):
+    """Writes RDF triples as N-Triples"""
+
+    def write(self, spo):
+        """Writes a triple"""
+        (s, p, o) = spo
+        self.writeLine("%s %s %s ." % (s.n3(), p.n3(), o.n3()))
+
+    def writeAll(self, triples):
+        """Writes many triples, returns how many"""
+        n = 0
+        for spo in triples:
+            self.write(spo)
+            n += 1
+        return n
+
+
+class PathWriter:
+    """
+    Writes answers as step and path records (see the module's format) on an
+      NDJSONWriter.
+
+    key gives a hashable ID for a path element, and step its serializable dict
+      (only called for steps not written yet). tag, if given, gives the source
+      of a path.
+    """
+
+    def __init__(self, out: NDJSONWriter, key, step, tag=None):
+        self.out = out
+        self.key = key
+        self.step = step
+        self.tag = tag
+        self.steps = {}  # (key, parent step) -> step id
+        self.paths = 0
+
+    def write(self, path):
+        """Writes the steps not written yet and the path record"""
+        parent = None
+        for x in path:
+            key = (self.key(x), parent)
+            k = self.steps.get(key)
+            if k is None:
+                k = len(self.steps)
+                self.steps[key] = k
+                record = {"id": k, "parent": parent}
+                record.update(self.step(x))
+                self.out.write({"step": record})
+            parent = k
+
+        if self.tag is None:
+            self.out.write({"path": parent})
+        else:
+            self.out.write({"path": parent, "source": self.tag(path)})
+        self.paths += 1
@@ -7,11 +7,11 @@ Currently it requires runs from A* end Dijkstra on the same setup
 import os
 
 import argparse
-import jsonpickle
 
 from matplotlib.pyplot import show, figure, plot, legend, title, xlabel, ylabel, savefig
 
 from asld.utils.color_print import Color
+from utils.fs import load_run
 
 
 parser = argparse.ArgumentParser(description='Plot stuff')
@@ -76,10 +76,9 @@ def load_files(files):
     for jf in files:
         print("Reading '%s'" % jf)
         try:
-            with open(jf) as f:
-                run_data = jsonpickle.decode(f.read())
-                alg_name = run_data["params"]["algorithm"]
-                data[alg_name] = run_data
+            run_data = load_run(jf)
+            alg_name = run_data["params"]["algorithm"]
+            data[alg_name] = run_data
         except KeyError as ke:
             Color.RED.print("Failed to load '%s' (%s)" % (jf, ke))
 
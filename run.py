@@ -5,11 +5,19 @@ Command line interface for running sample queries
 
 import os
 import argparse
+from time import time
 from pprint import pprint
-from json import dump
 
-from asld.search import ASLDSearch, Algorithm
+from rdflib.term import URIRef
+
+from asld.graph import ASLDGraph, Backend
+from asld.search import ASLDSearch, Algorithm, Fetcher, configure_stats
 from asld.sample_queries import automatons
+from asld.utils.document_cache import DocumentCache
+from asld.utils.request_archive import RequestArchive, ArchiveMode, ReplayLatency
+from asld.utils.cost_model import CostModel
+from asld.utils import http_pool, host_scheduler
+from asld.utils.writers import NDJSONWriter
 
 from asld.utils.color_print import Color
 
@@ -19,15 +27,41 @@ from asld.utils.color_print import Color
 parser = argparse.ArgumentParser(description='Process some queries')
 
 # Query
-parser.add_argument('-w', metavar='w', type=int, default=1,
+parser.add_argument('-w', metavar='w', type=float, default=1,
                     help='weight to use on the heuristic')
 parser.add_argument('-q', metavar='q', type=int, default=0,
                     help='query ID')
+parser.add_argument('--sources', metavar='file', type=str, default=None,
+                    help='Start nodes to run the query from at once (one IRI per line)')
 
 # Search tuning
 parser.add_argument("--slow-goal", help="Use regular goal declaration", action="store_true")
 parser.add_argument('--pool-size', metavar='p', type=int, default=40,
-                    help='Process pool size to use')
+                    help='Process pool size to use (requests in flight)')
+parser.add_argument('--fetcher', metavar='f', type=str, default="processes",
+                    help='processes | asyncio | simulated (cached answers, virtual clock)')
+parser.add_argument('--parsers', metavar='n', type=int, default=2,
+                    help='Parsing processes (asyncio fetcher)')
+parser.add_argument('--backend', metavar='b', type=str, default="rdflib",
+                    help='Triple store: rdflib | native (dictionary-encoded)')
+parser.add_argument("--barriers", help="Request top-f batches, waiting for each batch to finish",
+                    action="store_true")
+parser.add_argument("--stream", help="Expand nodes as their answers arrive (asyncio fetcher)",
+                    action="store_true")
+parser.add_argument('--sparql-batch', metavar='n', type=int, default=1,
+                    help='IRIs expanded by a single SPARQL query (1 disables batching)')
+parser.add_argument('--host-pool-size', metavar='n', type=int, default=http_pool.POOL_SIZE,
+                    help='Keep-alive connections per host')
+parser.add_argument('--host-pool', metavar='host=n', type=str, action='append', default=[],
+                    help='Keep-alive connections for a specific host')
+
+# Politeness
+parser.add_argument('--host-cap', metavar='n', type=int, default=None,
+                    help='Requests in flight per host (or SPARQL endpoint)')
+parser.add_argument('--host-rate', metavar='r', type=float, default=None,
+                    help='Requests per second per host (or SPARQL endpoint)')
+parser.add_argument('--host-limit', metavar='host=n[:r]', type=str, action='append', default=[],
+                    help='Cap and rate for a specific host (or SPARQL endpoint)')
 
 # Search limits
 parser.add_argument('--time', metavar='t', type=int, default=10*60,
@@ -37,13 +71,80 @@ parser.add_argument('--ans', metavar='a', type=int, default=1e3,
 parser.add_argument('--triples', metavar='s', type=int, default=1e5,
                     help='Triples limit')
 
+parser.add_argument('--max-nodes', metavar='n', type=int, default=None,
+                    help='NodeStates kept in memory (the worst ones are forgotten)')
+parser.add_argument('--max-rss', metavar='MB', type=int, default=None,
+                    help='Memory use that sets --max-nodes once reached [MB]')
+
+parser.add_argument('--spill', metavar='n', type=int, default=None,
+                    help='NodeStates on open kept in memory, higher f-layers go to disk')
+parser.add_argument('--spill-dir', metavar='dir', type=str, default=None,
+                    help='Directory for the open list spilled (default: temp directory)')
+
 parser.add_argument('--alg', metavar='t', type=str, default="a*",
                     help='A* | Dijkstra | BFS | DFS')
+parser.add_argument("--bidirectional", action="store_true",
+                    help="Also search backward from the goal node (single goal queries)")
+parser.add_argument('--anytime', metavar='w,w,...', type=str, default=None,
+                    help='Anytime A*: heuristic weights to go through (down to 1)')
+parser.add_argument('--cost-model', metavar='file', type=str, default=None,
+                    help='Request costs learned by previous runs, to break ties towards '
+                         'cheaper directions (updated with this run)')
+
+# Persistent cache
+parser.add_argument('--cache', metavar='dir', type=str, default=None,
+                    help='Directory for the persistent document cache')
+parser.add_argument('--cache-size', metavar='MB', type=int, default=1024,
+                    help='Cache size limit [MB]')
+parser.add_argument('--cache-ttl', metavar='t', type=int, default=7*24*3600,
+                    help='Time before cached documents are revalidated [s]')
+
+# Record/replay
+parser.add_argument('--record', metavar='dir', type=str, default=None,
+                    help='Directory of a request archive to record answers to')
+parser.add_argument('--replay', metavar='dir', type=str, default=None,
+                    help='Directory of a request archive to answer from (no network)')
+parser.add_argument('--replay-latency', metavar='l', type=str, default="recorded",
+                    help='recorded | modeled | zero')
+
+# Checkpoints
+parser.add_argument('--checkpoint', metavar='file', type=str, default=None,
+                    help='File to checkpoint the search to')
+parser.add_argument('--checkpoint-interval', metavar='t', type=float, default=60,
+                    help='Time between checkpoints [s]')
+parser.add_argument('--resume', metavar='file', type=str, default=None,
+                    help='Checkpoint to resume the search from (checkpoints go on there '
+                         'unless --checkpoint is given)')
+
+# Output
+parser.add_argument('--compress', metavar='c', type=str, default="none",
+                    help='Run log compression: none | gzip | zstd')
+
+# Stats
+parser.add_argument('--stats-interval', metavar='t', type=float, default=0.5,
+                    help='Time between memory samples [s]')
+parser.add_argument('--stats-history', metavar='n', type=int, default=1 << 18,
+                    help='Stats snapshots kept in memory')
+parser.add_argument('--stats-spill', metavar='file', type=str, default=None,
+                    help='File for the snapshots beyond --stats-history (dropped otherwise)')
 
 args = parser.parse_args()
+COMPRESSION_EXTENSIONS = {"none": "", "gzip": ".gz", "zstd": ".zst"}
+if args.compress not in COMPRESSION_EXTENSIONS:
+    parser.error("--compress must be one of: none, gzip, zstd")
+if args.record and args.replay:
+    parser.error("--record and --replay are exclusive")
 
 ALGORITHM    = Algorithm.parse(args.alg)
 ALGORITHM_N  = Algorithm.to_string(ALGORITHM)
+FETCHER      = Fetcher.parse(args.fetcher)
+FETCHER_N    = Fetcher.to_string(FETCHER)
+if args.anytime  and  args.w != 1:
+    parser.error("--anytime sets the heuristic weight, -w can't be given with it")
+if FETCHER == Fetcher.Simulated  and  not (args.cache  or  args.replay):
+    parser.error("The simulated fetcher serves answers from --cache or --replay, give one")
+BACKEND      = Backend.parse(args.backend)
+BACKEND_N    = Backend.to_string(BACKEND)
 w            = args.w
 quick_goal   = not args.slow_goal
 query_number = args.q
@@ -54,8 +155,41 @@ limit_time    = args.time
 limit_ans     = args.ans
 limit_triples = args.triples
 
+http_pool.configure(args.host_pool_size,
+                    {h: int(n) for (h, n) in (hn.split("=") for hn in args.host_pool)})
+
+def parse_host_limit(arg):
+    """host=cap[:rate] -> (host, (cap, rate))"""
+    (host, limit) = arg.rsplit("=", 1)
+    (cap, _, rate) = limit.partition(":")
+    return (host, (int(cap) if cap else None,
+                   float(rate) if rate else None))
+
+configure_stats(args.stats_interval, args.stats_history, args.stats_spill)
+
+host_scheduler.configure(args.host_cap, args.host_rate,
+                         dict(parse_host_limit(hl) for hl in args.host_limit))
+
+if args.cache:
+    ASLDGraph.use_cache(DocumentCache(args.cache,
+                                      max_size=args.cache_size*1024*1024,
+                                      ttl=args.cache_ttl))
+
+if args.record:
+    ASLDGraph.use_archive(RequestArchive(args.record, ArchiveMode.Record))
+if args.replay:
+    ASLDGraph.use_archive(RequestArchive(args.replay, ArchiveMode.Replay,
+                                         ReplayLatency.parse(args.replay_latency)))
+
 (query, query_name) = automatons[query_number]
 
+sources = None
+if args.sources:
+    with open(args.sources) as f:
+        sources = [line.strip() for line in f if line.strip()  and  not line.startswith("#")]
+    if not sources:
+        parser.error("--sources has no start nodes")
+
 
 if query is None:
     print("Review the query number")
@@ -63,7 +197,7 @@ else:
     # Run query
     # =========
     data = None
-    result = {
+    run = {
         "query": query_name,
         "params": {
             "limits": {
@@ -73,68 +207,147 @@ else:
             },
             "algorithm":        ALGORITHM_N,
             "parallelRequests": parallel_requests,
+            "fetcher":          FETCHER_N,
+            "backend":          BACKEND_N,
+            "sparqlBatch":      args.sparql_batch,
+            "stream":           args.stream,
+            "pipeline":         not args.barriers,
             "quickGoal":        quick_goal,
-            "weight":           w
-        },
-        "data": data
+            "weight":           w,
+            "anytime":          args.anytime,
+            "bidirectional":    args.bidirectional,
+            "costModel":        args.cost_model,
+            "sources":          len(sources) if sources else None,
+            "maxNodes":         args.max_nodes,
+            "maxRSS":           args.max_rss,
+            "spill":            args.spill,
+            "cache":            args.cache,
+            "record":           args.record,
+            "replay":           args.replay,
+            "replayLatency":    args.replay_latency if args.replay else None,
+            "checkpoint":       args.checkpoint,
+            "resume":           args.resume
+        }
     }
 
+    # Make sub-directory
+    results_directory = "bench/last/"
+    results_directory += "q%d-%s/" % (query_number, query_name)
+
+    results_directory += "p%d/" % parallel_requests
+    if quick_goal:
+        results_directory += "quick/"
+    else:
+        results_directory += "slow/"
+    os.makedirs(results_directory, mode=0o777, exist_ok=True)
+
+    # Log file (written as the search runs)
+    fileName = results_directory
+    fileName += "q%d--" % query_number
+    fileName += "%s" % ALGORITHM_N
+    fileName += "-w%g" % w
+    if args.anytime:
+        fileName += "-anytime%s" % args.anytime.replace(",", "_")
+    fileName += "-p%d" % parallel_requests
+    if quick_goal:
+        fileName += "-quickGoal"
+    else:
+        fileName += "-slowGoal"
+    fileName += "-time%d-ans%d-triples%d" % (limit_time,
+                                             limit_ans,
+                                             limit_triples)
+    if args.resume:
+        fileName += "-resumed%d" % time()
+    fileName += ".ndjson" + COMPRESSION_EXTENSIONS[args.compress]
+
+    print("Writing log to %s" % fileName)
+    log = NDJSONWriter(fileName)
+    log.write({"run": run})
+    costModel = CostModel(args.cost_model) if args.cost_model else None
+
     try:
         print("Solving %s..." % query_name)
 
         print("Parameters:")
         print("  Algorithm:      %s" % ALGORITHM_N)
         print("  Quick-Goal:     %s" % quick_goal)
-        print("  Weight:         %d" % w)
+        print("  Weight:         %g" % w)
+        if args.anytime:
+            print("  Anytime:        %s" % args.anytime)
         print("  Pool Size:      %d" % parallel_requests)
+        print("  Fetcher:        %s" % FETCHER_N)
+        print("  Backend:        %s" % BACKEND_N)
+        print("  Cache:          %s" % args.cache)
+        if args.checkpoint  or  args.resume:
+            print("  Checkpoints:    %s (every %.0fs)" % (args.checkpoint or args.resume,
+                                                       args.checkpoint_interval))
+        if args.record:
+            print("  Recording to:   %s" % args.record)
+        if args.replay:
+            print("  Replaying:      %s (%s latency)" % (args.replay, args.replay_latency))
+        if args.max_nodes  or  args.max_rss:
+            print("  Memory bound:   %s NodeStates, %s MB" % (args.max_nodes, args.max_rss))
+        if args.spill:
+            print("  Open spills:    after %d NodeStates (to %s)" % (args.spill,
+                                                                   args.spill_dir or "temp"))
+        if costModel:
+            print("  Cost model:     %s (%s)" % (args.cost_model, costModel))
         print("  Limits:")
         print("    Time:    %ds" % limit_time)
         print("    Answers: %d"  % limit_ans)
         print("    Triples: %d"  % limit_triples)
 
         # Run search
-        search = ASLDSearch(query(w=w), quick_goal=quick_goal, alg=ALGORITHM)
+        options = {
+            "quick_goal":   quick_goal,
+            "alg":          ALGORITHM,
+            "fetcher":      FETCHER,
+            "parsers":      args.parsers,
+            "sparql_batch": args.sparql_batch,
+            "backend":      BACKEND,
+            "stream":       args.stream,
+            "pipeline":     not args.barriers,
+            "checkpoint_interval": args.checkpoint_interval,
+            "anytime":      [float(aw) for aw in args.anytime.split(",")] if args.anytime else None,
+            "max_nodes":    args.max_nodes,
+            "max_rss":      args.max_rss,
+            "spill":        args.spill,
+            "spill_dir":    args.spill_dir,
+            "bidirectional": args.bidirectional,
+            "cost_model":   costModel
+        }
+        if args.checkpoint:
+            options["checkpoint"] = args.checkpoint
+
+        if args.resume:
+            print("Resuming from %s" % args.resume)
+            search = ASLDSearch.resume(args.resume, **options)
+        else:
+            if sources:
+                print("Searching from %d sources" % len(sources))
+                search = ASLDSearch([query(URIRef(iri), w=w) for iri in sources], **options)
+            else:
+                search = ASLDSearch(query(w=w), **options)
 
         data = search.test(parallel_requests,
                            limit_time    = limit_time,
                            limit_ans     = limit_ans,
-                           limit_triples = limit_triples)
-        result["data"] = data
+                           limit_triples = limit_triples,
+                           log           = log)
+        result = {"PathCount": data["PathCount"], "Time": data["Time"]}
+        if "Sources" in data:
+            result["Sources"] = data["Sources"]
+        log.write({"result": result})
 
 
     except KeyboardInterrupt:
         Color.BLUE.print("\nTerminating search.")
 
     finally:
-        # Make sub-directory
-        results_directory = "bench/last/"
-        results_directory += "q%d-%s/" % (query_number, query_name)
-
-        results_directory += "p%d/" % parallel_requests
-        if quick_goal:
-            results_directory += "quick/"
-        else:
-            results_directory += "slow/"
-        os.makedirs(results_directory, mode=0o777, exist_ok=True)
-
-        # Save files
-        fileName = results_directory
-        fileName += "q%d--" % query_number
-        fileName += "%s" % ALGORITHM_N
-        fileName += "-w%d" % w
-        fileName += "-p%d" % parallel_requests
-        if quick_goal:
-            fileName += "-quickGoal"
-        else:
-            fileName += "-slowGoal"
-        fileName += "-time%d-ans%d-triples%d" % (limit_time,
-                                                 limit_ans,
-                                                 limit_triples)
-        fileName += ".json"
-
-        print("Writing log to %s" % fileName)
-        with open(fileName, 'w') as f:
-            dump(result, f, indent=2)
+        log.close()
+        if costModel:
+            costModel.save()
+            Color.BLUE.print("Saved request costs to %s (%s)" % (args.cost_model, costModel))
 
         if data:
             stats = data["StatsHistory"]
@@ -0,0 +1,83 @@
+#!/usr/bin/env python
+"""
+Command line interface for the search server (see asld.server)
+"""
+
+import argparse
+
+from asld.graph import ASLDGraph, Backend
+from asld.service import SearchService
+from asld.server import make_server
+from asld.utils.document_cache import DocumentCache
+from asld.utils.request_archive import RequestArchive, ArchiveMode, ReplayLatency
+from asld.utils import http_pool, host_scheduler
+
+from asld.utils.color_print import Color
+
+
+# Parse arguments
+# ===============
+parser = argparse.ArgumentParser(description='Serve queries over a shared graph and fetch pool')
+
+parser.add_argument('--port', metavar='n', type=int, default=8080,
+                    help='Port to listen on (localhost)')
+parser.add_argument('--socket', metavar='path', type=str, default=None,
+                    help='UNIX socket to listen on (instead of a port)')
+
+# Fetching
+parser.add_argument('--pool-size', metavar='p', type=int, default=200,
+                    help='Requests in flight, shared by every query')
+parser.add_argument('--parsers', metavar='n', type=int, default=2,
+                    help='Parsing processes')
+parser.add_argument('--backend', metavar='b', type=str, default="rdflib",
+                    help='Triple store: rdflib | native (dictionary-encoded)')
+parser.add_argument('--host-pool-size', metavar='n', type=int, default=http_pool.POOL_SIZE,
+                    help='Keep-alive connections per host')
+
+# Politeness
+parser.add_argument('--host-cap', metavar='n', type=int, default=None,
+                    help='Requests in flight per host (or SPARQL endpoint)')
+parser.add_argument('--host-rate', metavar='r', type=float, default=None,
+                    help='Requests per second per host (or SPARQL endpoint)')
+
+# Persistent cache
+parser.add_argument('--cache', metavar='dir', type=str, default=None,
+                    help='Directory for the persistent document cache')
+parser.add_argument('--cache-size', metavar='MB', type=int, default=1024,
+                    help='Cache size limit [MB]')
+parser.add_argument('--cache-ttl', metavar='t', type=int, default=7*24*3600,
+                    help='Time before cached documents are revalidated [s]')
+
+# Replay
+parser.add_argument('--replay', metavar='dir', type=str, default=None,
+                    help='Directory of a request archive to answer from (no network)')
+parser.add_argument('--replay-latency', metavar='l', type=str, default="recorded",
+                    help='recorded | modeled | zero')
+
+args = parser.parse_args()
+
+http_pool.configure(args.host_pool_size, {})
+host_scheduler.configure(args.host_cap, args.host_rate)
+
+if args.cache:
+    ASLDGraph.use_cache(DocumentCache(args.cache,
+                                      max_size=args.cache_size*1024*1024,
+                                      ttl=args.cache_ttl))
+if args.replay:
+    ASLDGraph.use_archive(RequestArchive(args.replay, ArchiveMode.Replay,
+                                         ReplayLatency.parse(args.replay_latency)))
+
+
+# Serve
+# =====
+service = SearchService(args.pool_size, parsers=args.parsers, backend=Backend.parse(args.backend))
+server = make_server(service, args.port, args.socket)
+
+Color.GREEN.print("Serving on %s" % (args.socket or "http://127.0.0.1:%d" % args.port))
+try:
+    server.serve_forever()
+except KeyboardInterrupt:
+    Color.BLUE.print("\nStopping server.")
+finally:
+    server.server_close()
+    service.close()
@@ -2,6 +2,11 @@
 Filesystem utils
 """
 from glob import iglob
+from itertools import chain
+from json import loads
+from jsonpickle import decode as json_decode
+
+from asld.utils.writers import open_text
 
 def get_files(pattern="*", directory="", recursive=True):
     """
@@ -22,6 +27,71 @@ def get_subdirs(directory=""):
 
 def get_json_files(directory=""):
     """
-    Finds all json files in a directory
+    Finds all json files (and NDJSON run logs) in a directory
+    """
+    return chain(get_files("**/*.json", directory),
+                 get_files("**/*.ndjson", directory),
+                 get_files("**/*.ndjson.gz", directory),
+                 get_files("**/*.ndjson.zst", directory))
+
+
+def read_ndjson(file_name):
+    """Yields the objects of an NDJSON file, stopping at a truncated tail"""
+    # pylint: disable=broad-except
+    with open_text(file_name, "r") as f:
+        try:
+            for line in f:
+                if not line.endswith("\n"):
+                    break
+                yield loads(line)
+        except Exception:  # Compressed streams may end mid block
+            return
+
+
+def load_run(file_name):
     """
-    return get_files("**/*.json", directory)
+    Loads a run dump: a JSON document, or an NDJSON run log (see
+      asld/utils/writers.py) rebuilt as one.
+    """
+    if file_name.endswith(".json"):
+        with open(file_name) as dump_file:
+            return json_decode(dump_file.read())
+
+    run = {}
+    steps = {}
+    paths = []
+    history = []
+    result = None
+    for record in read_ndjson(file_name):
+        if "stats" in record:
+            history.append(record["stats"])
+        elif "step" in record:
+            step = record["step"]
+            steps[step.pop("id")] = step
+        elif "path" in record:
+            paths.append(record["path"])
+        elif "run" in record:
+            run = record["run"]
+        elif "result" in record:
+            result = record["result"]
+
+    def path(k):
+        _path = []
+        while k is not None:
+            step = steps[k]
+            _path.append({key: v for (key, v) in step.items() if key != "parent"})
+            k = step["parent"]
+        _path.reverse()
+        return _path
+
+    if result is None:  # Killed run
+        result = {"PathCount": len(paths),
+                  "Time": history[-1]["wallClock"] if history else 0}
+
+    run["data"] = {
+        "Paths": [path(k) for k in paths],
+        "PathCount": result["PathCount"],
+        "StatsHistory": history,
+        "Time": result["Time"]
+    }
+    return run
@@ -5,13 +5,12 @@ Plot utils
 #pylint: disable=invalid-name
 import argparse
 import json
-from jsonpickle import decode as json_decode
 
 #pylint: disable=unused-import
 from matplotlib.pyplot import show, figure, plot, legend, title, xlabel, ylabel, savefig, close
 
 
-from fs import get_files, get_subdirs, get_json_files
+from fs import get_files, get_subdirs, get_json_files, load_run
 
 EXTENSION = "pdf"
 ALGORITHMS = ["AStar", "Dijkstra", "DFS"]
@@ -125,6 +124,7 @@ LABELS = {
     "expansions":        "Expansions",
     "local_expansions":  "Local expansions",
     "remote_expansions": "Requests",
+    "cache_hits":        "Cache hits",
     "batchID":           "Batch Number",
 
 
@@ -267,7 +267,7 @@ def save_fig(figure_path: str):
 
 def load_jsons(filenames):
     """
-    Loads JSON files as (dict, filename) pairs
+    Loads JSON files (and NDJSON run logs) as (dict, filename) pairs
     """
 
     filenames = iterable_strict_eval(filenames)
@@ -275,9 +275,7 @@ def load_jsons(filenames):
 
     for file_name in filenames:
         try:
-            with open(file_name) as dump_file:
-                data = json_decode(dump_file.read())
-                yield (data, file_name)
+            yield (load_run(file_name), file_name)
         except Exception as ex:
             print("Failed to load '%s' (%s)" % (file_name, ex))
 
@@ -379,7 +377,7 @@ def plot_query_parallelism(query_path, x_key, y_key, alg="AStar"):
     """
     if query_path[-1] != '/':
         query_path += '/'
-    bench_dumps_regex = "%s**/*%s*.json" % (query_path, alg)
+    bench_dumps_regex = "%s**/*%s*.*json*" % (query_path, alg)
 
     data = []
     for (dump, name) in load_jsons(get_files(bench_dumps_regex)):